@@ -0,0 +1,65 @@
+"""
+Content-addressed files on disk: scanned sheets kept for audit, the overlay images
+rendered from them and the disk tier of the detection cache. A blob's name is the SHA-256
+of what it was derived from, so it never changes once written; that name doubles as the
+HTTP ETag.
+"""
+import os, shutil, tempfile
+
+
+class BlobStore:
+    def __init__(self, directory: str, suffix: str = ""):
+        self.directory = directory
+        self.suffix = suffix
+
+    def path(self, sha: str) -> str:
+        return os.path.join(self.directory, sha[:2], sha + self.suffix)
+
+    def has(self, sha: str) -> bool:
+        return os.path.exists(self.path(sha))
+
+    def _tmp(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return tempfile.mkstemp(dir=os.path.dirname(path))
+
+    def put_bytes(self, sha: str, data: bytes) -> str:
+        path = self.path(sha)
+        if not os.path.exists(path):
+            fd, tmp = self._tmp(path)
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(data)
+            os.replace(tmp, path)   # atomic: readers never see a partial blob
+        return path
+
+    def put_file(self, sha: str, src: str) -> str:
+        """Keep a copy of `src`: a hard link when it is on the same filesystem, else a copy."""
+        path = self.path(sha)
+        if not os.path.exists(path):
+            fd, tmp = self._tmp(path)
+            os.close(fd)
+            os.remove(tmp)
+            try:
+                os.link(src, tmp)
+            except OSError:
+                shutil.copyfile(src, tmp)
+            os.replace(tmp, path)
+        return path
+
+
+KEEP_SCANS = os.environ.get("OMR_KEEP_SCANS", "1") not in ("0", "false", "no")
+
+scans = BlobStore(os.environ.get("OMR_SCAN_DIR", "./var/scans"))
+overlays = BlobStore(os.environ.get("OMR_OVERLAY_DIR", "./var/overlays"), ".jpg")
+
+
+def keep_scan(sha: str, source):
+    """Retain an evaluated scan (bytes or path) under its hash; best effort, never fails an evaluation."""
+    if not KEEP_SCANS or not sha:
+        return
+    try:
+        if isinstance(source, (bytes, bytearray)):
+            scans.put_bytes(sha, source)
+        else:
+            scans.put_file(sha, source)
+    except OSError:
+        pass
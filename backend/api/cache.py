@@ -0,0 +1,204 @@
+from collections import OrderedDict
+from sqlalchemy.orm import Session
+from . import models
+from .blobs import BlobStore
+import hashlib, os, threading, time
+
+
+class LRUCache:
+    """Thread-safe bounded LRU map with hit/miss accounting."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def peek(self, key):
+        """Value without touching recency or hit/miss counts."""
+        with self._lock:
+            return self._data.get(key)
+
+    def values(self) -> list:
+        with self._lock:
+            return list(self._data.values())
+
+    def pop(self, key):
+        with self._lock:
+            return self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0}
+
+
+class AnswerKeyCache:
+    """
+    Compiled answer keys per batch. Entries carry the key's version stamp; an upload in this
+    process invalidates immediately, and entries older than `revalidate_s` re-check the stored
+    version with a one-column query so other worker processes pick up new keys too.
+    """
+
+    def __init__(self, maxsize: int = 256, revalidate_s: float = 30.0):
+        self.lru = LRUCache(maxsize)
+        self.revalidate_s = revalidate_s
+
+    def get(self, db: Session, batch_id: int, loader):
+        entry = self.lru.get(batch_id)
+        now = time.monotonic()
+        if entry is not None:
+            key, checked = entry
+            if now - checked < self.revalidate_s:
+                return key
+            version = db.query(models.Result.version).filter(models.Result.batch_id == batch_id).scalar()
+            if version is not None and (version or 0) == key.version:
+                self.lru.put(batch_id, (key, now))
+                return key
+        key = loader(db, batch_id)
+        if key is not None:
+            self.lru.put(batch_id, (key, now))
+        return key
+
+    def put(self, batch_id: int, key):
+        self.lru.put(batch_id, (key, time.monotonic()))
+
+    def invalidate(self, batch_id: int):
+        self.lru.pop(batch_id)
+
+    def stats(self) -> dict:
+        return self.lru.stats()
+
+
+class StudentIndex:
+    """
+    Student ids and names per batch, and whether the batch has an imported roster, loaded
+    with one query the first time a batch is seen. Evaluations check and name students from
+    here instead of the database. Writes in this process update entries in place; entries
+    older than `revalidate_s` are reloaded so rosters imported by other worker processes show up.
+    """
+
+    def __init__(self, maxsize: int = 1024, revalidate_s: float = 30.0):
+        self.lru = LRUCache(maxsize)
+        self.revalidate_s = revalidate_s
+
+    def get(self, db: Session, batch_id: int):
+        """(students {student_id: name}, closed) where closed means only rostered students are accepted."""
+        entry = self.lru.get(batch_id)
+        if entry is not None and time.monotonic() - entry[2] < self.revalidate_s:
+            return entry[0], entry[1]
+        S = models.Student
+        students = {sid: name or "" for sid, name in db.query(S.student_id, S.name).filter(S.batch_id == batch_id)}
+        closed = db.query(models.Batch.roster_imported_at).filter(models.Batch.id == batch_id).scalar() is not None
+        self.lru.put(batch_id, (students, closed, time.monotonic()))
+        return students, closed
+
+    def update(self, batch_id: int, students: dict):
+        """Merge committed {student_id: name} rows into a loaded entry; a blank name keeps the known one."""
+        entry = self.lru.peek(batch_id)
+        if entry is not None:
+            known = entry[0]
+            for sid, name in students.items():
+                if name or sid not in known:
+                    known[sid] = name or ""
+
+    def invalidate(self, batch_id: int):
+        self.lru.pop(batch_id)
+
+    def stats(self) -> dict:
+        out = self.lru.stats()
+        out["students"] = sum(len(e[0]) for e in self.lru.values())
+        return out
+
+
+class DetectionCache:
+    """
+    Detection results (selection masks, plus review notes for flagged sheets; see
+    omr_eval.pack_detection) keyed by the SHA-256 of the uploaded image bytes, so a re-uploaded
+    sheet skips decoding and detection and is only re-scored. Hot entries live in a bounded LRU;
+    every entry is also written under `directory` so hits survive restarts and are shared by
+    worker processes. Entries are namespaced by detector version.
+    """
+
+    def __init__(self, directory: str, maxsize: int = 4096, version: str = "2"):
+        # entries are additionally namespaced by sheet template: the same bytes read under
+        # another layout give different selections
+        self.lru = LRUCache(maxsize)
+        self.directory = directory
+        self.version = version
+        self.disk_hits = 0
+        self._stores = {}
+
+    @staticmethod
+    def digest(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    def _store(self, template: str) -> BlobStore:
+        store = self._stores.get(template)
+        if store is None:
+            store = self._stores[template] = BlobStore(os.path.join(self.directory, f"v{self.version}", template), ".bin")
+        return store
+
+    def get(self, sha: str, template: str):
+        masks = self.lru.get((template, sha))
+        if masks is not None:
+            return masks
+        try:
+            with open(self._store(template).path(sha), "rb") as fh:
+                masks = fh.read()
+        except OSError:
+            return None
+        self.disk_hits += 1
+        self.lru.put((template, sha), masks)
+        return masks
+
+    def put(self, sha: str, template: str, masks: bytes):
+        self.lru.put((template, sha), masks)
+        try:
+            self._store(template).put_bytes(sha, masks)
+        except OSError:
+            pass   # disk tier is best effort
+
+    def stats(self) -> dict:
+        out = self.lru.stats()
+        out["disk_hits"] = self.disk_hits
+        lookups = out["hits"] + out["misses"]
+        out["hit_rate"] = round((out["hits"] + self.disk_hits) / lookups, 4) if lookups else 0.0
+        return out
+
+
+answer_keys = AnswerKeyCache(maxsize=int(os.environ.get("OMR_KEY_CACHE_SIZE", 256)),
+                             revalidate_s=float(os.environ.get("OMR_KEY_CACHE_REVALIDATE_S", 30)))
+
+detections = DetectionCache(os.environ.get("OMR_DETECTION_CACHE_DIR", "./var/detections"),
+                            maxsize=int(os.environ.get("OMR_DETECTION_CACHE_SIZE", 4096)))
+
+students = StudentIndex(maxsize=int(os.environ.get("OMR_STUDENT_INDEX_SIZE", 1024)),
+                        revalidate_s=float(os.environ.get("OMR_STUDENT_INDEX_REVALIDATE_S", 30)))
+
+# batch_id -> sheet template name; a batch's template never changes after creation
+batch_templates = LRUCache(int(os.environ.get("OMR_BATCH_TEMPLATE_CACHE_SIZE", 4096)))
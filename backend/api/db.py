@@ -1,14 +1,120 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
+from collections import deque
+from .metrics import SQLITE_COMMIT_SECONDS, SQLITE_LOCK_WAIT_SECONDS
+import os, threading, time
+
+SQLITE_URL = os.environ.get("OMR_SQLITE_URL", "sqlite:///./omrrr.db")
+BUSY_TIMEOUT_MS = int(os.environ.get("OMR_SQLITE_BUSY_MS", 10000))
 
-SQLITE_URL = "sqlite:///./omrrr.db"
 engine = create_engine(SQLITE_URL, connect_args={"check_same_thread": False})
+
+# Sessions that will write take SQLite's write lock up front (BEGIN IMMEDIATE). A deferred
+# transaction that reads and then writes fails with "database is locked" straight away when
+# another writer committed in between, without waiting on the busy timeout.
+write_engine = engine.execution_options(immediate=True)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+WriteSession = sessionmaker(autocommit=False, autoflush=False, bind=write_engine)
 Base = declarative_base()
 
+
+class DBStats:
+    """Commit latency and write-lock contention over a sliding window of transactions."""
+
+    def __init__(self, window: int = 2048):
+        self._lock = threading.Lock()
+        self.commit_s = deque(maxlen=window)
+        self.lock_wait_s = deque(maxlen=window)
+        self.commits = self.busy_errors = 0
+
+    def record_commit(self, seconds: float):
+        SQLITE_COMMIT_SECONDS.observe(seconds)
+        with self._lock:
+            self.commits += 1
+            self.commit_s.append(seconds)
+
+    def record_lock_wait(self, seconds: float):
+        SQLITE_LOCK_WAIT_SECONDS.observe(seconds)
+        with self._lock:
+            self.lock_wait_s.append(seconds)
+
+    def record_busy(self):
+        with self._lock:
+            self.busy_errors += 1
+
+    @staticmethod
+    def _ms(values) -> dict:
+        v = sorted(values)
+        if not v:
+            return {"count": 0}
+        return {"count": len(v), "mean_ms": round(1e3 * sum(v) / len(v), 3),
+                "p50_ms": round(1e3 * v[len(v) // 2], 3), "p95_ms": round(1e3 * v[int(len(v) * 0.95)], 3),
+                "max_ms": round(1e3 * v[-1], 3)}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"commits": self.commits, "busy_errors": self.busy_errors,
+                    "commit_latency": self._ms(self.commit_s), "write_lock_wait": self._ms(self.lock_wait_s)}
+
+
+db_stats = DBStats()
+
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        dbapi_conn.isolation_level = None   # transactions are begun explicitly below
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")          # readers never block the writer
+        cur.execute("PRAGMA synchronous=NORMAL")        # fsync at checkpoints, not every commit
+        cur.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        cur.execute("PRAGMA cache_size=-32768")         # 32 MB page cache per connection
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.close()
+
+    @event.listens_for(engine, "begin")
+    def _sqlite_begin(conn):
+        if conn.get_execution_options().get("immediate"):
+            t = time.perf_counter()
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+            db_stats.record_lock_wait(time.perf_counter() - t)
+        else:
+            conn.exec_driver_sql("BEGIN")
+
+
+@event.listens_for(engine, "handle_error")
+def _count_busy(ctx):
+    if "database is locked" in str(ctx.original_exception):
+        db_stats.record_busy()
+
+
+@event.listens_for(SessionLocal, "before_commit")
+@event.listens_for(WriteSession, "before_commit")
+def _commit_started(session):
+    session.info["commit_t"] = time.perf_counter()
+
+
+@event.listens_for(SessionLocal, "after_commit")
+@event.listens_for(WriteSession, "after_commit")
+def _commit_done(session):
+    t = session.info.pop("commit_t", None)
+    if t is not None:
+        db_stats.record_commit(time.perf_counter() - t)
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+def get_write_db():
+    """Session for endpoints that read and then write; see write_engine."""
+    db = WriteSession()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -0,0 +1,351 @@
+from sqlalchemy import update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from backend.eval.omr_eval import evaluate_omr_image, estimate_decode_bytes, pack_detection, unpack_detection
+from backend.eval.templates import DEFAULT_TEMPLATE, SheetTemplate, get_template
+from backend.eval.scoring import CompiledKey, LABELS, align, compile_answer_key, key_from_bytes, mask_to_str, score_masks
+from . import models, schemas
+from . import stats
+from .cache import answer_keys, batch_templates, detections, students as student_index
+from .blobs import keep_scan
+from .uploads import hash_file, inflight
+from .writer import BatchWriter
+from .metrics import stage
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+import hashlib, json
+import numpy as np
+
+
+class MissingAnswerKey(ValueError):
+    """The batch has no official result yet; the evaluation can be retried once one is uploaded."""
+
+
+class UnknownStudent(ValueError):
+    """The batch has an imported roster and the student is not on it."""
+
+
+def _upsert(table, keys, update, where=None):
+    """INSERT ... ON CONFLICT(keys) DO UPDATE SET `update` columns, built once and reused for executemany."""
+    stmt = sqlite_insert(table)
+    return stmt.on_conflict_do_update(index_elements=keys, set_={c: stmt.excluded[c] for c in update},
+                                      where=where(table, stmt.excluded) if where else None)
+
+
+_UPSERT_STUDENT = _upsert(models.Student.__table__, ["batch_id", "student_id"], ["name"])
+_UPSERT_RESULT = _upsert(models.FinalResult.__table__, ["batch_id", "student_id"],
+                         [c.name for c in models.FinalResult.__table__.c if c.name not in ("id", "batch_id", "student_id")])
+
+
+def check_student(db: Session, meta: schemas.StudentMeta) -> schemas.StudentMeta:
+    """
+    Validate the student against the batch's in-memory index and fill in their rostered name.
+    Raises UnknownStudent for ids missing from an imported roster; other batches accept anyone.
+    """
+    known, closed = student_index.get(db, meta.batch_id)
+    name = known.get(meta.student_id)
+    if name is None and closed:
+        raise UnknownStudent(f"Student {meta.student_id} is not on the roster of batch {meta.batch_id}")
+    if not meta.name and name:
+        meta.name = name
+    return meta
+
+
+def upsert_students(db: Session, metas: List[schemas.StudentMeta]):
+    """
+    Create or rename the students of these evaluations with one executemany upsert. Students
+    the index already has under the same name are not written at all; a missing name never
+    blanks a stored one.
+    """
+    rows = {}
+    for m in metas:
+        name = student_index.get(db, m.batch_id)[0].get(m.student_id)
+        if name is None or (m.name and m.name != name):
+            rows[(m.batch_id, m.student_id)] = {
+                "student_id": m.student_id, "name": m.name or name or "", "college_id": m.college_id,
+                "batch_id": m.batch_id, "meta": json.dumps({"source": "OMR Evaluation"})}
+    if rows:
+        db.execute(_UPSERT_STUDENT, list(rows.values()))
+
+
+def _index_students(graded: List["Graded"]):
+    """Writer callback: once committed, the students of these evaluations are known."""
+    by_batch = {}
+    for g in graded:
+        by_batch.setdefault(g.meta.batch_id, {})[g.meta.student_id] = g.meta.name
+    for batch_id, names in by_batch.items():
+        student_index.update(batch_id, names)
+
+
+def import_roster(db: Session, batch: models.Batch, roster: dict) -> dict:
+    """
+    Upsert {student_id: name} into the batch in one transaction and close the batch to
+    students not on it. Existing students are renamed (a blank name keeps theirs), never removed.
+    """
+    known, _ = student_index.get(db, batch.id)
+    rows = [{"student_id": sid, "name": name or known.get(sid, ""), "college_id": batch.college_id,
+             "batch_id": batch.id, "meta": json.dumps({"source": "Roster import"})} for sid, name in roster.items()]
+    db.execute(_UPSERT_STUDENT, rows)
+    batch.roster_imported_at = datetime.utcnow()
+    db.commit()
+    student_index.invalidate(batch.id)
+    created = sum(sid not in known for sid in roster)
+    return {"students": len(rows), "created": created, "updated": len(rows) - created}
+
+
+def _read_answer_key(db: Session, batch_id: int):
+    official = db.query(models.Result).filter(models.Result.batch_id == batch_id).first()
+    if not official:
+        return None
+    if official.key_masks is None:
+        return compile_answer_key(json.loads(official.raw_json), official.version or 0)
+    return key_from_bytes(official.key_masks, official.version or 0)
+
+
+def template_for_batch(db: Session, batch_id: int) -> SheetTemplate:
+    name = batch_templates.get(batch_id)
+    if name is None:
+        name = db.query(models.Batch.template).filter(models.Batch.id == batch_id).scalar() or DEFAULT_TEMPLATE
+        batch_templates.put(batch_id, name)
+    return get_template(name)
+
+
+def load_answer_key(db: Session, batch_id: int):
+    """Compiled answer key for the batch, or None if no official result was uploaded."""
+    return answer_keys.get(db, batch_id, _read_answer_key)
+
+
+def build_result(meta: schemas.StudentMeta, key: CompiledKey, masks: np.ndarray, correct: np.ndarray,
+                 review: Optional[dict] = None) -> dict:
+    labels = [mask_to_str(m) for m in key.masks.tolist()]
+    evaluated = [{
+        "question": q + 1,
+        "correct_answer": labels[q] if q < len(labels) else "",
+        "student_answer": LABELS[m] or "Not Attempted",
+        "is_correct": c
+    } for q, (m, c) in enumerate(zip(masks.tolist(), correct.tolist()))]
+
+    return {
+        "student_id": meta.student_id,
+        "name": meta.name or "",
+        "batch_id": meta.batch_id,
+        "score": int(correct.sum()),
+        "total": len(masks),
+        "answers": evaluated,
+        "needs_review": review is not None,
+        "review": review,
+    }
+
+
+class Graded(NamedTuple):
+    meta: schemas.StudentMeta
+    key: CompiledKey
+    masks: np.ndarray      # (Q,) uint8 selections aligned to the key
+    correct: np.ndarray    # (Q,) bool
+    image_sha: Optional[str] = None   # content hash of the scanned sheet
+    review: Optional[dict] = None     # why the sheet needs a manual look; None when it does not
+
+    def result(self) -> dict:
+        return build_result(self.meta, self.key, self.masks, self.correct, self.review)
+
+    def row_values(self) -> dict:
+        """Columnar FinalResult values: one byte per answer, one bit per correctness flag."""
+        return {
+            "college_id": self.meta.college_id,
+            "batch_id": self.meta.batch_id,
+            "student_id": self.meta.student_id,
+            "name": self.meta.name or "",
+            "score": int(self.correct.sum()),
+            "total": len(self.masks),
+            "answers": self.masks.tobytes(),
+            "correct": pack_correct(self.correct),
+            "key_version": self.key.version,
+            "image_sha": self.image_sha,
+            "review": json.dumps(self.review) if self.review else None,
+        }
+
+
+def pack_correct(correct: np.ndarray) -> bytes:
+    return np.packbits(correct, axis=-1).tobytes()
+
+
+def unpack_correct(blob: bytes, n: int) -> np.ndarray:
+    return np.unpackbits(np.frombuffer(blob, dtype=np.uint8), count=n).astype(bool)
+
+
+def score_answers(meta: schemas.StudentMeta, key: CompiledKey, masks: np.ndarray, image_sha: str = None,
+                  review: dict = None) -> Graded:
+    masks = align(masks, len(key.masks))
+    return Graded(meta, key, masks, score_masks(key, masks), image_sha, review)
+
+
+def score_many(metas, key: CompiledKey, masks: np.ndarray, image_shas=None, reviews=None) -> List[Graded]:
+    """Score an (N, Q) matrix of selections in one compare."""
+    masks = align(masks, len(key.masks))
+    correct = score_masks(key, masks)
+    shas = image_shas or [None] * len(metas)
+    reviews = reviews or [None] * len(metas)
+    return [Graded(m, key, masks[i], correct[i], shas[i], reviews[i]) for i, m in enumerate(metas)]
+
+
+def store_results(db: Session, graded: List[Graded]):
+    """
+    Upsert one row per (batch, student) and fold the change into the batch statistics.
+    A re-evaluated student replaces their previous row, whose contribution is subtracted.
+    """
+    F = models.FinalResult
+    by_batch = {}
+    for g in graded:
+        by_batch.setdefault(g.meta.batch_id, {})[g.meta.student_id] = g   # last sheet per student wins
+    for batch_id, group in by_batch.items():
+        version = db.query(models.Result.version).filter(models.Result.batch_id == batch_id).scalar()
+        if version is not None and any(g.key.version != version for g in group.values()):
+            # the key was corrected while these sheets were being read; score against the stored one
+            key = _read_answer_key(db, batch_id)
+            group = {sid: score_answers(g.meta, key, g.masks, g.image_sha, g.review) for sid, g in group.items()}
+        st = stats.get_or_rebuild(db, batch_id)
+        removed = [stats.snapshot(r) for r in db.query(F.score, F.answers, F.correct).filter(
+            F.batch_id == batch_id, F.student_id.in_(list(group)), F.answers.isnot(None))]
+        added = [dict(g.row_values(), aggregated_json=None, created_at=datetime.utcnow()) for g in group.values()]
+        db.execute(_UPSERT_RESULT, added)
+        stats.apply(st, added=added, removed=removed)
+
+
+def rescore_batch(db: Session, batch_id: int, old: Optional[CompiledKey], new: CompiledKey) -> dict:
+    """
+    Re-score a batch's stored selections against a corrected key, without touching scans.
+    Rows scored against `old` only recompute the questions whose key entry changed; rows
+    scored against any other version are recomputed in full. Only rows whose correctness
+    changed are written, and their contribution to the batch statistics is swapped.
+    """
+    F = models.FinalResult
+    q = len(new.masks)
+    changed = np.arange(q) if old is None else np.flatnonzero(align(old.masks, q) != new.masks)
+    st = stats.get_or_rebuild(db, batch_id)   # before any row changes, or a rebuild would count them twice
+    rows = db.query(F.id, F.key_version, F.score, F.answers, F.correct).filter(
+        F.batch_id == batch_id, F.answers.isnot(None)).all()
+    if not rows:
+        return {"questions": (changed + 1).tolist(), "rows": 0}
+
+    masks = np.zeros((len(rows), q), dtype=np.uint8)
+    correct = np.zeros((len(rows), q), dtype=bool)
+    resized = np.zeros(len(rows), dtype=bool)
+    for i, r in enumerate(rows):
+        a = np.frombuffer(r.answers, dtype=np.uint8)[:q]
+        masks[i, :len(a)] = a
+        correct[i, :len(a)] = unpack_correct(r.correct, len(r.answers))[:q]
+        resized[i] = len(r.answers) != q
+    rescored = correct.copy()
+    if len(changed):
+        rescored[:, changed] = score_masks(CompiledKey(new.masks[changed]), masks[:, changed])
+    stale = np.array([old is None or (r.key_version or 0) != old.version for r in rows])
+    if stale.any():
+        rescored[stale] = score_masks(new, masks[stale])
+
+    dirty = np.flatnonzero((rescored != correct).any(1) | resized)
+    updates = [{"id": rows[i].id, "score": int(rescored[i].sum()), "total": q, "answers": masks[i].tobytes(),
+                "correct": pack_correct(rescored[i])} for i in dirty.tolist()]
+    if updates:
+        db.execute(update(F), updates)   # executemany UPDATE ... WHERE id = ?
+        stats.apply(st, added=updates, removed=[stats.snapshot(rows[i]) for i in dirty.tolist()])
+    db.query(F).filter(F.batch_id == batch_id).update({F.key_version: new.version}, synchronize_session=False)
+    return {"questions": (changed + 1).tolist(), "rows": len(updates)}
+
+
+def store_answer_key(db: Session, batch_id: int, answer_key: dict) -> dict:
+    """Store a batch's official key, bump its version and re-score stored results, in one transaction."""
+    key_masks = compile_answer_key(answer_key).masks.tobytes()
+    raw = json.dumps(answer_key, sort_keys=True)
+    existing = db.query(models.Result).filter(models.Result.batch_id == batch_id).first()
+    old = _read_answer_key(db, batch_id)
+    if existing:
+        existing.raw_json = raw
+        existing.key_masks = key_masks
+        existing.version = (existing.version or 0) + 1
+    else:
+        existing = models.Result(batch_id=batch_id, college_id=1, raw_json=raw, key_masks=key_masks, version=1)
+        db.add(existing)
+    db.flush()
+    new = key_from_bytes(key_masks, existing.version)
+    rescored = rescore_batch(db, batch_id, old, new)
+    db.commit()
+    answer_keys.put(batch_id, new)
+    return rescored
+
+
+def write_graded(db: Session, graded: List[Graded]):
+    """Everything an evaluation writes: its student and its result row, in the caller's transaction."""
+    upsert_students(db, [g.meta for g in graded])
+    store_results(db, graded)
+
+
+# every evaluation path commits through this one writer thread; see writer.py
+result_writer = BatchWriter(write_graded, after_commit=_index_students)
+
+
+def overlay_url(result_id: int) -> str:
+    return f"/api/results/{result_id}/overlay"
+
+
+def with_reference(result: dict, result_id: Optional[int], image_sha: Optional[str]) -> dict:
+    """Results point at their audit overlay instead of carrying it."""
+    result["result_id"] = result_id
+    result["overlay_url"] = overlay_url(result_id) if result_id is not None and image_sha else None
+    return result
+
+
+def overlay_digest(row, template: SheetTemplate, key: Optional[CompiledKey]) -> str:
+    """Content hash of everything the overlay of a stored row is drawn from."""
+    from backend.eval.overlay import VERSION
+    h = hashlib.sha256(f"{VERSION}:{row.image_sha}:{template.name}:".encode())
+    for part in (row.answers, row.correct, key.masks.tobytes() if key is not None else b""):
+        h.update(len(part or b"").to_bytes(4, "big") + (part or b""))
+    return h.hexdigest()
+
+
+def result_from_row(row, key: CompiledKey) -> dict:
+    """Rebuild the full per-question result of a stored row."""
+    if row.answers is None:   # legacy row the migration could not convert
+        return json.loads(row.aggregated_json)
+    masks = np.frombuffer(row.answers, dtype=np.uint8)
+    meta = schemas.StudentMeta(student_id=row.student_id, name=row.name, college_id=row.college_id or 0,
+                               batch_id=row.batch_id)
+    return with_reference(build_result(meta, key if key is not None else CompiledKey(np.zeros(0, np.uint8)),
+                                       masks, unpack_correct(row.correct, len(masks)),
+                                       json.loads(row.review) if row.review else None), row.id, row.image_sha)
+
+
+def evaluate_upload(db: Session, meta: schemas.StudentMeta, source, sha: str = None) -> dict:
+    """
+    Full single-sheet pipeline shared by the synchronous endpoint and the job workers.
+    `source` is the sheet as bytes or a file path; pass `sha` when the caller already hashed it.
+    Raises MissingAnswerKey, or ValueError for sheets that cannot be read.
+    """
+    with stage("load_key"):
+        answer_key = load_answer_key(db, meta.batch_id)
+        if answer_key is None:
+            raise MissingAnswerKey("Upload official result first.")
+        template = template_for_batch(db, meta.batch_id)
+        db.commit()   # end the read transaction; nothing is held open during detection
+
+    if sha is None:
+        with stage("hash"):
+            sha = detections.digest(source) if isinstance(source, bytes) else hash_file(source)
+    entry = detections.get(sha, template.name)
+    if entry is None:
+        with inflight.reserve(estimate_decode_bytes(source)):
+            omr_result = evaluate_omr_image(source, meta, answer_key, template)
+        entry = pack_detection(omr_result["selection_masks"], omr_result["audit"]["review"])
+        detections.put(sha, template.name, entry)
+    masks, review = unpack_detection(entry, template.questions)
+    with stage("keep_scan"):
+        keep_scan(sha, source)   # a hard link to the spooled upload; the overlay is drawn from it on request
+    with stage("score"):
+        graded = score_answers(meta, answer_key, masks, image_sha=sha, review=review)
+    with stage("db_write"):
+        result_writer.write([graded])   # student + result + stats in one transaction, grouped with concurrent evaluations
+        F = models.FinalResult
+        result_id = db.query(F.id).filter(F.batch_id == meta.batch_id, F.student_id == meta.student_id).scalar()
+        db.commit()
+    with stage("build_result"):
+        return with_reference(graded.result(), result_id, sha)
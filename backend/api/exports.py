@@ -0,0 +1,93 @@
+from .db import SessionLocal
+from . import models
+import csv, io
+import numpy as np
+
+SUMMARY_COLUMNS = ("student_id", "name", "batch_id", "score", "total", "needs_review")
+EXPORT_CHUNK = 1000
+
+
+def summary_query(db, batch_id: int):
+    """Projection of the scalar columns only; per-question blobs are never read."""
+    F = models.FinalResult
+    return db.query(F.id, F.student_id, F.name, F.batch_id, F.score, F.total,
+                    F.review.isnot(None).label("needs_review")).filter(F.batch_id == batch_id)
+
+
+def _rows(batch_id: int, n_questions: int, with_answers: bool):
+    """Yield lists of export rows, EXPORT_CHUNK at a time, from a dedicated session."""
+    from backend.eval.scoring import LABELS
+    db = SessionLocal()
+    try:
+        F = models.FinalResult
+        cols = [F.student_id, F.name, F.batch_id, F.score, F.total, F.review.isnot(None)] + \
+               ([F.answers] if with_answers else [])
+        q = db.query(*cols).filter(F.batch_id == batch_id).order_by(F.id).yield_per(EXPORT_CHUNK)
+        n = len(SUMMARY_COLUMNS)
+        chunk = []
+        for r in q:
+            row = list(r[:n])
+            if with_answers:
+                labels = [LABELS[m] for m in np.frombuffer(r[n] or b"", dtype=np.uint8).tolist()]
+                row += (labels + [""] * n_questions)[:n_questions]
+            chunk.append(row)
+            if len(chunk) >= EXPORT_CHUNK:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        db.close()
+
+
+def csv_stream(batch_id: int, n_questions: int, with_answers: bool = False):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(list(SUMMARY_COLUMNS) + ([f"q{i+1}" for i in range(n_questions)] if with_answers else []))
+    for chunk in _rows(batch_id, n_questions, with_answers):
+        writer.writerows(chunk)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+class _Drain:
+    """Minimal writable sink that hands bytes back to the response as row groups complete."""
+    def __init__(self):
+        self.parts, self.pos, self.closed = [], 0, False
+
+    def write(self, b):
+        self.parts.append(bytes(b))
+        self.pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        out, self.parts = b"".join(self.parts), []
+        return out
+
+
+def parquet_stream(batch_id: int, n_questions: int, with_answers: bool = False):
+    import pyarrow as pa, pyarrow.parquet as pq
+    names = list(SUMMARY_COLUMNS) + ([f"q{i+1}" for i in range(n_questions)] if with_answers else [])
+    types = [pa.string(), pa.string(), pa.int64(), pa.int64(), pa.int64(), pa.bool_()]
+    types += [pa.string()] * (len(names) - len(types))
+    schema = pa.schema(list(zip(names, types)))
+    sink = _Drain()
+    writer = pq.ParquetWriter(sink, schema)
+    for chunk in _rows(batch_id, n_questions, with_answers):
+        cols = [list(c) for c in zip(*chunk)]
+        writer.write_table(pa.table(cols, schema=schema))   # one row group per chunk
+        yield sink.take()
+    writer.close()
+    yield sink.take()
@@ -0,0 +1,181 @@
+"""
+Opt-in asynchronous evaluation backed by the eval_jobs table: no external broker.
+
+Uploads are spooled to OMR_JOB_DIR and a row is queued. Workers (threads started with the
+API, or standalone processes via `python -m backend.api.jobs`) claim rows with a guarded
+UPDATE, so each job runs once; a claim holds a lease, and a job whose worker died is
+picked up again when the lease expires. Failures are retried with exponential backoff
+up to max_attempts; unreadable sheets fail immediately.
+"""
+from sqlalchemy import func, or_, and_
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+from typing import Optional
+from .db import SessionLocal, WriteSession
+from . import models, schemas, evaluation
+from .metrics import SHEETS
+import json, logging, os, socket, threading, time
+
+log = logging.getLogger(__name__)
+
+JOB_DIR = os.environ.get("OMR_JOB_DIR", "./var/jobs")
+LEASE_S = float(os.environ.get("OMR_JOB_LEASE_S", 120))
+POLL_S = float(os.environ.get("OMR_JOB_POLL_S", 1.0))
+TERMINAL = ("done", "failed")
+
+_wakeup = threading.Event()
+
+
+def enqueue(meta: schemas.StudentMeta, sheet) -> dict:
+    """
+    Queue an already spooled sheet (see uploads.spool_upload with directory=JOB_DIR, keep=True)
+    in its own write transaction; returns the new job's status.
+    """
+    with WriteSession() as db:
+        job = models.EvalJob(batch_id=meta.batch_id, student_meta=json.dumps(meta.dict()), upload_path=sheet.path)
+        db.add(job)
+        db.commit()
+        status = job_status(job)
+    _wakeup.set()
+    return status
+
+
+def job_status(job: models.EvalJob) -> dict:
+    return {
+        "id": job.id,
+        "status": job.status,
+        "attempts": job.attempts or 0,
+        "error": job.error,
+        "result": json.loads(job.result_json) if job.result_json else None,
+    }
+
+
+def queue_depth(db: Session) -> dict:
+    counts = dict(db.query(models.EvalJob.status, func.count()).group_by(models.EvalJob.status).all())
+    return {s: counts.get(s, 0) for s in ("queued", "running", "done", "failed")}
+
+
+def claim(worker: str) -> Optional[int]:
+    """
+    Atomically take the next runnable job (queued and due, or running with an expired lease)
+    and return its id. Candidates are found on a read session, so an idle poll never takes the
+    write lock; only the guarded UPDATE does.
+    """
+    J = models.EvalJob
+    now = datetime.utcnow()
+    runnable = or_(and_(J.status == "queued", J.not_before <= now),
+                   and_(J.status == "running", J.lease_until < now))
+    with SessionLocal() as db:
+        candidates = [job_id for job_id, in db.query(J.id).filter(runnable).order_by(J.id).limit(8)]
+    if not candidates:
+        return None
+    with WriteSession() as db:
+        for job_id in candidates:
+            taken = db.query(J).filter(J.id == job_id, runnable).update(
+                {J.status: "running", J.worker: worker, J.attempts: J.attempts + 1,
+                 J.lease_until: now + timedelta(seconds=LEASE_S), J.updated_at: now},
+                synchronize_session=False)
+            db.commit()
+            if taken:
+                return job_id
+    return None
+
+
+def _finish(db: Session, job: models.EvalJob, status: str, error: str = None, result: dict = None):
+    job.status, job.error, job.updated_at = status, error, datetime.utcnow()
+    job.lease_until = None
+    if result is not None:
+        job.result_json = json.dumps(result)
+    db.commit()
+    if status in TERMINAL and job.upload_path:
+        try:
+            os.remove(job.upload_path)
+        except OSError:
+            pass
+
+
+def run_job(db: Session, job: models.EvalJob):
+    meta = schemas.StudentMeta(**json.loads(job.student_meta))
+    try:
+        if (job.attempts or 0) > (job.max_attempts or 1):
+            raise RuntimeError("Worker lost too many times")
+        result = evaluation.evaluate_upload(db, meta, job.upload_path)
+    except evaluation.MissingAnswerKey as e:
+        _retry(db, job, str(e))
+    except ValueError as e:
+        db.rollback()
+        SHEETS.inc(path="job", status="error")
+        _finish(db, job, "failed", str(e))
+    except Exception as e:
+        log.exception("evaluation job %s failed", job.id)
+        _retry(db, job, f"{type(e).__name__}: {e}")
+    else:
+        SHEETS.inc(path="job", status="ok")
+        summary = {k: result[k] for k in ("student_id", "name", "batch_id", "score", "total")}
+        _finish(db, job, "done", result=summary)
+
+
+def _retry(db: Session, job: models.EvalJob, error: str):
+    db.rollback()
+    if (job.attempts or 0) >= (job.max_attempts or 1):
+        _finish(db, job, "failed", error)
+        return
+    job.status, job.error = "queued", error
+    job.not_before = datetime.utcnow() + timedelta(seconds=2 ** (job.attempts or 0))
+    job.lease_until = None
+    db.commit()
+
+
+def work(stop: threading.Event, name: str):
+    """Worker loop: drain the queue, then sleep until woken by an enqueue or the poll interval."""
+    while not stop.is_set():
+        try:
+            job_id = claim(name)
+            if job_id is not None:
+                with WriteSession() as db:   # status updates read then write
+                    run_job(db, db.get(models.EvalJob, job_id))
+                continue
+        except Exception:
+            log.exception("job worker %s error", name)
+        _wakeup.wait(POLL_S)
+        _wakeup.clear()
+
+
+class WorkerPool:
+    def __init__(self, size: int):
+        self.size = size
+        self.stop = threading.Event()
+        self.threads = []
+
+    def start(self):
+        self.stop = threading.Event()
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        for i in range(self.size):
+            t = threading.Thread(target=work, args=(self.stop, f"{prefix}:{i}"), daemon=True, name=f"omr-job-{i}")
+            t.start()
+            self.threads.append(t)
+
+    def shutdown(self, timeout: float = 5.0):
+        self.stop.set()
+        _wakeup.set()
+        for t in self.threads:
+            t.join(timeout)
+        self.threads = []
+
+
+workers = WorkerPool(int(os.environ.get("OMR_JOB_WORKERS", 2)))
+
+
+if __name__ == "__main__":
+    # Standalone worker process: python -m backend.api.jobs
+    from .db import engine
+    from .migrations import upgrade
+    logging.basicConfig(level=logging.INFO)
+    upgrade(engine)
+    pool = WorkerPool(int(os.environ.get("OMR_JOB_WORKERS", 2)))
+    pool.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.shutdown()
@@ -1,9 +1,48 @@
-from fastapi import FastAPI
-from . import models
+from .warmup import readiness   # first: it timestamps the start of the API's cold start
+from fastapi import FastAPI, Request
 from .db import engine
+from .migrations import upgrade
 from .routes import router
+from .jobs import workers
+from .evaluation import result_writer
+from .metrics import IN_FLIGHT, REQUESTS, REQUEST_SECONDS, profiler
+from backend.eval.pool import shutdown_pool
+import os, time
 
-models.Base.metadata.create_all(bind=engine)
+# backend.serve migrates once before starting its workers, which then skip this
+if not os.environ.get("OMR_SKIP_MIGRATIONS"):
+    upgrade(engine)
 
 app = FastAPI(title="OMR Evaluation API")
 app.include_router(router, prefix="/api")
+
+@app.middleware("http")
+async def _record_request(request: Request, call_next):
+    IN_FLIGHT.inc()
+    t = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        IN_FLIGHT.inc(-1)
+        # label by route template, not raw path, so ids do not explode the series count
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        REQUEST_SECONDS.observe(time.perf_counter() - t, method=request.method, route=route)
+        REQUESTS.inc(method=request.method, route=route, status=status)
+        readiness.record_request(route, time.perf_counter() - t)
+
+@app.on_event("startup")
+def _start_job_workers():
+    readiness.warm()   # before the server accepts connections; see backend.api.warmup
+    workers.start()
+    if os.environ.get("OMR_PROFILE"):
+        profiler.start(float(os.environ.get("OMR_PROFILE_INTERVAL_MS", 5)) / 1000)
+
+@app.on_event("shutdown")
+def _stop_background_workers():
+    workers.shutdown()
+    result_writer.shutdown()
+    shutdown_pool()
+    profiler.stop()
@@ -0,0 +1,246 @@
+"""
+Process metrics in the Prometheus text format, served at /api/metrics.
+
+Counters and histograms are updated where the work happens (request middleware, stage()
+timers around upload, decode, detection, scoring, serialization and SQLite commits);
+queue depths and cache ratios are read from their owners at scrape time. A sampling
+profiler can be switched on at runtime to collect collapsed stacks for flame graphs.
+"""
+from collections import Counter as _Tally
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence
+import bisect, os, sys, threading, time
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ""
+    esc = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, esc)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"] + \
+               [f"{self.name}{_labels(self.labels, k)} {v}" for k, v in items]
+
+
+class Gauge(Counter):
+    def set(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, tuple(labels), tuple(buckets)
+        self._series: Dict[tuple, list] = {}   # key -> [count per bucket..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):   # above the last bucket only counts towards +Inf
+                s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, s in items:
+            cum = 0
+            for le, n in zip(self.buckets, s):
+                cum += n
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), key + (le,))} {cum}")
+            lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), key + ('+Inf',))} {s[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {s[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {s[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors: List[Callable[[], List[str]]] = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, fn: Callable[[], List[str]]):
+        """fn() returns exposition lines for values read at scrape time."""
+        self.collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines = []
+        for m in self.metrics:
+            lines += m.render()
+        for fn in self.collectors:
+            try:
+                lines += fn()
+            except Exception as e:   # one broken source must not take the endpoint down
+                lines.append(f"# collector {fn.__name__} failed: {type(e).__name__}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUESTS = registry.add(Counter("omr_http_requests_total", "HTTP requests by route and status.",
+                                ["method", "route", "status"]))
+REQUEST_SECONDS = registry.add(Histogram("omr_http_request_duration_seconds",
+                                         "Time to response headers by route.", ["method", "route"]))
+IN_FLIGHT = registry.add(Gauge("omr_http_requests_in_flight", "Requests currently being handled."))
+STAGE_SECONDS = registry.add(Histogram("omr_stage_duration_seconds", "Time spent per evaluation stage.", ["stage"]))
+SHEETS = registry.add(Counter("omr_sheets_total", "Sheets evaluated by entry point and outcome.", ["path", "status"]))
+SQLITE_COMMIT_SECONDS = registry.add(Histogram("omr_sqlite_commit_duration_seconds", "Session commit latency."))
+SQLITE_LOCK_WAIT_SECONDS = registry.add(Histogram("omr_sqlite_lock_wait_seconds",
+                                                  "Time waiting for the SQLite write lock (BEGIN IMMEDIATE)."))
+COLD_START_SECONDS = registry.add(Gauge("omr_cold_start_seconds", "Module import to ready, this process."))
+WARMUP_SECONDS = registry.add(Gauge("omr_warmup_step_seconds", "Duration of each startup warm-up step.", ["step"]))
+FIRST_REQUEST_SECONDS = registry.add(Gauge("omr_first_request_seconds", "Latency of the first non-probe request.", ["route"]))
+
+
+def stage(name: str):
+    """`with stage("decode"): ...` records the block's duration under omr_stage_duration_seconds."""
+    return STAGE_SECONDS.time(stage=name)
+
+
+def _sample_lines(name: str, help: str, samples, kind: str = "gauge") -> List[str]:
+    return [f"# HELP {name} {help}", f"# TYPE {name} {kind}"] + \
+           [f"{name}{_labels(tuple(l), tuple(l.values()))} {v}" for l, v in samples]
+
+
+@registry.collector
+def _runtime():
+    from .cache import answer_keys, batch_templates, detections, students
+    from .db import SessionLocal, db_stats
+    from .evaluation import result_writer
+    from .uploads import inflight
+    from . import jobs
+    from backend.eval.pool import pool_size
+
+    caches = {"answer_keys": answer_keys.stats(), "detections": detections.stats(),
+              "batch_templates": batch_templates.stats(), "students": students.stats()}
+    with SessionLocal() as db:
+        depth = jobs.queue_depth(db)
+    sql = db_stats.stats()
+    decode = inflight.stats()
+    return (
+        _sample_lines("omr_cache_hits_total", "Cache hits.", [({"cache": c}, s["hits"]) for c, s in caches.items()], "counter")
+        + _sample_lines("omr_cache_misses_total", "Cache misses.", [({"cache": c}, s["misses"]) for c, s in caches.items()], "counter")
+        + _sample_lines("omr_cache_hit_ratio", "Hits over lookups since start.", [({"cache": c}, s["hit_rate"]) for c, s in caches.items()])
+        + _sample_lines("omr_cache_entries", "Entries held in memory.", [({"cache": c}, s["size"]) for c, s in caches.items()])
+        + _sample_lines("omr_job_queue_depth", "Evaluation jobs by status.", [({"status": k}, v) for k, v in depth.items()])
+        + _sample_lines("omr_write_queue_depth", "Evaluations waiting for the result writer.",
+                       [({}, result_writer.stats()["queued"])])
+        + _sample_lines("omr_decode_memory_bytes", "Decode memory budget.",
+                       [({"state": "in_use"}, decode["in_use"]), ({"state": "limit"}, decode["limit"])])
+        + _sample_lines("omr_decode_waiting", "Decodes waiting for memory budget.", [({}, decode["waiting"])])
+        + _sample_lines("omr_sqlite_busy_errors_total", '"database is locked" errors.', [({}, sql["busy_errors"])], "counter")
+        + _sample_lines("omr_detect_pool_processes", "Size of the bulk detection process pool.", [({}, pool_size())])
+    )
+
+
+# -------- SAMPLING PROFILER --------
+class SamplingProfiler:
+    """
+    Samples every thread's Python stack each `interval_s` and tallies collapsed stacks
+    ("outer;inner;leaf count", the input format of flamegraph.pl / speedscope). Costs one
+    sys._current_frames() walk per interval while running and nothing while stopped.
+    """
+
+    def __init__(self):
+        self.stacks = _Tally()
+        self.samples = 0
+        self.interval_s = 0.005
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval_s: float = None):
+        with self._lock:
+            if self.running:
+                return
+            self.interval_s = interval_s or self.interval_s
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, daemon=True, name="omr-profiler")
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._stop.set()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(1.0)
+
+    def reset(self):
+        with self._lock:
+            self.stacks.clear()
+            self.samples = 0
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            frames = sys._current_frames()
+            with self._lock:
+                self.samples += 1
+                for tid, frame in frames.items():
+                    if tid == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self, limit: int = 0) -> str:
+        with self._lock:
+            items = self.stacks.most_common(limit or None)
+        return "".join(f"{stack} {n}\n" for stack, n in items)
+
+    def status(self) -> dict:
+        return {"running": self.running, "interval_ms": self.interval_s * 1e3, "samples": self.samples,
+                "distinct_stacks": len(self.stacks)}
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,100 @@
+from sqlalchemy import inspect, text
+from .db import Base
+from . import models
+import json
+
+
+def _add_missing_columns(conn):
+    """create_all never alters existing tables; add any model columns the database lacks."""
+    insp = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not insp.has_table(table.name):
+            continue
+        existing = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name not in existing:
+                coltype = col.type.compile(dialect=conn.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {col.name} {coltype}'))
+
+
+def _rebuild_students(conn):
+    """students used to be keyed by student_id alone; SQLite cannot change a primary key in place."""
+    insp = inspect(conn)
+    if not insp.has_table("students") or insp.get_pk_constraint("students")["constrained_columns"] != ["student_id"]:
+        return
+    for ix in insp.get_indexes("students"):
+        conn.execute(text(f"DROP INDEX IF EXISTS {ix['name']}"))
+    conn.execute(text("ALTER TABLE students RENAME TO students_old"))
+    models.Student.__table__.create(conn)
+    conn.execute(text("INSERT INTO students (student_id, name, college_id, batch_id, meta, created_at) "
+                      "SELECT student_id, name, college_id, batch_id, meta, created_at FROM students_old "
+                      "WHERE batch_id IS NOT NULL AND student_id IS NOT NULL"))
+    conn.execute(text("DROP TABLE students_old"))
+
+
+def _compile_answer_keys(conn):
+    from backend.eval.scoring import compile_answer_key
+    rows = conn.execute(text("SELECT id, raw_json FROM results WHERE key_masks IS NULL AND raw_json IS NOT NULL")).fetchall()
+    for rid, raw in rows:
+        key = compile_answer_key(json.loads(raw))
+        conn.execute(text("UPDATE results SET key_masks = :m WHERE id = :id"), {"m": key.masks.tobytes(), "id": rid})
+
+
+def _dedupe_final_results(conn):
+    """Keep only the latest row per (batch, student) so the unique index can be built."""
+    if any(ix["name"] == "uix_final_results_batch_student" for ix in inspect(conn).get_indexes("final_results")):
+        return
+    conn.execute(text("DROP INDEX IF EXISTS ix_final_results_batch_student"))
+    conn.execute(text("DELETE FROM final_results WHERE student_id IS NOT NULL AND id NOT IN "
+                      "(SELECT MAX(id) FROM final_results WHERE student_id IS NOT NULL GROUP BY batch_id, student_id)"))
+
+
+def _create_missing_indexes(conn):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def _columnarize_final_results(conn, chunk: int = 500):
+    """Unpack legacy aggregated_json blobs into the compact per-student columns."""
+    from backend.eval.scoring import parse_selection
+    import numpy as np
+    while True:
+        rows = conn.execute(text("SELECT id, aggregated_json FROM final_results "
+                                 "WHERE answers IS NULL AND aggregated_json IS NOT NULL LIMIT :n"), {"n": chunk}).fetchall()
+        if not rows:
+            return
+        updates = []
+        for rid, raw in rows:
+            try:
+                data = json.loads(raw)
+                answers = sorted(data.get("answers", []), key=lambda a: int(a["question"]))
+                n = max((int(a["question"]) for a in answers), default=0)
+                masks = np.zeros(n, dtype=np.uint8)
+                correct = np.zeros(n, dtype=bool)
+                for a in answers:
+                    sel = a.get("student_answer", "")
+                    masks[int(a["question"]) - 1] = 0 if sel == "Not Attempted" else parse_selection(sel)
+                    correct[int(a["question"]) - 1] = bool(a.get("is_correct"))
+            except (ValueError, KeyError, TypeError):
+                continue   # leave unreadable blobs untouched; they are still served as-is
+            updates.append({"id": rid, "sid": str(data.get("student_id", "")), "name": data.get("name", ""),
+                            "score": int(data.get("score", correct.sum())), "total": int(data.get("total", n)),
+                            "answers": masks.tobytes(), "correct": np.packbits(correct).tobytes()})
+        if updates:
+            conn.execute(text("UPDATE final_results SET student_id = :sid, name = :name, score = :score, total = :total, "
+                              "answers = :answers, correct = :correct, aggregated_json = NULL WHERE id = :id"), updates)
+        if len(updates) < len(rows):
+            return   # only unconvertible rows are left
+
+
+def upgrade(engine):
+    """Bring an existing database up to the current models. Safe to run on every start."""
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        _rebuild_students(conn)
+        _add_missing_columns(conn)
+        _compile_answer_keys(conn)
+        _columnarize_final_results(conn)
+        _dedupe_final_results(conn)
+        _create_missing_indexes(conn)
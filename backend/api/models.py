@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Text, DateTime, UniqueConstraint
+from sqlalchemy import Column, Integer, String, ForeignKey, Text, DateTime, LargeBinary, Index, PrimaryKeyConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .db import Base
@@ -19,6 +19,8 @@ class Batch(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String)
     college_id = Column(Integer, ForeignKey("colleges.id"))
+    template = Column(String, default="std-100x4")  # sheet layout, see backend/eval/templates.py
+    roster_imported_at = Column(DateTime)  # once set, only students on the roster can be evaluated
     created_at = Column(DateTime, default=datetime.utcnow)
 
     college = relationship("College", back_populates="batches")
@@ -26,7 +28,7 @@ class Batch(Base):
 
 class Student(Base):
     __tablename__ = "students"
-    student_id = Column(String, primary_key=True, index=True)
+    student_id = Column(String)
     name = Column(String)
     college_id = Column(Integer, ForeignKey("colleges.id"))
     batch_id = Column(Integer, ForeignKey("batches.id"))
@@ -35,7 +37,8 @@ class Student(Base):
 
     college = relationship("College", back_populates="students")
     batch = relationship("Batch", back_populates="students")
-    __table_args__ = (UniqueConstraint('student_id', 'college_id', 'batch_id', name='uix_student_college_batch'),)
+    # the same roll number may appear in several batches; a batch belongs to one college
+    __table_args__ = (PrimaryKeyConstraint("batch_id", "student_id"),)
 
 class Result(Base):
     __tablename__ = "results"
@@ -43,6 +46,8 @@ class Result(Base):
     college_id = Column(Integer, ForeignKey("colleges.id"))
     batch_id = Column(Integer, ForeignKey("batches.id"))
     raw_json = Column(Text)  # official answer key
+    key_masks = Column(LargeBinary)  # compiled key: one option bitmask byte per question
+    version = Column(Integer, default=1)  # bumped on every re-upload, stamps cached keys
     created_at = Column(DateTime, default=datetime.utcnow)
 
 class FinalResult(Base):
@@ -50,5 +55,50 @@ class FinalResult(Base):
     id = Column(Integer, primary_key=True, index=True)
     college_id = Column(Integer, ForeignKey("colleges.id"))
     batch_id = Column(Integer, ForeignKey("batches.id"))
-    aggregated_json = Column(Text)  # evaluated student result
+    student_id = Column(String)
+    name = Column(String)
+    score = Column(Integer)
+    total = Column(Integer)
+    answers = Column(LargeBinary)  # one option bitmask byte per question
+    correct = Column(LargeBinary)  # packed per-question correctness bits
+    key_version = Column(Integer)  # answer key version the row was scored against
+    image_sha = Column(String)  # SHA-256 of the scanned sheet
+    review = Column(Text)  # JSON reasons when the sheet was flagged for manual review, else NULL
+    aggregated_json = Column(Text)  # legacy JSON blob, migrated into the columns above
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_final_results_batch_id", "batch_id"),
+        Index("uix_final_results_batch_student", "batch_id", "student_id", unique=True),
+    )
+
+class BatchStats(Base):
+    __tablename__ = "batch_stats"
+    batch_id = Column(Integer, ForeignKey("batches.id"), primary_key=True)
+    n = Column(Integer, default=0)  # students counted (latest result per student)
+    score_sum = Column(Integer, default=0)
+    score_sq_sum = Column(Integer, default=0)
+    hist = Column(LargeBinary)  # int64 count per score value
+    q_attempted = Column(LargeBinary)  # int64 per question
+    q_correct = Column(LargeBinary)  # int64 per question
+    q_correct_score_sum = Column(LargeBinary)  # int64 per question: total score of students who got it right
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class EvalJob(Base):
+    __tablename__ = "eval_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    status = Column(String, default="queued")  # queued | running | done | failed
+    batch_id = Column(Integer, ForeignKey("batches.id"))
+    student_meta = Column(Text)
+    upload_path = Column(String)  # spooled sheet, removed once the job finishes
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    not_before = Column(DateTime, default=datetime.utcnow)  # retry backoff
+    lease_until = Column(DateTime)  # a running job whose lease expired was lost with its worker
+    worker = Column(String)
+    error = Column(Text)
+    result_json = Column(Text)  # score summary once done
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (Index("ix_eval_jobs_status_not_before", "status", "not_before"),)
@@ -1,15 +1,31 @@
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Form
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Form, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from .db import get_db
-from . import models, schemas
-from backend.eval.omr_eval import evaluate_omr_image
-import json, hashlib, pandas as pd, io
+from typing import List, Optional
+from concurrent.futures.process import BrokenProcessPool
+from .db import get_db, get_write_db, SessionLocal, WriteSession, db_stats
+from . import models, schemas, evaluation, exports, stats, jobs
+from .cache import answer_keys, detections, students as student_index
+from .blobs import keep_scan, overlays, scans
+from .uploads import MAX_UPLOAD_BYTES, inflight, spool_upload
+from .metrics import SHEETS, profiler, registry, stage
+from .warmup import readiness
+from backend.eval.answer_key import MAX_REPORTED, pad_answer_key, parse_answer_key
+from backend.eval.roster import parse_roster
+from backend.eval.templates import DEFAULT_TEMPLATE, get_template, list_templates
+from backend.eval.pool import get_pool, pool_size, detect_chunk
+from backend.eval.omr_eval import SHEET_H, SHEET_W, unpack_detection
+import json, hashlib, logging, os, asyncio, zipfile, zlib
+import numpy as np
+
+log = logging.getLogger(__name__)
 
 router = APIRouter()
 
 # -------- AUTH --------
 @router.post("/signup")
-def signup(name: str = Form(...), email: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
+def signup(name: str = Form(...), email: str = Form(...), password: str = Form(...), db: Session = Depends(get_write_db)):
     existing = db.query(models.College).filter(models.College.email == email).first()
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
@@ -32,145 +48,484 @@ def login(email: str = Form(...), password: str = Form(...), db: Session = Depen
 
 # -------- BATCH --------
 @router.post("/batches")
-def create_batch(college_id: int = Form(...), name: str = Form(...), db: Session = Depends(get_db)):
-    batch = models.Batch(name=name, college_id=college_id)
+def create_batch(college_id: int = Form(...), name: str = Form(...), template: str = Form(DEFAULT_TEMPLATE),
+                 db: Session = Depends(get_write_db)):
+    try:
+        get_template(template)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    batch = models.Batch(name=name, college_id=college_id, template=template)
     db.add(batch)
     db.commit()
     db.refresh(batch)
-    return {"id": batch.id, "name": batch.name, "created_at": batch.created_at.isoformat()}
+    return {"id": batch.id, "name": batch.name, "template": batch.template, "created_at": batch.created_at.isoformat()}
 
 @router.get("/batches/{college_id}")
 def list_batches(college_id: int, db: Session = Depends(get_db)):
     batches = db.query(models.Batch).filter(models.Batch.college_id == college_id).all()
-    return [{"id": b.id, "name": b.name} for b in batches]
+    return [{"id": b.id, "name": b.name, "template": b.template or DEFAULT_TEMPLATE} for b in batches]
 
-# -------- OFFICIAL RESULT --------
-@router.post("/batches/{batch_id}/official_result")
-async def upload_official_result(batch_id: int, file: UploadFile = File(...), db: Session = Depends(get_db)):
-    content = await file.read()
-    filename = file.filename.lower()
+# -------- TEMPLATES --------
+@router.get("/templates")
+def templates_list():
+    return [t.describe() for t in list_templates()]
 
+@router.get("/templates/{name}")
+def template_detail(name: str):
     try:
-        if filename.endswith(".json"):
-            answer_key = json.loads(content.decode("utf-8"))
-        elif filename.endswith(".xlsx"):
-            df = pd.read_excel(io.BytesIO(content), header=None)
-            answer_key = {}
-
-            # ✅ Row-wise iteration to handle multiple columns & empty cells
-            for _, row in df.iterrows():
-                for cell in row.dropna():
-                    try:
-                        cell_str = str(cell).replace(":", "-").replace(".", "-").replace(" ", "")
-                        parts = cell_str.split("-")
-                        if len(parts) >= 2:
-                            q = int(parts[0])
-                            ans = parts[1].lower()
-                            answer_key[q] = ans
-                    except:
-                        continue
-        else:
-            answer_key = {}
-
-        # ✅ Ensure all 1–100 questions are present
-        for q in range(1, 101):
-            if q not in answer_key:
-                answer_key[q] = ""
-
-        # ✅ Sort dictionary by question number before saving
-        answer_key = {k: answer_key[k] for k in sorted(answer_key.keys())}
+        return get_template(name).describe(geometry=True)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
+# -------- OFFICIAL RESULT --------
+@router.post("/batches/{batch_id}/official_result")
+async def upload_official_result(batch_id: int, file: UploadFile = File(...), db: Session = Depends(get_write_db)):
+    sheet = await spool_upload(file)
+    try:
+        parsed = await run_in_threadpool(parse_answer_key, sheet.path, file.filename)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to parse official result: {str(e)}")
+    finally:
+        sheet.close()
+    if not parsed.answers:
+        sample = ", ".join(f"{e['cell']}={e['value']!r}" for e in parsed.errors[:5])
+        raise HTTPException(status_code=400, detail="No answers found in official result"
+                                                    + (f"; unreadable cells: {sample}" if sample else ""))
 
-    existing = db.query(models.Result).filter(models.Result.batch_id == batch_id).first()
-    if existing:
-        existing.raw_json = json.dumps(answer_key, sort_keys=True)
-    else:
-        db.add(models.Result(batch_id=batch_id, college_id=1, raw_json=json.dumps(answer_key, sort_keys=True)))
-    db.commit()
-    return {"message": "Official answers stored", "answer_key": answer_key}
+    # ✅ Every question of the batch's sheet template present, sorted by question number
+    answer_key = pad_answer_key(parsed.answers, evaluation.template_for_batch(db, batch_id).questions)
+
+    # ✅ Compile once at upload; stored results are re-scored from their saved selections, no rescans
+    rescored = await run_in_threadpool(evaluation.store_answer_key, db, batch_id, answer_key)
+    return {"message": "Official answers stored", "answer_key": answer_key, "rescored": rescored,
+            "malformed": parsed.errors[:MAX_REPORTED], "malformed_count": len(parsed.errors)}
+
+# -------- ROSTER --------
+@router.post("/batches/{batch_id}/roster")
+async def import_roster(batch_id: int, file: UploadFile = File(...), db: Session = Depends(get_write_db)):
+    """
+    CSV/XLSX of student ids and names, with or without a header row, upserted in one transaction.
+    Students are added or renamed, never removed; afterwards the batch only evaluates rostered students.
+    """
+    sheet = await spool_upload(file)
+    try:
+        parsed = await run_in_threadpool(parse_roster, sheet.path, file.filename)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to parse roster: {str(e)}")
+    finally:
+        sheet.close()
+    if not parsed.students:
+        raise HTTPException(status_code=400, detail="No student ids found in roster")
+
+    # the write transaction (and SQLite's write lock) starts here, after the upload is parsed
+    def upsert():
+        batch = db.get(models.Batch, batch_id)
+        if not batch:
+            raise HTTPException(status_code=404, detail="Batch not found")
+        return evaluation.import_roster(db, batch, parsed.students)
+    counts = await run_in_threadpool(upsert)
+    return {"message": "Roster imported", **counts,
+            "malformed": parsed.errors[:MAX_REPORTED], "malformed_count": len(parsed.errors)}
 
 # -------- STUDENT EVALUATION --------
 @router.post("/evaluate_student")
-async def evaluate_student(file: UploadFile = File(...), student_meta: str = Form(...), db: Session = Depends(get_db)):
+async def evaluate_student(file: UploadFile = File(...), student_meta: str = Form(...), mode: str = Form("sync"),
+                           db: Session = Depends(get_db)):
+    """mode=async stores the upload, queues it and returns 202 with a job id to poll at /jobs/{id}."""
     try:
         meta = json.loads(student_meta)
         student_meta_obj = schemas.StudentMeta(**meta)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid student_meta")
+    # ✅ Checked against the in-memory roster index before the upload is even read
+    try:
+        student_meta_obj = evaluation.check_student(db, student_meta_obj)
+    except evaluation.UnknownStudent as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if mode == "async":
+        sheet = await spool_upload(file, directory=jobs.JOB_DIR, keep=True)
+        # queued in a write transaction of its own: upgrading this read session would fail
+        # with "database is locked" whenever another writer committed since it began
+        return JSONResponse(status_code=202, content=await run_in_threadpool(jobs.enqueue, student_meta_obj, sheet))
 
-    # Ensure student exists
-    student = db.query(models.Student).filter(
-        models.Student.student_id == student_meta_obj.student_id,
-        models.Student.batch_id == student_meta_obj.batch_id
-    ).first()
-
-    if not student:
-        student = models.Student(
-            student_id=student_meta_obj.student_id,
-            name=student_meta_obj.name or "",
-            college_id=student_meta_obj.college_id,
-            batch_id=student_meta_obj.batch_id,
-            meta=json.dumps({"source": "OMR Evaluation"})
-        )
-        db.add(student)
+    # ✅ Stream to disk instead of holding the scan in memory; decode off the event loop
+    with stage("upload"):
+        sheet = await spool_upload(file)
+    with sheet:
+        try:
+            result_data = await run_in_threadpool(evaluation.evaluate_upload, db, student_meta_obj,
+                                                  sheet.path, sheet.sha)
+        except ValueError as e:
+            SHEETS.inc(path="sync", status="error")
+            raise HTTPException(status_code=400, detail=str(e))
+    SHEETS.inc(path="sync", status="ok")
+
+    with stage("serialize"):
+        return JSONResponse({"evaluated_result": result_data})
+
+@router.get("/batches/{batch_id}/final_results")
+def get_final_results(batch_id: int, response: Response, view: str = "full", limit: Optional[int] = None,
+                      after: int = 0, db: Session = Depends(get_db)):
+    """
+    view=summary returns only student_id/name/score/total and never reads per-question data.
+    With `limit`, results are paged by row id: pass the X-Next-Cursor header back as `after`.
+    """
+    if view == "summary":
+        q = exports.summary_query(db, batch_id)
     else:
-        if student.name != student_meta_obj.name:
-            student.name = student_meta_obj.name
+        q = db.query(models.FinalResult).filter(models.FinalResult.batch_id == batch_id)
+    if limit is not None:
+        limit = max(1, min(limit, 5000))
+        q = q.filter(models.FinalResult.id > after).order_by(models.FinalResult.id).limit(limit)
+    results = q.all()
+    if limit is not None and len(results) == limit:
+        response.headers["X-Next-Cursor"] = str(results[-1].id)
 
-    db.commit()
+    if view == "summary":
+        return [{c: getattr(r, c) for c in exports.SUMMARY_COLUMNS} for r in results]
+    key = evaluation.load_answer_key(db, batch_id)
+    return [evaluation.result_from_row(r, key) for r in results]
+
+# -------- AUDIT OVERLAYS --------
+@router.get("/results/{result_id}/overlay")
+def get_result_overlay(result_id: int, request: Request, db: Session = Depends(get_db)):
+    """
+    The scan with read bubbles outlined, rendered on first request and stored under the hash of
+    its inputs. That hash is the ETag, so unchanged overlays revalidate with a 304; Range is supported.
+    The URL stays the same when the student is re-evaluated or the key corrected, so it is served
+    no-cache: browsers keep the image but revalidate it on every view.
+    """
+    row = db.query(models.FinalResult).filter(models.FinalResult.id == result_id).first()
+    if not row or row.answers is None or not row.image_sha or not scans.has(row.image_sha):
+        raise HTTPException(status_code=404, detail="No retained scan for this result")
+    template = evaluation.template_for_batch(db, row.batch_id)
+    key = evaluation.load_answer_key(db, row.batch_id)
+    digest = evaluation.overlay_digest(row, template, key)
+    headers = {"ETag": f'"{digest}"', "Cache-Control": "private, no-cache"}
+    if digest in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    if not overlays.has(digest):
+        from backend.eval.overlay import render_overlay
+        masks = np.frombuffer(row.answers, dtype=np.uint8)
+        jpeg = render_overlay(scans.path(row.image_sha), template, masks,
+                              evaluation.unpack_correct(row.correct, len(masks)),
+                              key.masks if key is not None else np.zeros(0, np.uint8))
+        overlays.put_bytes(digest, jpeg)
+    return FileResponse(overlays.path(digest), media_type="image/jpeg", headers=headers)
+
+@router.get("/batches/{batch_id}/final_results/export")
+def export_final_results(batch_id: int, format: str = "csv", answers: bool = False, db: Session = Depends(get_db)):
+    """Stream the batch as CSV or Parquet, reading and writing rows in fixed-size chunks."""
+    key = evaluation.load_answer_key(db, batch_id)
+    n_questions = len(key.masks) if key is not None else 0
+    if format == "csv":
+        body, media_type = exports.csv_stream(batch_id, n_questions, answers), "text/csv"
+    elif format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=400, detail="Parquet export requires pyarrow")
+        body, media_type = exports.parquet_stream(batch_id, n_questions, answers), "application/vnd.apache.parquet"
+    else:
+        raise HTTPException(status_code=400, detail="format must be csv or parquet")
+    headers = {"Content-Disposition": f'attachment; filename="batch_{batch_id}_results.{format}"'}
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+@router.get("/batches/{batch_id}/stats")
+def get_batch_stats(batch_id: int, db: Session = Depends(get_db)):
+    """Mean/median/histogram and per-question item analysis from the incrementally kept aggregates."""
+    st = db.get(models.BatchStats, batch_id)
+    if st is not None:
+        return stats.summarize(st)
+    with WriteSession() as session:   # batch evaluated before stats existed: rebuild once
+        st = stats.get_or_rebuild(session, batch_id)
+        session.commit()
+        return stats.summarize(st)
 
-    # Fetch official key
-    official = db.query(models.Result).filter(models.Result.batch_id == student_meta_obj.batch_id).first()
-    if not official:
+# -------- JOBS --------
+@router.get("/jobs/stats")
+def job_stats(db: Session = Depends(get_db)):
+    return jobs.queue_depth(db)
+
+@router.get("/jobs/{job_id}")
+def get_job(job_id: int, db: Session = Depends(get_db)):
+    job = db.get(models.EvalJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return jobs.job_status(job)
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: int):
+    """Server-sent events with the job status on every change, closing once it finishes."""
+    with SessionLocal() as session:
+        if not session.get(models.EvalJob, job_id):
+            raise HTTPException(status_code=404, detail="Job not found")
+
+    async def run():
+        last = None
+        while True:
+            with SessionLocal() as session:
+                job = session.get(models.EvalJob, job_id)
+                # a job row is only ever removed by hand; end the stream rather than poll forever
+                status = jobs.job_status(job) if job else {"id": job_id, "status": "not_found"}
+            if status != last:
+                yield f"data: {json.dumps(status)}\n\n"
+                last = status
+            if status["status"] in jobs.TERMINAL or not job:
+                return
+            await asyncio.sleep(0.5)
+    return StreamingResponse(run(), media_type="text/event-stream")
+
+# -------- READINESS --------
+@router.get("/ready")
+def ready():
+    """200 once this worker has warmed up (see backend.api.warmup), 503 before."""
+    status = readiness.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+# -------- CACHES --------
+@router.get("/cache/stats")
+def cache_stats():
+    return {"answer_keys": answer_keys.stats(), "detections": detections.stats(), "students": student_index.stats(),
+            "decode_memory": inflight.stats()}
+
+# -------- METRICS --------
+@router.get("/metrics")
+def metrics_text():
+    """Prometheus text exposition: request/stage latency histograms, throughput, queue depths, cache ratios."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@router.post("/metrics/profiler")
+def toggle_profiler(action: str = Form(...), interval_ms: float = Form(5.0)):
+    """action=start|stop|reset for the in-process sampling profiler."""
+    if action == "start":
+        profiler.start(max(interval_ms, 1.0) / 1000)
+    elif action == "stop":
+        profiler.stop()
+    elif action == "reset":
+        profiler.reset()
+    else:
+        raise HTTPException(status_code=400, detail="action must be start, stop or reset")
+    return profiler.status()
+
+@router.get("/metrics/profiler")
+def profiler_stacks(limit: int = 0):
+    """Collapsed stacks with sample counts, ready for flamegraph.pl or speedscope."""
+    return PlainTextResponse(profiler.collapsed(limit), headers={"X-Profiler-Samples": str(profiler.samples)})
+
+# -------- DATABASE --------
+@router.get("/db/stats")
+def database_stats():
+    """Commit latency, write-lock waits and "database is locked" errors, plus write-behind batching."""
+    return {"sqlite": db_stats.stats(), "result_writer": evaluation.result_writer.stats()}
+
+# -------- BULK EVALUATION --------
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+BULK_CHUNK = 16
+MAX_BULK_BYTES = int(os.environ.get("OMR_MAX_BULK_BYTES", 4 << 30))
+
+def _list_sheets(spooled):
+    """
+    (name, size, path, zip member or None) for every image upload and every image inside
+    uploaded zips, plus (name, error) for archives that cannot be opened. Only directories
+    are read, so chunks can reserve memory before loading.
+    """
+    out, errors = [], []
+    for name, sheet in spooled:
+        if name.lower().endswith(".zip"):
+            try:
+                with zipfile.ZipFile(sheet.path) as zf:
+                    members = zf.infolist()
+            except zipfile.BadZipFile as e:   # one bad archive does not cost the other sheets
+                errors.append((name, f"Unreadable zip archive: {e}"))
+                continue
+            for info in members:
+                if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTS):
+                    out.append((os.path.basename(info.filename), info.file_size, sheet.path, info))
+        elif name.lower().endswith(IMAGE_EXTS):
+            out.append((os.path.basename(name), sheet.size, sheet.path, None))
+    return out, errors
+
+def _chunk_bytes(sources) -> int:
+    """
+    Memory a chunk pins until its detection returns: the sheets read here, their pickled copy
+    in the pool worker, and each sheet's decode there.
+    """
+    read = sum(size for _, size, _, _ in sources if size <= MAX_UPLOAD_BYTES)
+    return 2 * read + len(sources) * 2 * SHEET_W * SHEET_H
+
+def _read_chunk(sources, archives: dict, template: str):
+    """
+    Load a chunk of sheets as [(name, sha, bytes)], their detection cache hits and {index: error}
+    for sheets that were not read (sha None): over MAX_UPLOAD_BYTES or a corrupt zip member. Each
+    sheet read is retained for audit. All blocking I/O (zip inflation, hashing, disk), so the
+    bulk stream runs it in the threadpool.
+    """
+    chunk, errors = [], {}
+    for name, size, path, member in sources:
+        if size > MAX_UPLOAD_BYTES:   # zipfile never inflates past file_size, so this also stops zip bombs
+            errors[len(chunk)] = f"Sheet exceeds {MAX_UPLOAD_BYTES} bytes"
+            chunk.append((name, None, None))
+            continue
+        try:
+            if member is None:
+                with open(path, "rb") as fh:
+                    b = fh.read()
+            else:
+                if path not in archives:
+                    archives[path] = zipfile.ZipFile(path)
+                b = archives[path].read(member)
+        except (zipfile.BadZipFile, zlib.error, EOFError) as e:   # bad CRC, truncated or corrupt deflate data
+            errors[len(chunk)] = f"Unreadable zip member: {e}"
+            chunk.append((name, None, None))
+            continue
+        chunk.append((name, detections.digest(b), b))
+    for _, sha, b in chunk:
+        if sha:
+            keep_scan(sha, b)
+    return chunk, [detections.get(sha, template) if sha else None for _, sha, _ in chunk], errors
+
+def _remember(detected, template: str):
+    """Store fresh detections in the cache; writes its disk tier, so it runs in the threadpool."""
+    for sha, entry in detected:
+        detections.put(sha, template, entry)
+
+def _parse_roster(roster: str):
+    """Roster is a JSON list of {"file", "student_id", "name"}; keyed by file name and by student id."""
+    try:
+        entries = json.loads(roster or "[]")
+        by_key = {}
+        for e in entries:
+            by_key[e.get("file") or e["student_id"]] = e
+        return by_key
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid roster")
+
+@router.post("/batches/{batch_id}/evaluate_bulk")
+async def evaluate_bulk(batch_id: int, college_id: int = Form(...), roster: str = Form("[]"),
+                        files: List[UploadFile] = File(...), stream: str = Form("ndjson"),
+                        db: Session = Depends(get_db)):
+    """
+    Evaluate many sheets (images and/or zip archives) in one request. Detection fans out over a
+    CPU process pool and per-sheet results are streamed back as NDJSON (or SSE) as chunks finish.
+    """
+    by_key = _parse_roster(roster)
+    answer_key = evaluation.load_answer_key(db, batch_id)
+    if answer_key is None:
         raise HTTPException(status_code=400, detail="Upload official result first.")
-    answer_key = json.loads(official.raw_json)
-
-    content = await file.read()
-    omr_result = evaluate_omr_image(content, student_meta_obj, answer_key)
-
-    student_answers = {int(item["question_no"]): item["selected_option"].lower()
-                       for item in omr_result["question_breakdown"]}
-
-    evaluated, score = [], 0
-    for q in sorted(answer_key.keys(), key=int):  # ✅ Always evaluate in order
-        correct = answer_key[str(q)] if isinstance(q, str) else answer_key[q]
-        student_ans = student_answers.get(int(q), "")
-        corr_set = set([x for x in correct.split(",") if x])
-        stud_set = set([x for x in student_ans.split(",") if x])
-        is_correct = corr_set == stud_set and corr_set
-        evaluated.append({
-            "question": int(q),
-            "correct_answer": ",".join(sorted(corr_set)),
-            "student_answer": ",".join(sorted(stud_set)) if stud_set else "Not Attempted",
-            "is_correct": bool(is_correct)
-        })
-        if is_correct:
-            score += 1
-
-    # ✅ Sort answers list before saving
-    evaluated = sorted(evaluated, key=lambda x: x["question"])
-
-    result_data = {
-        "student_id": student_meta_obj.student_id,
-        "name": student_meta_obj.name or "",
-        "batch_id": student_meta_obj.batch_id,
-        "score": score,
-        "total": 100,
-        "answers": evaluated
-    }
-
-    db.add(models.FinalResult(
-        college_id=student_meta_obj.college_id,
-        batch_id=student_meta_obj.batch_id,
-        aggregated_json=json.dumps(result_data)
-    ))
-    db.commit()
+    template = evaluation.template_for_batch(db, batch_id)
+    known, closed = student_index.get(db, batch_id)
+    spooled = [(f.filename or "", await spool_upload(f, max_bytes=MAX_BULK_BYTES)) for f in files]
 
-    return {"evaluated_result": result_data}
+    def meta_for(name):
+        entry = by_key.get(name) or by_key.get(os.path.splitext(name)[0]) or {}
+        sid = str(entry.get("student_id") or os.path.splitext(name)[0])
+        return schemas.StudentMeta(student_id=sid, name=entry.get("name") or known.get(sid) or None,
+                                   college_id=college_id, batch_id=batch_id)
 
-@router.get("/batches/{batch_id}/final_results")
-def get_final_results(batch_id: int, db: Session = Depends(get_db)):
-    results = db.query(models.FinalResult).filter(models.FinalResult.batch_id == batch_id).all()
-    return [json.loads(r.aggregated_json) for r in results]
+    def fmt(obj):
+        line = json.dumps(obj)
+        return f"data: {line}\n\n" if stream == "sse" else line + "\n"
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        archives, pending, done_count, failed = {}, {}, 0, 0
+        max_in_flight = 2 * pool_size()
+
+        def submit(images):
+            try:
+                return loop.run_in_executor(get_pool(), detect_chunk, images, template.name)
+            except BrokenProcessPool as e:   # broke after get_pool looked; fails this chunk only
+                fut = loop.create_future()
+                fut.set_exception(e)
+                return fut
+
+        try:
+            sheets, bad_archives = await run_in_threadpool(_list_sheets, spooled)
+            for name, error in bad_archives:
+                failed += 1
+                SHEETS.inc(path="bulk", status="error")
+                yield fmt({"file": name, "status": "error", "error": error})
+            pos = 0
+            while pending or pos < len(sheets):
+                # keep the pool saturated, but only with chunks the decode memory budget can hold
+                while pos < len(sheets) and len(pending) < max_in_flight:
+                    sources = sheets[pos:pos + BULK_CHUNK]
+                    need = _chunk_bytes(sources)
+                    held = inflight.try_acquire(need)
+                    if held is None:
+                        if pending:
+                            break   # our own chunks release budget as they finish
+                        held = await run_in_threadpool(inflight.acquire, need)
+                    pos += len(sources)
+                    try:
+                        chunk, hits, errors = await run_in_threadpool(_read_chunk, sources, archives, template.name)
+                    except BaseException:
+                        inflight.release(held)
+                        raise
+                    # sheets seen before skip detection entirely
+                    todo = [i for i, (m, (_, sha, _)) in enumerate(zip(hits, chunk)) if m is None and sha]
+                    if todo:
+                        fut = submit([chunk[i][2] for i in todo])
+                    else:
+                        fut = loop.create_future()
+                        fut.set_result([])
+                    pending[fut] = ([(n, sha) for n, sha, _ in chunk], hits, errors, todo, held)
+                if not pending:
+                    break
+                finished, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for fut in finished:
+                    names, hits, errors, todo, held = pending.pop(fut)
+                    inflight.release(held)   # the worker has decoded the chunk and dropped its bytes
+                    try:
+                        detected = dict(zip(todo, fut.result()))
+                    except Exception as e:   # e.g. BrokenProcessPool: a pool worker was killed mid-chunk
+                        log.exception("bulk detection failed for batch %s", batch_id)
+                        detected = {i: (None, f"Detection failed ({type(e).__name__}); retry this sheet")
+                                    for i in todo}
+                    lines, ok, fresh = [], [], []
+                    for i, (name, sha) in enumerate(names):
+                        meta = meta_for(name)
+                        if hits[i] is not None:
+                            entry, error = hits[i], None
+                        else:
+                            entry, error = detected.get(i) or (None, errors.get(i))
+                        if closed and meta.student_id not in known:
+                            error = f"Student {meta.student_id} is not on the roster of batch {batch_id}"
+                        if error:
+                            failed += 1
+                            SHEETS.inc(path="bulk", status="error")
+                            lines.append({"file": name, "student_id": meta.student_id, "status": "error", "error": error})
+                            continue
+                        if hits[i] is None:
+                            fresh.append((sha, entry))
+                        ok.append((name, meta, sha) + unpack_detection(entry, template.questions))
+                    if fresh:
+                        await run_in_threadpool(_remember, fresh, template.name)
+                    scored = evaluation.score_many([o[1] for o in ok], answer_key, np.stack([o[3] for o in ok]),
+                                                   [o[2] for o in ok], [o[4] for o in ok]) if ok else []
+                    SHEETS.inc(len(ok), path="bulk", status="ok")
+                    for (name, meta, *_), graded in zip(ok, scored):
+                        done_count += 1
+                        lines.append({"file": name, "student_id": meta.student_id, "status": "ok",
+                                      "score": int(graded.correct.sum()), "total": len(graded.masks),
+                                      "needs_review": graded.review is not None})
+                    if scored:   # grouped with other writers into one transaction
+                        await asyncio.wrap_future(evaluation.result_writer.submit(scored))
+                    for line in lines:
+                        yield fmt(line)
+            yield fmt({"done": True, "evaluated": done_count, "failed": failed})
+        except HTTPException as e:   # decode memory stayed exhausted by other requests
+            yield fmt({"done": True, "evaluated": done_count, "failed": failed, "error": e.detail})
+        finally:
+            for *_, held in pending.values():
+                inflight.release(held)
+            for zf in archives.values():
+                zf.close()
+            for _, sheet in spooled:
+                sheet.close()
+
+    media_type = "text/event-stream" if stream == "sse" else "application/x-ndjson"
+    return StreamingResponse(run(), media_type=media_type)
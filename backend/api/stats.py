@@ -0,0 +1,117 @@
+from sqlalchemy.orm import Session
+from datetime import datetime
+from . import models
+import numpy as np
+
+# Per-batch aggregates kept in one BatchStats row: scalar running sums plus int64 arrays
+# (score histogram, per-question attempted/correct counters and the summed total score of
+# the students who got each question right, which gives discrimination without a rescan).
+
+
+def _arr(blob, n: int) -> np.ndarray:
+    a = np.frombuffer(blob, dtype=np.int64) if blob else np.zeros(0, dtype=np.int64)
+    return np.pad(a, (0, max(n - len(a), 0))) if len(a) < n else a.copy()
+
+
+def contributions(rows):
+    """(scores (k,), attempted (k,Q), correct (k,Q)) for stored rows or FinalResult value dicts."""
+    get = (lambda r, c: r[c]) if rows and isinstance(rows[0], dict) else getattr
+    n = max((len(get(r, "answers") or b"") for r in rows), default=0)
+    scores = np.array([get(r, "score") or 0 for r in rows], dtype=np.int64)
+    attempted = np.zeros((len(rows), n), dtype=bool)
+    correct = np.zeros((len(rows), n), dtype=bool)
+    for i, r in enumerate(rows):
+        ans = np.frombuffer(get(r, "answers") or b"", dtype=np.uint8)
+        attempted[i, :len(ans)] = ans != 0
+        correct[i, :len(ans)] = np.unpackbits(np.frombuffer(get(r, "correct") or b"", dtype=np.uint8),
+                                              count=len(ans)).astype(bool)
+    return scores, attempted, correct
+
+
+def snapshot(row) -> dict:
+    """Copy of the columns a row contributes, taken before the row is overwritten."""
+    return {"score": row.score, "answers": row.answers, "correct": row.correct}
+
+
+def apply(st: models.BatchStats, added=(), removed=()):
+    """Add and subtract row contributions in O(rows x questions), independent of batch size."""
+    for rows, sign in ((list(added), 1), (list(removed), -1)):
+        if not rows:
+            continue
+        scores, attempted, correct = contributions(rows)
+        q = max(attempted.shape[1], len(st.q_attempted or b"") // 8)
+        hist = _arr(st.hist, int(scores.max(initial=0)) + 1)
+        np.add.at(hist, scores, sign)
+        q_att, q_cor, q_css = _arr(st.q_attempted, q), _arr(st.q_correct, q), _arr(st.q_correct_score_sum, q)
+        k = attempted.shape[1]
+        q_att[:k] += sign * attempted.sum(0)
+        q_cor[:k] += sign * correct.sum(0)
+        q_css[:k] += sign * (correct * scores[:, None]).sum(0)
+        st.n = (st.n or 0) + sign * len(rows)
+        st.score_sum = (st.score_sum or 0) + sign * int(scores.sum())
+        st.score_sq_sum = (st.score_sq_sum or 0) + sign * int((scores ** 2).sum())
+        st.hist, st.q_attempted, st.q_correct, st.q_correct_score_sum = (
+            hist.tobytes(), q_att.tobytes(), q_cor.tobytes(), q_css.tobytes())
+    st.updated_at = datetime.utcnow()
+
+
+def latest_rows(db: Session, batch_id: int):
+    """Latest stored row per student; older duplicates do not count towards statistics."""
+    F = models.FinalResult
+    rows = db.query(F.id, F.student_id, F.score, F.answers, F.correct).filter(
+        F.batch_id == batch_id, F.answers.isnot(None)).order_by(F.id).all()
+    return list({r.student_id: r for r in rows}.values())
+
+
+def rebuild(db: Session, batch_id: int) -> models.BatchStats:
+    st = db.get(models.BatchStats, batch_id)
+    if st is None:
+        st = models.BatchStats(batch_id=batch_id)
+        db.add(st)
+    st.n = st.score_sum = st.score_sq_sum = 0
+    st.hist = st.q_attempted = st.q_correct = st.q_correct_score_sum = None
+    apply(st, added=latest_rows(db, batch_id))
+    return st
+
+
+def get_or_rebuild(db: Session, batch_id: int) -> models.BatchStats:
+    """Stats row for the batch; batches evaluated before stats existed are rebuilt once."""
+    return db.get(models.BatchStats, batch_id) or rebuild(db, batch_id)
+
+
+def summarize(st: models.BatchStats) -> dict:
+    n = st.n or 0
+    hist = _arr(st.hist, 1)
+    q_att = _arr(st.q_attempted, 0)
+    q = len(q_att)
+    q_cor, q_css = _arr(st.q_correct, q), _arr(st.q_correct_score_sum, q)
+    mean = st.score_sum / n if n else 0.0
+    std = float(np.sqrt(max(st.score_sq_sum / n - mean ** 2, 0.0))) if n else 0.0
+    nz = np.flatnonzero(hist)
+    cum = np.cumsum(hist)
+    median = 0.0
+    if n:
+        lo = int(np.searchsorted(cum, (n + 1) // 2))
+        hi = int(np.searchsorted(cum, n // 2 + 1))
+        median = (lo + hi) / 2
+
+    # difficulty = share of students answering correctly; discrimination = point-biserial
+    # correlation between getting the question right and the total score
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = q_cor / n if n else np.zeros(q)
+        mean_correct = np.where(q_cor > 0, q_css / np.maximum(q_cor, 1), 0.0)
+        disc = np.where((p > 0) & (p < 1) & (std > 0),
+                        (mean_correct - mean) / (std or 1) * np.sqrt(p / np.where(p < 1, 1 - p, 1)), 0.0)
+    return {
+        "batch_id": st.batch_id,
+        "count": n,
+        "mean": round(mean, 4),
+        "std": round(std, 4),
+        "median": median,
+        "min": int(nz[0]) if n else None,
+        "max": int(nz[-1]) if n else None,
+        "histogram": hist.tolist(),
+        "questions": [{"question": i + 1, "attempted": int(q_att[i]), "correct": int(q_cor[i]),
+                       "difficulty": round(float(p[i]), 4), "discrimination": round(float(disc[i]), 4)}
+                      for i in range(q)],
+    }
@@ -0,0 +1,119 @@
+"""
+Uploads are streamed to disk in fixed-size chunks (hashed on the way) instead of being read
+into memory, with a per-request byte budget. Decoding then reserves its estimated peak
+memory from a process-wide budget, so concurrent large scans queue instead of spiking RSS.
+"""
+from contextlib import contextmanager
+from fastapi import HTTPException, UploadFile
+import hashlib, os, tempfile, threading
+
+CHUNK = 1 << 20
+MAX_UPLOAD_BYTES = int(os.environ.get("OMR_MAX_UPLOAD_BYTES", 25 << 20))
+INFLIGHT_BYTES = int(os.environ.get("OMR_INFLIGHT_BYTES", 512 << 20))
+INFLIGHT_WAIT_S = float(os.environ.get("OMR_INFLIGHT_WAIT_S", 30))
+SPOOL_DIR = os.environ.get("OMR_SPOOL_DIR") or None   # None: system temp dir
+
+
+class SpooledSheet:
+    """An upload on disk: path, size and SHA-256 of its bytes. Removes the file on close."""
+
+    def __init__(self, path: str, size: int, sha: str, keep: bool = False):
+        self.path, self.size, self.sha, self.keep = path, size, sha, keep
+
+    def close(self):
+        if not self.keep:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+async def spool_upload(upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES,
+                       directory: str = None, keep: bool = False) -> SpooledSheet:
+    """Copy an upload to a file chunk by chunk; 413 once it exceeds `max_bytes`."""
+    directory = directory or SPOOL_DIR
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=directory, suffix=".sheet")
+    sha, size = hashlib.sha256(), 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await upload.read(CHUNK)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds {max_bytes} bytes")
+                sha.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return SpooledSheet(path, size, sha.hexdigest(), keep)
+
+
+def hash_file(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(CHUNK), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class MemoryBudget:
+    """Counting semaphore over bytes. A single request larger than the budget runs alone."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes: int, timeout: float = INFLIGHT_WAIT_S) -> int:
+        """Block until `nbytes` fit (503 after `timeout`); returns the amount to release()."""
+        nbytes = min(max(int(nbytes), 0), self.limit)
+        with self._cond:
+            self.waiting += 1
+            ok = self._cond.wait_for(lambda: self.in_use + nbytes <= self.limit, timeout)
+            self.waiting -= 1
+            if not ok:
+                self.rejected += 1
+                raise HTTPException(status_code=503, detail="Server busy decoding other sheets, retry shortly")
+            self.in_use += nbytes
+        return nbytes
+
+    def try_acquire(self, nbytes: int):
+        """acquire() without waiting: the amount to release(), or None if it does not fit now."""
+        nbytes = min(max(int(nbytes), 0), self.limit)
+        with self._cond:
+            if self.in_use + nbytes > self.limit:
+                return None
+            self.in_use += nbytes
+        return nbytes
+
+    def release(self, nbytes: int):
+        with self._cond:
+            self.in_use -= nbytes
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes: int, timeout: float = INFLIGHT_WAIT_S):
+        held = self.acquire(nbytes, timeout)
+        try:
+            yield
+        finally:
+            self.release(held)
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "in_use": self.in_use, "waiting": self.waiting, "rejected": self.rejected}
+
+
+inflight = MemoryBudget(INFLIGHT_BYTES)
@@ -0,0 +1,143 @@
+"""
+Startup warm-up and readiness, served at /api/ready.
+
+Decoders, spreadsheet readers and the detection engine are imported lazily, so importing
+the API stays cheap for scripts, job workers and tests. A serving worker pays for them
+once in its startup hook instead, before it accepts connections. The hook imports them,
+reads a blank sheet on every registered template (both the coarse and the fine pass) and
+loads the answer keys, templates and student indexes of the most recently keyed batches.
+
+Cold start (module import to ready) and the first real request's latency are exported as
+metrics and logged when they exceed OMR_COLD_START_BUDGET_S / OMR_FIRST_REQUEST_BUDGET_MS.
+"""
+import importlib, io, logging, os, threading, time
+
+_T0 = time.perf_counter()   # imported first by main.py, so this is where the API starts loading
+
+log = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("OMR_WARMUP", "1") not in ("0", "false", "no")
+WARM_BATCHES = int(os.environ.get("OMR_WARM_BATCHES", 32))
+WARM_POOL = os.environ.get("OMR_WARM_POOL", "0") not in ("0", "false", "no")
+COLD_START_BUDGET_S = float(os.environ.get("OMR_COLD_START_BUDGET_S", 10))
+FIRST_REQUEST_BUDGET_MS = float(os.environ.get("OMR_FIRST_REQUEST_BUDGET_MS", 1000))
+
+# probes hit a fresh worker first; they say nothing about how warm the evaluation path is
+PROBE_ROUTES = {"/ready", "/metrics"}
+# imported on first use by the request path: decoders, the overlay renderer, XLSX keys and rosters
+DEFERRED_IMPORTS = ("PIL.Image", "PIL.JpegImagePlugin", "PIL.PngImagePlugin", "PIL.ImageDraw", "openpyxl")
+
+
+def blank_sheet(width: int = 1700, height: int = 2200) -> bytes:
+    """An empty page at scan size: no frame is found, so a read goes through the fine pass too."""
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new("L", (width, height), 245).save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+
+def _import_deferred():
+    for name in DEFERRED_IMPORTS:
+        try:
+            importlib.import_module(name)
+        except ImportError:   # optional: the endpoint that needs it reports the error
+            pass
+
+
+def _warm_engine():
+    from backend.eval.omr_eval import read_sheets
+    from backend.eval.templates import list_templates
+    sheet = blank_sheet()
+    for template in list_templates():
+        read_sheets([sheet], template)
+
+
+def _warm_batches():
+    from .db import SessionLocal
+    from .cache import students
+    from . import evaluation, models
+    with SessionLocal() as db:
+        ids = [b for (b,) in db.query(models.Result.batch_id).order_by(models.Result.id.desc()).limit(WARM_BATCHES)]
+        for batch_id in ids:
+            evaluation.load_answer_key(db, batch_id)
+            evaluation.template_for_batch(db, batch_id)
+            students.get(db, batch_id)
+
+
+def _warm_writes():
+    """Compile the evaluation write path (student and result upserts, stats) in a dry run that is rolled back."""
+    import numpy as np
+    from .db import WriteSession
+    from . import evaluation, models, schemas
+    with WriteSession() as db:
+        row = db.query(models.Result.batch_id, models.Batch.college_id).join(
+            models.Batch, models.Batch.id == models.Result.batch_id).order_by(models.Result.id.desc()).first()
+        key = row and evaluation.load_answer_key(db, row.batch_id)
+        if key is None:
+            return
+        meta = schemas.StudentMeta(student_id="warmup", college_id=row.college_id or 0, batch_id=row.batch_id)
+        evaluation.write_graded(db, evaluation.score_many([meta], key, np.zeros((1, len(key.masks)), np.uint8)))
+        db.rollback()
+
+
+def _warm_pool():
+    from backend.eval.pool import get_pool, pool_size, warm_worker
+    pool = get_pool()
+    for f in [pool.submit(warm_worker) for _ in range(pool_size())]:
+        f.result()
+
+
+class Readiness:
+    def __init__(self):
+        self.ready = threading.Event()
+        self.steps = {}
+        self.cold_start_s = None
+        self.first_request = None   # (route, seconds)
+        self._lock = threading.Lock()
+
+    def _step(self, name, fn):
+        t = time.perf_counter()
+        fn()
+        self.steps[name] = round(time.perf_counter() - t, 4)
+
+    def warm(self):
+        """Run every warm-up step, then mark the process ready. A failing step is logged, not fatal."""
+        from .metrics import COLD_START_SECONDS, WARMUP_SECONDS
+        steps = [("imports", _import_deferred), ("engine", _warm_engine), ("batches", _warm_batches),
+             ("writes", _warm_writes)]
+        if WARM_POOL:
+            steps.append(("detect_pool", _warm_pool))
+        for name, fn in steps if ENABLED else []:
+            try:
+                self._step(name, fn)
+            except Exception:
+                log.exception("warm-up step %s failed", name)
+            else:
+                WARMUP_SECONDS.set(self.steps[name], step=name)
+        self.cold_start_s = round(time.perf_counter() - _T0, 4)
+        COLD_START_SECONDS.set(self.cold_start_s)
+        self.ready.set()
+        if self.cold_start_s > COLD_START_BUDGET_S:
+            log.warning("cold start took %.2f s, over the %.2f s budget (%s)", self.cold_start_s, COLD_START_BUDGET_S, self.steps)
+
+    def record_request(self, route: str, seconds: float):
+        """Called for every request; keeps the first one that is not a probe."""
+        if self.first_request is not None or route in PROBE_ROUTES:
+            return
+        with self._lock:
+            if self.first_request is not None:
+                return
+            self.first_request = (route, seconds)
+        from .metrics import FIRST_REQUEST_SECONDS
+        FIRST_REQUEST_SECONDS.set(seconds, route=route)
+        if seconds * 1e3 > FIRST_REQUEST_BUDGET_MS:
+            log.warning("first request (%s) took %.0f ms, over the %.0f ms budget", route, seconds * 1e3, FIRST_REQUEST_BUDGET_MS)
+
+    def status(self) -> dict:
+        first = self.first_request
+        return {"ready": self.ready.is_set(), "pid": os.getpid(), "warmed": ENABLED, "cold_start_s": self.cold_start_s,
+                "steps": dict(self.steps), "first_request": first and {"route": first[0], "ms": round(first[1] * 1e3, 3)},
+                "budgets": {"cold_start_s": COLD_START_BUDGET_S, "first_request_ms": FIRST_REQUEST_BUDGET_MS}}
+
+
+readiness = Readiness()
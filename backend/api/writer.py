@@ -0,0 +1,117 @@
+"""
+Write-behind batching for evaluation results.
+
+Evaluations finish on many threads (request threadpool, job workers, bulk streams) but
+SQLite has a single writer. Instead of each one taking the write lock and committing on
+its own, they hand their rows to one writer thread that drains everything queued within a
+few milliseconds and applies it in a single transaction, with one executemany upsert per
+table. Callers get a Future and wait on it, so a result is durable before it is returned.
+"""
+from concurrent.futures import Future
+from typing import Callable, List
+from .db import WriteSession
+import logging, os, queue, threading, time
+
+log = logging.getLogger(__name__)
+
+MAX_ITEMS = int(os.environ.get("OMR_WRITE_BATCH", 256))
+MAX_DELAY_S = float(os.environ.get("OMR_WRITE_DELAY_MS", 2)) / 1000
+
+_STOP = object()
+
+
+class BatchWriter:
+    def __init__(self, apply: Callable, max_items: int = MAX_ITEMS, max_delay_s: float = MAX_DELAY_S,
+                 name: str = "omr-writer", after_commit: Callable = None):
+        self.apply = apply                # apply(session, items) issues the writes, without committing
+        self.after_commit = after_commit  # after_commit(items) runs once they are durable
+        self.max_items = max_items
+        self.max_delay_s = max_delay_s
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.groups = self.items = self.failures = 0
+        self.flush_s = 0.0
+
+    def submit(self, items: List) -> Future:
+        fut = Future()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True, name=self.name)
+                self._thread.start()
+            self._queue.put((list(items), fut))
+        return fut
+
+    def write(self, items: List, timeout: float = None):
+        """Submit and block until the items are committed; re-raises the write's exception."""
+        return self.submit(items).result(timeout)
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            group, n = [first], len(first[0])
+            deadline = time.monotonic() + self.max_delay_s
+            stop = False
+            while n < self.max_items:
+                try:
+                    nxt = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if nxt is _STOP:
+                    stop = True
+                    break
+                group.append(nxt)
+                n += len(nxt[0])
+            self._flush(group)
+            if stop:
+                return
+
+    def _commit(self, group):
+        items = [item for items, _ in group for item in items]
+        with WriteSession() as db:
+            self.apply(db, items)
+            db.commit()
+        if self.after_commit:
+            self.after_commit(items)
+
+    def _flush(self, group):
+        t = time.perf_counter()
+        try:
+            self._commit(group)
+        except Exception as e:
+            if len(group) == 1:
+                self.failures += 1
+                log.exception("%s: write failed", self.name)
+                group[0][1].set_exception(e)
+                return
+            # one bad submission must not fail the others it was grouped with
+            for sub in group:
+                self._flush([sub])
+            return
+        self.groups += 1
+        self.items += sum(len(items) for items, _ in group)
+        self.flush_s += time.perf_counter() - t
+        for _, fut in group:
+            fut.set_result(None)
+
+    def shutdown(self, timeout: float = 10.0):
+        """Flush what is queued and stop the thread; a later submit starts a new one."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is not None and thread.is_alive():
+                self._queue.put(_STOP)
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "transactions": self.groups,
+            "items": self.items,
+            "failures": self.failures,
+            "items_per_transaction": round(self.items / self.groups, 2) if self.groups else 0.0,
+            "mean_flush_ms": round(1e3 * self.flush_s / self.groups, 3) if self.groups else 0.0,
+        }
@@ -0,0 +1,155 @@
+# backend/eval/answer_key.py
+"""
+Official answer-key ingestion. Every non-empty cell of the sheet is joined into one text
+buffer (cells separated by tabs, rows by newlines) and entries are pulled out with a single
+regex pass, so even large keys parse without per-cell Python work. Two layouts are accepted,
+freely mixed: "12-a" / "12: a,c" / "12. B" in one cell, or the question number in one cell
+and the answer in the next. Cells matching neither are reported back with their position.
+"""
+from typing import Dict, Iterable, List, NamedTuple
+import csv, io, json, re
+import numpy as np
+
+# one entry: number, then a separator inside the cell or a cell boundary, then option letters
+ENTRY = re.compile(
+    r"(?:^|(?<=\t)) *(\d+)(?:\.0)? *(?:[-:.)] *|\t *)([A-Za-z](?: *, *[A-Za-z])*) *(?=\t|$)",
+    re.MULTILINE,
+)
+MAX_REPORTED = 100
+
+
+class ParsedKey(NamedTuple):
+    answers: Dict[int, str]   # {question: "a" | "a,c"}
+    errors: List[dict]        # {"cell": "B7", "value": ..., "error": ...} for cells not understood or overridden
+
+
+def _column(i: int) -> str:
+    name = ""
+    i += 1
+    while i:
+        i, r = divmod(i - 1, 26)
+        name = chr(65 + r) + name
+    return name
+
+
+_BLANKS = str.maketrans("\t\r\n", "   ")
+
+
+def _text(v) -> str:
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)
+    return str(v).translate(_BLANKS).strip()
+
+
+def parse_rows(rows: Iterable[Iterable]) -> ParsedKey:
+    """Parse a stream of rows (tuples of cell values, None for empty) into an answer key."""
+    lines, starts, cells, values = [], [], [], []
+    pos = 0
+    for r, row in enumerate(rows, 1):
+        line = []
+        for c, v in enumerate(row):
+            if v is None:
+                continue
+            s = _text(v)
+            if s:
+                starts.append(pos)
+                cells.append((r, c))
+                values.append(s)
+                line.append(s)
+                pos += len(s) + 1   # trailing tab or newline
+        if line:
+            lines.append("\t".join(line))
+    text = "\n".join(lines)
+
+    found = [(m.group(1), m.group(2), m.start(1), m.end(2) - 1) for m in ENTRY.finditer(text)]
+    qs = np.array([int(f[0]) for f in found], dtype=np.int64)
+    keep = qs >= 1
+    starts = np.asarray(starts, dtype=np.int64)
+    first = np.searchsorted(starts, [f[2] for f in found], side="right")[keep] - 1
+    last = np.searchsorted(starts, [f[3] for f in found], side="right")[keep] - 1
+    qs = qs[keep]
+
+    # cells consumed by some entry: +1 at each entry's first cell, -1 past its last
+    cover = np.zeros(len(starts) + 1, dtype=np.int64)
+    np.add.at(cover, first, 1)
+    np.add.at(cover, last + 1, -1)
+    covered = np.cumsum(cover[:-1]) > 0
+
+    entries = [found[i] for i in np.flatnonzero(keep).tolist()]
+    answers = {int(q): a.replace(" ", "").lower() for q, a, _, _ in entries}   # later entries win, as before
+    errors = []
+    # each repeat of a question, paired with the occurrence before it (the one it overrides)
+    order = np.argsort(qs, kind="stable")
+    repeat = qs[order[1:]] == qs[order[:-1]]
+    later, earlier = order[1:][repeat], order[:-1][repeat]
+    for i, j in sorted(zip(later.tolist(), earlier.tolist())):
+        errors.append(_error(cells, values, first[i], f"duplicate question {qs[i]}; overrides {_cell(cells, first[j])}"))
+    for i in np.flatnonzero(~covered).tolist():
+        errors.append(_error(cells, values, i, "not a question/answer entry"))
+    return ParsedKey(answers, errors)
+
+
+def _cell(cells, i: int) -> str:
+    r, c = cells[i]
+    return f"{_column(c)}{r}"
+
+
+def _error(cells, values, i: int, message: str) -> dict:
+    return {"cell": _cell(cells, i), "value": values[i], "error": message}
+
+
+def _xlsx_rows(source):
+    from openpyxl import load_workbook
+    fh = open(source, "rb") if isinstance(source, str) else source   # openpyxl rejects paths without .xlsx
+    try:
+        wb = load_workbook(fh, read_only=True, data_only=True)
+        try:
+            yield from wb.worksheets[0].iter_rows(values_only=True)
+        finally:
+            wb.close()
+    finally:
+        if fh is not source:
+            fh.close()
+
+
+def _csv_rows(source):
+    fh = open(source, newline="", encoding="utf-8-sig") if isinstance(source, str) else \
+        io.TextIOWrapper(source, newline="", encoding="utf-8-sig")
+    with fh:
+        yield from csv.reader(fh)
+
+
+def read_table(source, filename: str):
+    """Rows of the first sheet of an .xlsx or of a .csv (path or binary file object), by file extension."""
+    name = (filename or "").lower()
+    if name.endswith(".xlsx"):
+        return _xlsx_rows(source)
+    if name.endswith(".csv"):
+        return _csv_rows(source)
+    raise ValueError(f"unsupported table format {filename!r}; expected .xlsx or .csv")
+
+
+def parse_answer_key(source, filename: str) -> ParsedKey:
+    """
+    Parse an official result upload (path or binary file object) by file extension:
+    .xlsx, .csv or .json ({"1": "a", "2": "b,c"}). Raises ValueError for other formats.
+    """
+    name = (filename or "").lower()
+    if name.endswith(".json"):
+        if isinstance(source, str):
+            with open(source, "rb") as fh:
+                raw = json.load(fh)
+        else:
+            raw = json.load(source)
+        return ParsedKey({int(q): str(a or "").lower() for q, a in raw.items()}, [])
+    if name.endswith((".xlsx", ".csv")):
+        return parse_rows(read_table(source, filename))
+    raise ValueError(f"unsupported answer key format {filename!r}; expected .xlsx, .csv or .json")
+
+
+def pad_answer_key(answers: Dict[int, str], n_questions: int) -> Dict[int, str]:
+    """Every question 1..n present (blank if missing), sorted by question number."""
+    out = dict(answers)
+    for q in range(1, n_questions + 1):
+        out.setdefault(q, "")
+    return {k: out[k] for k in sorted(out)}
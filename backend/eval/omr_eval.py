@@ -1,40 +1,301 @@
 # backend/eval/omr_eval.py
-from typing import Dict, List
-from backend.api.schemas import OMRResult, StudentMeta, QuestionBreakdown
-import random, base64, json
-
-def evaluate_omr_image(image_bytes: bytes, student_meta: StudentMeta, answer_key: Dict[int,str]=None) -> Dict:
-    """
-    Demo evaluator.
-    - If answer_key provided, this function will still produce a full OMRResult-style dict.
-    - For demo we randomly pick answers (deterministic via hash would be better).
-    In production replace with real OMR extraction.
-    """
-    total_questions = 100
-    if answer_key is None:
-        answer_key = {i+1: random.choice(['a','b','c','d']) for i in range(total_questions)}
-
-    qbreak = []
-    correct_count = 0
-    for i in range(total_questions):
-        qno = i + 1
-        sel = random.choice(['a','b','c','d', None])
-        is_correct = (sel == answer_key.get(qno))
-        if is_correct:
-            correct_count += 1
-        qbreak.append({"question_no": qno, "selected_option": sel if sel is not None else "", "is_correct": is_correct})
-
-    per_subject_scores = {f"sub_{i+1}": sum(1 for j in range(i*20, (i+1)*20) if qbreak[j]['is_correct']) for i in range(5)}
-    total_score = sum(per_subject_scores.values())
-
-    # for audit overlay placeholder
-    overlay_b64 = base64.b64encode(b"overlay-placeholder").decode('utf-8')
-
-    omr_result = {
-        "student_meta": student_meta.dict() if hasattr(student_meta, "dict") else student_meta,
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+from backend.api.schemas import StudentMeta
+from backend.api.metrics import stage
+from .scoring import CompiledKey, compile_answer_key, score_masks, mask_to_str, align
+from .templates import SheetTemplate, get_template
+import io, json, logging, os
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Every sheet is resampled to this working size on decode so a batch can be stacked into one array.
+SHEET_W, SHEET_H = 850, 1100
+
+FILL_THRESHOLD = 0.5   # mean ink inside a bubble above which it counts as marked
+_INK_THRESHOLD = 0.5   # normalized ink level treated as "dark" when locating the frame
+_EDGE_SAMPLES = 48
+
+# Coarse-to-fine: every sheet is first read at 1/COARSE of the working size (for JPEGs that is
+# libjpeg's cheapest DCT scaling). Bubbles whose coarse confidence is below REFINE_CONFIDENCE,
+# multi-marked questions whose weakest mark is below MULTI_CONFIDENCE (a possible erasure) and
+# sheets without a frame are re-read at the working size. Confidence is the distance of a
+# bubble's fill from FILL_THRESHOLD, scaled to 0..1.
+COARSE = int(os.environ.get("OMR_COARSE_SCALE", 4))
+REFINE_CONFIDENCE = 0.2
+MULTI_CONFIDENCE = 0.3
+REVIEW_CONFIDENCE = 0.2    # after the fine pass, bubbles below this are uncertain
+REVIEW_AMBIGUITY = float(os.environ.get("OMR_REVIEW_AMBIGUITY", 0.02))   # share of uncertain questions that flags a sheet
+
+
+MAX_PIXELS = 100_000_000   # refuse decompression bombs before any pixel data is decoded
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def _open(source, size: Tuple[int, int] = (SHEET_W, SHEET_H)):
+    """Open bytes, a file path or a binary file object and apply JPEG draft-mode scaling."""
+    from PIL import Image
+    img = Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source)
+    if img.size[0] * img.size[1] > MAX_PIXELS:
+        raise ImageTooLarge(f"Could not decode OMR image: {img.size[0]}x{img.size[1]} pixels is too large")
+    img.draft("L", size)   # JPEG: decode straight to grayscale at 1/2..1/8 scale
+    return img
+
+
+def estimate_decode_bytes(source) -> int:
+    """Peak memory needed to decode `source`, from its header alone."""
+    try:
+        img = _open(source)
+        return img.size[0] * img.size[1] * len(img.getbands()) + 2 * SHEET_W * SHEET_H
+    except Exception:
+        return 2 * SHEET_W * SHEET_H
+
+
+def decode_sheet(source, scale: int = 1) -> np.ndarray:
+    """
+    Decode a scan (bytes, path or file object) to a (SHEET_H, SHEET_W) uint8 grayscale array,
+    or to 1/scale of that size.
+    """
+    from PIL import Image
+    w, h = SHEET_W // scale, SHEET_H // scale
+    try:
+        if hasattr(source, "seek"):
+            source.seek(0)   # file objects are read once per pass
+        img = _open(source, (w, h)).convert("L")
+        factor = min(img.size[0] // w, img.size[1] // h)
+        if factor >= 2:
+            img = img.reduce(factor)   # cheap box downscale before the final resample
+        if img.size != (w, h):
+            img = img.resize((w, h), Image.BILINEAR)
+        return np.asarray(img, dtype=np.uint8)
+    except ImageTooLarge:
+        raise
+    except Exception as e:
+        # Pillow's messages name the spooled file on the server: log them, never return them
+        log.info("could not decode OMR image: %s", e)
+        raise ValueError("Could not decode OMR image: not a readable JPEG or PNG scan") from None
+
+
+def _normalize(stack: np.ndarray):
+    """Per-sheet paper/ink levels from a coarse subsample, so lighting differences cancel out."""
+    coarse = stack[:, ::8, ::8].reshape(len(stack), -1).astype(np.float32)
+    paper = np.percentile(coarse, 95, axis=1)
+    ink = np.percentile(coarse, 1, axis=1)
+    span = np.maximum(paper - ink, 16.0)
+    return paper, span
+
+
+def _fit_lines(pos: np.ndarray, hits: np.ndarray, valid: np.ndarray, default: float, tolerance: float):
+    """Least-squares fit hit = a*pos + b per sheet, ignoring invalid and samples further than `tolerance` from the median."""
+    h = np.where(valid, hits, np.nan)
+    med = np.nanmedian(np.where(valid.any(1, keepdims=True), h, default), axis=1, keepdims=True)
+    w = (valid & (np.abs(hits - med) < tolerance)).astype(np.float64)
+    n = np.maximum(w.sum(1, keepdims=True), 1)
+    pm = (w * pos).sum(1, keepdims=True) / n
+    hm = (w * hits).sum(1, keepdims=True) / n
+    var = (w * (pos - pm) ** 2).sum(1)
+    a = np.where(var > 0, (w * (pos - pm) * (hits - hm)).sum(1) / np.maximum(var, 1e-9), 0.0)
+    b = hm[:, 0] - a * pm[:, 0]
+    ok = w.sum(1) >= 4
+    return np.where(ok, a, 0.0), np.where(ok, b, default), ok
+
+
+def _first_dark(lines: np.ndarray, dark_level: np.ndarray):
+    """Index of the first dark pixel along axis 1 of (N, L, S) and whether one exists."""
+    dark = lines < dark_level[:, None, None]
+    return dark.argmax(axis=1).astype(np.float64), dark.any(axis=1)
+
+
+def _locate_frames(stack: np.ndarray, paper: np.ndarray, span: np.ndarray):
+    """Find the printed border on every sheet and return its corners, shape (N, 4, 2) as (x, y)."""
+    dark_level = paper - _INK_THRESHOLD * span
+    H, W = stack.shape[1:]
+    tol = 0.03 * max(W, H)
+    cols = np.linspace(0.2 * W, 0.8 * W, _EDGE_SAMPLES).astype(int)
+    rows = np.linspace(0.2 * H, 0.8 * H, _EDGE_SAMPLES).astype(int)
+
+    top, top_ok = _first_dark(stack[:, :, cols], dark_level)
+    bot, bot_ok = _first_dark(stack[:, ::-1, cols], dark_level)
+    left, left_ok = _first_dark(stack[:, rows, :].transpose(0, 2, 1), dark_level)
+    right, right_ok = _first_dark(stack[:, rows, ::-1].transpose(0, 2, 1), dark_level)
+
+    at, bt, ok1 = _fit_lines(cols, top, top_ok, 0.0, tol)                   # y = at*x + bt
+    ab, bb, ok2 = _fit_lines(cols, H - 1 - bot, bot_ok, H - 1.0, tol)
+    al, bl, ok3 = _fit_lines(rows, left, left_ok, 0.0, tol)                 # x = al*y + bl
+    ar, br, ok4 = _fit_lines(rows, W - 1 - right, right_ok, W - 1.0, tol)
+
+    def meet(ah, bh, av, bv):
+        x = (av * bh + bv) / (1 - av * ah)
+        return np.stack([x, ah * x + bh], -1)
+
+    corners = np.stack([meet(at, bt, al, bl), meet(at, bt, ar, br),
+                        meet(ab, bb, al, bl), meet(ab, bb, ar, br)], 1)
+    return corners, ok1 & ok2 & ok3 & ok4
+
+
+def _fill(stack, paper, span, centres, radius, offsets, sheet_idx, bubble_idx) -> np.ndarray:
+    """Mean ink of the selected bubbles: (M,) for M (sheet, bubble) index pairs, in one gather."""
+    H, W = stack.shape[1:]
+    pts = centres[sheet_idx, bubble_idx][:, None, :] + radius[sheet_idx, None, None] * offsets[None]   # (M, K, 2)
+    xs = np.clip(np.rint(pts[..., 0]), 0, W - 1).astype(np.intp)
+    ys = np.clip(np.rint(pts[..., 1]), 0, H - 1).astype(np.intp)
+    samples = stack[sheet_idx[:, None], ys, xs].astype(np.float32)
+    ink = np.clip((paper[sheet_idx, None] - samples) / span[sheet_idx, None], 0.0, 1.0)
+    return ink.mean(axis=1)
+
+
+def confidence(fill: np.ndarray) -> np.ndarray:
+    """0 for a fill level on the threshold, 1 for a clearly empty or clearly filled bubble."""
+    return np.clip(np.abs(fill - FILL_THRESHOLD) / (1 - FILL_THRESHOLD), 0.0, 1.0)
+
+
+def detect_sheets(stack: np.ndarray, template: SheetTemplate = None, only: np.ndarray = None) -> Dict[str, np.ndarray]:
+    """
+    Vectorized bubble reading for a (N, H, W) uint8 stack laid out per `template`, at any
+    resolution. Returns fill levels (N, Q, O), selection bitmasks (N, Q), per-sheet frame flags
+    and the frame corners (N, 4, 2) the bubbles were located from. With `only`, an (N, Q, O)
+    bool array, just those bubbles are sampled and the others read as 0.
+    """
+    tpl = template or get_template()
+    stack = np.asarray(stack, dtype=np.uint8)
+    if stack.ndim == 2:
+        stack = stack[None]
+    n = len(stack)
+    paper, span = _normalize(stack)
+    corners, frame_ok = _locate_frames(stack, paper, span)
+
+    # Every bubble centre in pixel space for every sheet, from the template's precomputed
+    # corner weights: (N, Q*O, 2); then all sample points of the wanted bubbles in one gather.
+    centres = np.einsum("bk,nkd->nbd", tpl.corner_weights, corners)
+    radius = tpl.bubble_r * np.linalg.norm(corners[:, 1] - corners[:, 0], axis=1)
+    fill = np.zeros((n, tpl.questions * tpl.options), dtype=np.float32)
+    if only is None:
+        si, bi = np.repeat(np.arange(n), fill.shape[1]), np.tile(np.arange(fill.shape[1]), n)
+    else:
+        si, bi = np.nonzero(only.reshape(n, -1))
+    fill[si, bi] = _fill(stack, paper, span, centres, radius, tpl.sample_offsets, si, bi)
+    fill = fill.reshape(n, tpl.questions, tpl.options)
+
+    marked = fill >= FILL_THRESHOLD
+    masks = (marked * tpl.option_bits).sum(axis=2).astype(np.uint8)
+    return {"fill": fill, "masks": masks, "frame_found": frame_ok, "corners": corners}
+
+
+def _review(fill: np.ndarray, frame_found: bool, refined: bool) -> Dict:
+    conf = confidence(fill).min(axis=1)   # per question: its least certain option
+    unsure = np.flatnonzero(conf < REVIEW_CONFIDENCE)
+    reasons = []
+    if not frame_found:
+        reasons.append("printed frame not found")
+    if len(unsure) > REVIEW_AMBIGUITY * len(conf):
+        reasons.append(f"{len(unsure)} question(s) with ambiguous bubbles")
+    return {"needs_review": bool(reasons), "reasons": reasons, "refined": refined,
+            "confidence": round(float(conf.mean()), 4) if len(conf) else 1.0,
+            "ambiguous_questions": (unsure + 1).tolist()}
+
+
+def read_sheets(sources: Sequence, template: SheetTemplate = None, coarse: np.ndarray = None) -> Dict:
+    """
+    Coarse-to-fine reading of many scans: one pass over all sheets at 1/COARSE size, then
+    the doubtful bubbles of the sheets that have any (see REFINE_CONFIDENCE) re-sampled at
+    the working size. Returns detect_sheets' arrays plus a `review` dict per sheet.
+    Pass `coarse` when the caller already decoded the sources with decode_sheet(s, COARSE).
+    """
+    tpl = template or get_template()
+    if coarse is None:
+        with stage("decode"):
+            coarse = np.stack([decode_sheet(s, COARSE) for s in sources])
+    with stage("detect"):
+        det = detect_sheets(coarse, tpl)
+        conf = confidence(det["fill"])
+        marked = det["fill"] >= FILL_THRESHOLD
+        weak_multi = (marked.sum(axis=2) > 1) & (np.where(marked, conf, 1.0).min(axis=2) < MULTI_CONFIDENCE)
+        redo = (conf < REFINE_CONFIDENCE) | weak_multi[:, :, None] | ~det["frame_found"][:, None, None]
+        sheets = np.flatnonzero(redo.any(axis=(1, 2)))
+    if len(sheets):
+        with stage("decode_fine"):
+            fine = np.stack([decode_sheet(sources[i]) for i in sheets])
+        with stage("detect_fine"):
+            fdet = detect_sheets(fine, tpl, only=redo[sheets])
+            for k in ("fill", "masks"):   # coarse readings stand for bubbles that were clear
+                det[k] = det[k].copy()
+            det["fill"][sheets] = np.where(redo[sheets], fdet["fill"], det["fill"][sheets])
+            det["masks"][sheets] = ((det["fill"][sheets] >= FILL_THRESHOLD) * tpl.option_bits).sum(axis=2)
+            det["frame_found"] = det["frame_found"].copy()
+            det["frame_found"][sheets] = fdet["frame_found"]
+            det["corners"] = det["corners"] * COARSE
+            det["corners"][sheets] = fdet["corners"]
+    else:
+        det["corners"] = det["corners"] * COARSE
+    refined = np.zeros(len(coarse), dtype=bool)
+    refined[sheets] = True
+    det["review"] = [_review(det["fill"][i], bool(det["frame_found"][i]), bool(refined[i])) for i in range(len(coarse))]
+    return det
+
+
+def pack_detection(masks: np.ndarray, review: Optional[Dict]) -> bytes:
+    """Detection cache entry: the (Q,) selection bytes, followed by the review as JSON when a sheet is flagged."""
+    tail = json.dumps(review).encode() if review and review["needs_review"] else b""
+    return np.asarray(masks, dtype=np.uint8).tobytes() + tail
+
+
+def unpack_detection(entry: bytes, questions: int) -> Tuple[np.ndarray, Optional[Dict]]:
+    tail = entry[questions:]
+    return np.frombuffer(entry[:questions], dtype=np.uint8), json.loads(tail) if tail else None
+
+
+def _build_result(meta, tpl: SheetTemplate, masks: np.ndarray, correct: np.ndarray, frame_found: bool,
+                  fill: np.ndarray, review: Dict) -> Dict:
+    qbreak = [{"question_no": q + 1, "selected_option": mask_to_str(m), "is_correct": bool(c)}
+              for q, (m, c) in enumerate(zip(masks.tolist(), correct.tolist()))]
+    per_subject_scores = tpl.section_scores(correct)
+
+    return {
+        "student_meta": meta.dict() if hasattr(meta, "dict") else meta,
         "per_subject_scores": per_subject_scores,
-        "total_score": total_score,
+        "total_score": int(correct.sum()),
         "question_breakdown": qbreak,
-        "audit": {"overlay_b64": overlay_b64}
+        # overlay images are rendered on demand from the stored scan, see backend/eval/overlay.py
+        "audit": {"frame_found": bool(frame_found), "template": tpl.name,
+                  "multi_marked": int((np.count_nonzero(fill >= FILL_THRESHOLD, axis=1) > 1).sum()),
+                  "needs_review": review["needs_review"], "review": review},
+        # raw per-question bitmasks so callers can re-score without parsing the breakdown
+        "selection_masks": masks,
     }
-    return omr_result
+
+
+def evaluate_omr_batch(images: Sequence, student_metas: Sequence[StudentMeta] = None,
+                       answer_key: Union[Dict[int, str], CompiledKey] = None, chunk_size: int = 32,
+                       template: Union[str, SheetTemplate] = None) -> List[Dict]:
+    """
+    Evaluate many sheets (bytes, paths or file objects) at once. Sheets are decoded, stacked
+    and read coarse-to-fine in chunks of `chunk_size` so peak memory stays bounded while
+    per-sheet Python work is minimal.
+    """
+    tpl = template if isinstance(template, SheetTemplate) else get_template(template)
+    metas = list(student_metas) if student_metas is not None else [None] * len(images)
+    key = answer_key if isinstance(answer_key, CompiledKey) else compile_answer_key(answer_key)
+    sheet_key = CompiledKey(align(key.masks, tpl.questions), key.version)   # questions as printed on the sheet
+    results = []
+    for start in range(0, len(images), chunk_size):
+        chunk = images[start:start + chunk_size]
+        det = read_sheets(chunk, tpl)
+        with stage("omr_result"):
+            correct = score_masks(sheet_key, det["masks"])
+            for i in range(len(chunk)):
+                results.append(_build_result(metas[start + i], tpl, det["masks"][i], correct[i],
+                                             det["frame_found"][i], det["fill"][i], det["review"][i]))
+    return results
+
+
+def evaluate_omr_image(image_bytes: bytes, student_meta: StudentMeta,
+                       answer_key: Union[Dict[int, str], CompiledKey] = None,
+                       template: Union[str, SheetTemplate] = None) -> Dict:
+    """
+    Decode one scan (bytes, path or file object), locate the printed frame and read all
+    bubbles in a single vectorized pass. Raises ValueError if the image cannot be decoded.
+    """
+    return evaluate_omr_batch([image_bytes], [student_meta], answer_key, template=template)[0]
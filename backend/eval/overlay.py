@@ -0,0 +1,49 @@
+# backend/eval/overlay.py
+"""
+Audit overlays: the scan at working size with every read bubble outlined. Green marks were
+correct, red marks were wrong, and correct answers the student missed are outlined in blue.
+Rendered on demand from the retained scan, never during evaluation.
+"""
+from .omr_eval import decode_sheet, detect_sheets
+from .templates import SheetTemplate
+import io
+import numpy as np
+
+VERSION = "1"   # part of every overlay's content hash; bump when the drawing changes
+
+GREEN, RED, BLUE = (20, 160, 60), (210, 30, 30), (30, 90, 220)
+
+
+def render_overlay(source, template: SheetTemplate, masks: np.ndarray, correct: np.ndarray,
+                   key_masks: np.ndarray, quality: int = 80) -> bytes:
+    """
+    JPEG overlay for one stored result. `masks`, `correct` and `key_masks` are the stored
+    (Q,) selections, correctness flags and answer key, so the picture matches the record
+    even if detection has changed since.
+    """
+    from PIL import Image, ImageDraw
+    gray = decode_sheet(source)
+    corners = detect_sheets(gray[None], template)["corners"][0]
+    q, o = template.questions, template.options
+    centres = (template.corner_weights @ corners).reshape(q, o, 2)
+    r = template.bubble_r * float(np.linalg.norm(corners[1] - corners[0]))
+
+    bits = template.option_bits
+    n = min(len(masks), q)
+    marked = np.zeros((q, o), dtype=bool)
+    marked[:n] = (np.asarray(masks[:n], dtype=np.uint8)[:, None] & bits) != 0
+    keyed = np.zeros((q, o), dtype=bool)
+    k = min(len(key_masks), q)
+    keyed[:k] = (np.asarray(key_masks[:k], dtype=np.uint8)[:, None] & bits) != 0
+    ok = np.zeros(q, dtype=bool)
+    ok[:min(len(correct), q)] = correct[:q]
+
+    img = Image.fromarray(gray).convert("RGB")
+    d = ImageDraw.Draw(img)
+    for (qi, oi), colour in [(i, GREEN if ok[i[0]] else RED) for i in zip(*np.nonzero(marked))] + \
+                            [(i, BLUE) for i in zip(*np.nonzero(keyed & ~marked))]:
+        x, y = centres[qi, oi]
+        d.ellipse([x - r, y - r, x + r, y + r], outline=colour, width=2)
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
@@ -0,0 +1,63 @@
+# backend/eval/pool.py
+"""CPU process pool for sheet detection, shared by bulk evaluation requests."""
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+import multiprocessing, os, threading
+
+_pool: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def pool_size() -> int:
+    return int(os.environ.get("OMR_DETECT_PROCESSES", 0)) or os.cpu_count() or 1
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _lock:
+        # a pool whose worker died (e.g. OOM-killed) fails every later submit; start a fresh one
+        if _pool is not None and getattr(_pool, "_broken", False):
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+        if _pool is None:
+            # spawn, not fork: the API process runs threads we must not duplicate mid-lock
+            _pool = ProcessPoolExecutor(max_workers=pool_size(), mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def warm_worker() -> int:
+    """Import the engine in a pool process and read one blank sheet; returns the worker's pid."""
+    from backend.api.warmup import blank_sheet
+    detect_chunk([blank_sheet()])
+    return os.getpid()
+
+
+def detect_chunk(images: List[bytes], template: str = None) -> List[Tuple[Optional[bytes], Optional[str]]]:
+    """
+    Worker entry point: read a chunk of sheets coarse-to-fine in one stacked pass.
+    Returns (detection cache entry, error) per sheet; bad images do not fail the chunk.
+    """
+    import numpy as np
+    from .omr_eval import COARSE, decode_sheet, pack_detection, read_sheets
+    from .templates import get_template
+
+    decoded, out = [], [None] * len(images)
+    for i, b in enumerate(images):
+        try:
+            decoded.append((i, decode_sheet(b, COARSE)))
+        except ValueError as e:
+            out[i] = (None, str(e))
+    if decoded:
+        det = read_sheets([images[i] for i, _ in decoded], get_template(template),
+                          coarse=np.stack([a for _, a in decoded]))
+        for (i, _), masks, review in zip(decoded, det["masks"], det["review"]):
+            out[i] = (pack_detection(masks, review), None)
+    return out
@@ -0,0 +1,46 @@
+# backend/eval/roster.py
+"""
+Student roster ingestion: one student per row, the id in the first column and the name in
+the second, or wherever a header row ("student_id" / "roll_no" / "name" ...) puts them.
+"""
+from typing import Dict, List, NamedTuple
+from .answer_key import read_table
+
+ID_HEADERS = {"student_id", "studentid", "student id", "id", "roll", "roll_no", "roll no", "rollno", "usn"}
+NAME_HEADERS = {"name", "student_name", "student name", "full name"}
+
+
+class ParsedRoster(NamedTuple):
+    students: Dict[str, str]   # {student_id: name}, in file order
+    errors: List[dict]         # {"row": 7, "value": ..., "error": ...}
+
+
+def _cell(v) -> str:
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)   # spreadsheet numbers: roll number 1001, not 1001.0
+    return "" if v is None else str(v).strip()
+
+
+def parse_roster(source, filename: str) -> ParsedRoster:
+    """Parse a .csv or .xlsx roster (path or binary file object). Raises ValueError for other formats."""
+    students, errors = {}, []
+    id_col, name_col, seen_row = 0, 1, False
+    for i, row in enumerate(read_table(source, filename), 1):
+        cells = [_cell(v) for v in row]
+        if not any(cells):
+            continue
+        if not seen_row:
+            seen_row = True
+            labels = [c.lower() for c in cells]
+            if any(c in ID_HEADERS for c in labels):
+                id_col = next(j for j, c in enumerate(labels) if c in ID_HEADERS)
+                name_col = next((j for j, c in enumerate(labels) if c in NAME_HEADERS), None)
+                continue
+        sid = cells[id_col] if id_col < len(cells) else ""
+        if not sid:
+            errors.append({"row": i, "value": ", ".join(c for c in cells if c), "error": "missing student id"})
+            continue
+        if sid in students:
+            errors.append({"row": i, "value": sid, "error": "duplicate student id; the later row wins"})
+        students[sid] = cells[name_col] if name_col is not None and name_col < len(cells) else ""
+    return ParsedRoster(students, errors)
@@ -0,0 +1,69 @@
+# backend/eval/scoring.py
+"""
+Answer keys and student selections as bitmasks: bit i of a question's byte is option i
+('a' = bit 0). Scoring a student, or a whole matrix of students, is one vectorized compare.
+"""
+from typing import Dict, NamedTuple, Optional
+import numpy as np
+
+OPTION_LETTERS = "abcdefg"
+UNMATCHABLE = 0x80   # key cell held something other than option letters; no sheet can match it
+
+# mask -> "a,c" display string, precomputed for every possible byte
+LABELS = [",".join(o for i, o in enumerate(OPTION_LETTERS) if m >> i & 1) for m in range(256)]
+
+
+class CompiledKey(NamedTuple):
+    masks: np.ndarray        # (Q,) uint8, masks[q-1] is the correct option set of question q
+    version: int = 0
+
+
+def parse_selection(ans: Optional[str]) -> int:
+    mask = 0
+    for opt in str(ans or "").lower().split(","):
+        opt = opt.strip()
+        if not opt:
+            continue
+        if len(opt) == 1 and opt in OPTION_LETTERS:
+            mask |= 1 << OPTION_LETTERS.index(opt)
+        else:
+            mask |= UNMATCHABLE
+    return mask
+
+
+def mask_to_str(mask: int) -> str:
+    return LABELS[int(mask) & 0x7F]
+
+
+def compile_answer_key(answer_key: Dict, version: int = 0) -> CompiledKey:
+    """Compile {question: "a" | "a,c" | ""} into a dense per-question bitmask array."""
+    parsed = {int(q): parse_selection(a) for q, a in (answer_key or {}).items() if int(q) >= 1}
+    masks = np.zeros(max(parsed, default=0), dtype=np.uint8)
+    for q, m in parsed.items():
+        masks[q - 1] = m
+    return CompiledKey(masks, version)
+
+
+def key_from_bytes(blob: bytes, version: int = 0) -> CompiledKey:
+    return CompiledKey(np.frombuffer(blob, dtype=np.uint8), version)
+
+
+def align(student_masks: np.ndarray, n_questions: int) -> np.ndarray:
+    """Pad or trim selections (..., Q_sheet) to the key length."""
+    student_masks = np.asarray(student_masks, dtype=np.uint8)
+    q = student_masks.shape[-1]
+    if q == n_questions:
+        return student_masks
+    if q > n_questions:
+        return student_masks[..., :n_questions]
+    pad = [(0, 0)] * (student_masks.ndim - 1) + [(0, n_questions - q)]
+    return np.pad(student_masks, pad)
+
+
+def score_masks(key: CompiledKey, student_masks: np.ndarray) -> np.ndarray:
+    """
+    Exact-set comparison against the key for one student (Q,) or many (N, Q).
+    Blank key entries are never correct. Returns a bool array of the same shape.
+    """
+    sm = align(student_masks, len(key.masks))
+    return (sm == key.masks) & (key.masks != 0)
@@ -0,0 +1,145 @@
+# backend/eval/templates.py
+"""
+Sheet templates: question count, options per question, subject sections and bubble geometry.
+Geometry is in frame-normalized coordinates (0..1 inside the printed border), so it is
+independent of scan resolution. Each template compiles once into the arrays the detector
+needs: bilinear corner weights for every bubble, the in-bubble sampling pattern and the
+section index used for per-subject totals.
+"""
+from functools import cached_property
+from typing import Dict, List, Tuple
+import json, os
+import numpy as np
+from .scoring import OPTION_LETTERS
+
+DEFAULT_TEMPLATE = "std-100x4"
+
+# k x k sampling grid covering the inscribed square of a bubble, so the printed outline
+# never contributes to the fill level
+_K = 7
+_OFFS = np.stack(np.meshgrid(np.linspace(-0.6, 0.6, _K), np.linspace(-0.6, 0.6, _K)), -1).reshape(-1, 2)
+
+
+class SheetTemplate:
+    def __init__(self, name: str, bubble_u, bubble_v, bubble_r: float, sections: Dict[str, Tuple[int, int]],
+                 description: str = ""):
+        self.name = name
+        self.bubble_u = np.asarray(bubble_u, dtype=np.float64)   # (Q, O)
+        self.bubble_v = np.asarray(bubble_v, dtype=np.float64)   # (Q, O)
+        if self.bubble_u.shape != self.bubble_v.shape or self.bubble_u.ndim != 2:
+            raise ValueError(f"template {name}: bubble_u and bubble_v must both be (questions, options)")
+        # selections are uint8 masks with the top bit reserved for UNMATCHABLE
+        if not 1 <= self.bubble_u.shape[1] <= len(OPTION_LETTERS):
+            raise ValueError(f"template {name}: options must be 1..{len(OPTION_LETTERS)}, "
+                             f"got {self.bubble_u.shape[1]}")
+        self.bubble_r = float(bubble_r)   # bubble radius as a fraction of frame width
+        self.sections = {k: (int(v[0]), int(v[1])) for k, v in sections.items()}
+        self.description = description
+
+    @property
+    def questions(self) -> int:
+        return self.bubble_u.shape[0]
+
+    @property
+    def options(self) -> int:
+        return self.bubble_u.shape[1]
+
+    @cached_property
+    def corner_weights(self) -> np.ndarray:
+        """(Q*O, 4) bilinear weights of the TL, TR, BL, BR frame corners for every bubble centre."""
+        u, v = self.bubble_u.reshape(-1, 1), self.bubble_v.reshape(-1, 1)
+        return np.concatenate([(1 - u) * (1 - v), u * (1 - v), (1 - u) * v, u * v], 1)
+
+    @cached_property
+    def sample_offsets(self) -> np.ndarray:
+        """(K, 2) sampling offsets in units of the bubble radius."""
+        return _OFFS
+
+    @cached_property
+    def option_bits(self) -> np.ndarray:
+        return (1 << np.arange(self.options)).astype(np.uint8)
+
+    @cached_property
+    def section_index(self) -> Tuple[List[str], np.ndarray]:
+        """Section names and a (Q,) array of section ids (-1 = not in any section)."""
+        names = list(self.sections)
+        ids = np.full(self.questions, -1, dtype=np.intp)
+        for i, (first, last) in enumerate(self.sections.values()):
+            ids[first - 1:last] = i
+        return names, ids
+
+    def compile(self) -> "SheetTemplate":
+        """Materialize every cached array up front (done once at registration)."""
+        self.corner_weights, self.sample_offsets, self.option_bits, self.section_index
+        return self
+
+    def section_scores(self, correct: np.ndarray) -> Dict[str, int]:
+        names, ids = self.section_index
+        valid = ids >= 0
+        sums = np.bincount(ids[valid], weights=correct[:len(ids)][valid], minlength=len(names))
+        return {n: int(s) for n, s in zip(names, sums)}
+
+    def describe(self, geometry: bool = False) -> dict:
+        out = {"name": self.name, "questions": self.questions, "options": self.options,
+               "sections": {k: list(v) for k, v in self.sections.items()}, "description": self.description}
+        if geometry:
+            out.update(bubble_u=self.bubble_u.tolist(), bubble_v=self.bubble_v.tolist(), bubble_r=self.bubble_r)
+        return out
+
+
+def grid_template(name: str, columns: int, rows: int, options: int = 4, x0: float = 0.1, col_step: float = 0.19,
+                  opt_step: float = 0.033, y0: float = 0.06, row_step: float = 0.045, bubble_r: float = 0.011,
+                  sections: Dict[str, Tuple[int, int]] = None, description: str = "") -> SheetTemplate:
+    """Questions numbered down each column; by default one section per column."""
+    q = np.arange(columns * rows)
+    col, row = q // rows, q % rows
+    u = x0 + col[:, None] * col_step + np.arange(options)[None, :] * opt_step
+    v = np.broadcast_to((y0 + row * row_step)[:, None], u.shape)
+    if sections is None:
+        sections = {f"sub_{i+1}": (i * rows + 1, (i + 1) * rows) for i in range(columns)}
+    return SheetTemplate(name, u, v, bubble_r, sections, description)
+
+
+_registry: Dict[str, SheetTemplate] = {}
+
+
+def register(template: SheetTemplate) -> SheetTemplate:
+    _registry[template.name] = template.compile()
+    return template
+
+
+def get_template(name: str = None) -> SheetTemplate:
+    try:
+        return _registry[name or DEFAULT_TEMPLATE]
+    except KeyError:
+        raise ValueError(f"Unknown sheet template: {name}")
+
+
+def list_templates() -> List[SheetTemplate]:
+    return list(_registry.values())
+
+
+def template_from_dict(spec: dict) -> SheetTemplate:
+    """Either {"grid": {...grid_template kwargs}} or explicit "bubble_u"/"bubble_v"/"bubble_r"."""
+    if "grid" in spec:
+        return grid_template(spec["name"], sections=spec.get("sections"), description=spec.get("description", ""),
+                             **spec["grid"])
+    return SheetTemplate(spec["name"], spec["bubble_u"], spec["bubble_v"], spec["bubble_r"], spec["sections"],
+                         spec.get("description", ""))
+
+
+def load_dir(path: str):
+    """Register every *.json template definition in `path`."""
+    for fn in sorted(os.listdir(path)):
+        if fn.endswith(".json"):
+            with open(os.path.join(path, fn)) as fh:
+                register(template_from_dict(json.load(fh)))
+
+
+register(grid_template(DEFAULT_TEMPLATE, columns=5, rows=20, description="100 questions, 4 options, 5 subjects x 20"))
+register(grid_template("std-50x4", columns=5, rows=10, row_step=0.09, description="50 questions, 4 options, 5 subjects x 10"))
+register(grid_template("std-60x5", columns=3, rows=20, options=5, col_step=0.3, opt_step=0.045,
+                       description="60 questions, 5 options, 3 subjects x 20"))
+
+if os.environ.get("OMR_TEMPLATE_DIR"):
+    load_dir(os.environ["OMR_TEMPLATE_DIR"])
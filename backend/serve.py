@@ -0,0 +1,39 @@
+"""
+Production server: several uvicorn worker processes sharing one listening socket.
+
+    python -m backend.serve [--workers N] [--host 0.0.0.0] [--port 8000]
+
+Migrations run once here, before any worker starts, and the workers skip them. Each
+worker warms up in its startup hook and only then accepts connections; GET /api/ready
+reports its cold start. Detection processes for bulk uploads are split between the
+workers unless OMR_DETECT_PROCESSES is set. Job workers (OMR_JOB_WORKERS), caches and
+the decode memory budget (OMR_INFLIGHT_BYTES) are per worker.
+"""
+import argparse, logging, os
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default=os.environ.get("OMR_HOST", "0.0.0.0"))
+    ap.add_argument("--port", type=int, default=int(os.environ.get("OMR_PORT", 8000)))
+    ap.add_argument("--workers", type=int, default=int(os.environ.get("OMR_WORKERS", 0)) or cpus)
+    ap.add_argument("--log-level", default=os.environ.get("OMR_LOG_LEVEL", "info"))
+    args = ap.parse_args()
+    logging.basicConfig(level=args.log_level.upper())
+
+    from backend.api.db import engine
+    from backend.api.migrations import upgrade
+    upgrade(engine)
+    engine.dispose()   # no pooled connections carried into the workers
+    os.environ["OMR_SKIP_MIGRATIONS"] = "1"
+    # each worker would otherwise start a pool of cpu_count detection processes
+    os.environ.setdefault("OMR_DETECT_PROCESSES", str(max(1, cpus // args.workers)))
+
+    import uvicorn
+    uvicorn.run("backend.api.main:app", host=args.host, port=args.port, workers=args.workers,
+                log_level=args.log_level)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Answer-key ingestion benchmark: the streaming parser against the previous
+pd.read_excel + iterrows loop, on generated keys of increasing size.
+
+    python -m benchmarks.bench_answer_key [--sizes 200 2000 20000] [--repeat 5]
+"""
+import argparse, os, random, tempfile, time
+import pandas as pd
+from openpyxl import Workbook
+from backend.eval.answer_key import parse_answer_key
+
+LETTERS = "abcd"
+
+
+def make_key(n: int, seed: int = 0):
+    rnd = random.Random(seed)
+    key = {}
+    for q in range(1, n + 1):
+        k = 1 if rnd.random() < 0.8 else 2   # some multi-answer questions
+        key[q] = ",".join(sorted(rnd.sample(LETTERS, k)))
+    return key
+
+
+def write_xlsx(path: str, key: dict, sets: int = 5):
+    """Key laid out as `sets` side-by-side blocks of "q-ans" cells, like the printed multi-set sheets."""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    per = -(-len(key) // sets)
+    items = list(key.items())
+    for r in range(per):
+        ws.append([f"{q}-{a}" for q, a in items[r::per]])
+    wb.save(path)
+
+
+def write_csv(path: str, key: dict):
+    with open(path, "w") as fh:
+        fh.write("question,answer\n")
+        for q, a in key.items():
+            fh.write(f'{q},"{a}"\n')
+
+
+def legacy_xlsx(path: str) -> dict:
+    df = pd.read_excel(path, header=None)
+    answer_key = {}
+    for _, row in df.iterrows():
+        for cell in row.dropna():
+            try:
+                cell_str = str(cell).replace(":", "-").replace(".", "-").replace(" ", "")
+                parts = cell_str.split("-")
+                if len(parts) >= 2:
+                    answer_key[int(parts[0])] = parts[1].lower()
+            except Exception:
+                continue
+    return answer_key
+
+
+def best_of(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    return min(times)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[200, 2000, 20000])
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    print(f"{'questions':>10} {'legacy xlsx ms':>15} {'xlsx ms':>10} {'csv ms':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            key = make_key(n)
+            xlsx, csv_path = os.path.join(tmp, f"{n}.xlsx"), os.path.join(tmp, f"{n}.csv")
+            write_xlsx(xlsx, key)
+            write_csv(csv_path, key)
+            assert parse_answer_key(xlsx, xlsx).answers == key
+            assert parse_answer_key(csv_path, csv_path).answers == key
+            legacy = best_of(lambda: legacy_xlsx(xlsx), args.repeat)
+            fast = best_of(lambda: parse_answer_key(xlsx, xlsx), args.repeat)
+            csv_t = best_of(lambda: parse_answer_key(csv_path, csv_path), args.repeat)
+            print(f"{n:>10} {legacy * 1e3:>15.1f} {fast * 1e3:>10.1f} {csv_t * 1e3:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""
+Benchmark harness: detection, scoring, answer-key parsing, database writes and the
+evaluate_student / final_results endpoints end to end, each at several batch sizes, on
+synthetic sheets from benchmarks.synth, plus the cold start of `python -m backend.serve`.
+Runs against a throwaway database and cache dir.
+
+    python -m benchmarks.run [--quick] [--only detect,e2e]
+    python -m benchmarks.run --save benchmarks/baselines/local.json
+    python -m benchmarks.run --compare benchmarks/baselines/local.json [--tolerance 0.3]
+
+With --compare the exit status is 1 if any case lost more than `tolerance` of its
+throughput, its p95 latency grew by more than that, or detection accuracy dropped,
+relative to the baseline. Cases with a `budget_ms` (cold start, first request) also fail
+when their p95 is over budget, baseline or not.
+"""
+import os, sys, tempfile
+
+# isolate every bit of state before the API modules read their settings
+_TMP = tempfile.mkdtemp(prefix="omr-bench-")
+os.environ["OMR_SQLITE_URL"] = f"sqlite:///{_TMP}/bench.db"
+os.environ["OMR_DETECTION_CACHE_DIR"] = os.path.join(_TMP, "detections")
+os.environ["OMR_JOB_DIR"] = os.path.join(_TMP, "jobs")
+os.environ["OMR_SCAN_DIR"] = os.path.join(_TMP, "scans")
+os.environ["OMR_OVERLAY_DIR"] = os.path.join(_TMP, "overlays")
+
+import argparse, json, platform, shutil, socket, subprocess, time
+import numpy as np
+from benchmarks.synth import make_batch, random_masks
+from benchmarks.bench_answer_key import make_key, write_csv, write_xlsx
+
+CASES = {}
+
+
+def case(group: str):
+    def register(fn):
+        CASES.setdefault(group, []).append(fn)
+        return fn
+    return register
+
+
+def measure(fn, items: int, repeat: int = 3, unit: str = "items/s", **extra) -> dict:
+    """Best-of-`repeat` throughput of fn() processing `items` items."""
+    best = min(_timed(fn) for _ in range(repeat))
+    return {"unit": unit, "throughput": round(items / best, 2), "seconds": round(best, 6), **extra}
+
+
+def latencies(fn, calls, unit: str = "requests/s", **extra) -> dict:
+    """Call fn(arg) for each arg, reporting throughput and per-call latency percentiles."""
+    ts = np.array([_timed(lambda: fn(a)) for a in calls])
+    return {"unit": unit, "throughput": round(len(ts) / ts.sum(), 2), "p50_ms": round(1e3 * np.percentile(ts, 50), 3),
+            "p95_ms": round(1e3 * np.percentile(ts, 95), 3), **extra}
+
+
+def _timed(fn) -> float:
+    t = time.perf_counter()
+    fn()
+    return time.perf_counter() - t
+
+
+# -------- DETECTION --------
+@case("detect")
+def bench_detect(quick: bool):
+    from backend.eval.omr_eval import decode_sheet, detect_sheets, read_sheets
+    out = {}
+    sheets = make_batch(8 if quick else 32, seed=1, rotate=1.0, noise=6, partial=0.1, faint=0.1)
+    clean = make_batch(8 if quick else 32, seed=2, rotate=0.5, noise=2)
+    for b in ((1, 8) if quick else (1, 8, 32)):
+        chunk = sheets[:b]
+        decoded = np.stack([decode_sheet(s.image) for s in chunk])
+        masks = detect_sheets(decoded)["masks"]
+        acc = float(np.mean([(s.masks == m).mean() for s, m in zip(chunk, masks)]))
+        out[f"decode[b={b}]"] = measure(lambda: [decode_sheet(s.image) for s in chunk], b, unit="sheets/s")
+        out[f"detect[b={b}]"] = measure(lambda: detect_sheets(decoded), b, unit="sheets/s", accuracy=round(acc, 5))
+        # decode + read, coarse-to-fine, on hard and on clean scans
+        for label, group in (("hard", chunk), ("clean", clean[:b])):
+            images = [s.image for s in group]
+            det = read_sheets(images)
+            acc = float(np.mean([(s.masks == m).mean() for s, m in zip(group, det["masks"])]))
+            out[f"read[{label},b={b}]"] = measure(lambda: read_sheets(images), b, unit="sheets/s", accuracy=round(acc, 5),
+                                                  refined=sum(r["refined"] for r in det["review"]))
+    return out
+
+
+# -------- SCORING --------
+@case("score")
+def bench_score(quick: bool):
+    from backend.eval.scoring import CompiledKey, score_masks
+    rng = np.random.default_rng(2)
+    key = CompiledKey(random_masks(100, rng=rng, blank=0))
+    out = {}
+    for n in ((1000,) if quick else (1000, 100_000)):
+        masks = np.stack([random_masks(100, rng=rng) for _ in range(min(n, 1000))])
+        masks = np.resize(masks, (n, 100))
+        out[f"score[n={n}]"] = measure(lambda: score_masks(key, masks), n, repeat=5, unit="sheets/s")
+    return out
+
+
+# -------- ANSWER KEYS --------
+@case("answer_key")
+def bench_answer_key(quick: bool):
+    from backend.eval.answer_key import parse_answer_key
+    out = {}
+    for n in ((200,) if quick else (200, 2000)):
+        key = make_key(n)
+        xlsx, csv_path = os.path.join(_TMP, f"key{n}.xlsx"), os.path.join(_TMP, f"key{n}.csv")
+        write_xlsx(xlsx, key)
+        write_csv(csv_path, key)
+        out[f"answer_key[xlsx,q={n}]"] = measure(lambda: parse_answer_key(xlsx, xlsx), n, repeat=5, unit="questions/s")
+        out[f"answer_key[csv,q={n}]"] = measure(lambda: parse_answer_key(csv_path, csv_path), n, repeat=5,
+                                                unit="questions/s")
+    return out
+
+
+# -------- API SETUP --------
+_api = {}
+
+
+def api():
+    """Test client with one college, one batch and an uploaded answer key."""
+    if not _api:
+        from fastapi.testclient import TestClient
+        from backend.api.main import app
+        from backend.eval.scoring import mask_to_str
+        client = TestClient(app)
+        cid = client.post("/api/signup", data={"name": "bench", "email": "bench@example.com", "password": "x"}).json()["id"]
+        bid = client.post("/api/batches", data={"college_id": cid, "name": "bench"}).json()["id"]
+        key = random_masks(100, rng=np.random.default_rng(3), blank=0)
+        body = json.dumps({q + 1: mask_to_str(m) for q, m in enumerate(key.tolist())})
+        client.post(f"/api/batches/{bid}/official_result", files={"file": ("key.json", body, "application/json")})
+        _api.update(client=client, college_id=cid, batch_id=bid, key=key)
+    return _api
+
+
+# -------- DATABASE WRITES --------
+@case("db")
+def bench_db(quick: bool):
+    from backend.api import evaluation, schemas
+    from backend.api.db import SessionLocal, db_stats
+    a = api()
+    with SessionLocal() as db:
+        key = evaluation.load_answer_key(db, a["batch_id"])
+    rng = np.random.default_rng(4)
+    out, run = {}, [0]
+    for b in ((1, 16) if quick else (1, 16, 128)):
+        rounds = max(256 // b, 4)
+
+        def write():
+            for _ in range(rounds):
+                run[0] += 1
+                metas = [schemas.StudentMeta(student_id=f"db{run[0]}-{i}", college_id=a["college_id"],
+                                             batch_id=a["batch_id"]) for i in range(b)]
+                masks = np.stack([random_masks(100, rng=rng) for _ in range(b)])
+                evaluation.result_writer.write(evaluation.score_many(metas, key, masks))
+        out[f"db_write[b={b}]"] = measure(write, rounds * b, repeat=1, unit="rows/s")
+    out["db_write"] = {"unit": "info", "sqlite": db_stats.stats(), "writer": evaluation.result_writer.stats()}
+    return out
+
+
+# -------- END TO END --------
+@case("e2e")
+def bench_e2e(quick: bool):
+    a = api()
+    c, out = a["client"], {}
+    for n in ((5,) if quick else (10, 50)):
+        sheets = make_batch(n, seed=100 + n, rotate=1.0, noise=6)
+
+        def post(i, prefix):
+            meta = {"student_id": f"{prefix}{n}-{i}", "college_id": a["college_id"], "batch_id": a["batch_id"]}
+            r = c.post("/api/evaluate_student", files={"file": ("s.jpg", sheets[i].image, "image/jpeg")},
+                       data={"student_meta": json.dumps(meta)})
+            assert r.status_code == 200, r.text
+        out[f"evaluate_student[n={n}]"] = latencies(lambda i: post(i, "e"), range(n))
+        # same scans again: detection comes from the content-addressed cache
+        out[f"evaluate_student[n={n},cached]"] = latencies(lambda i: post(i, "r"), range(n))
+
+    url = f"/api/batches/{a['batch_id']}/final_results"
+    rows = len(c.get(url, params={"view": "summary"}).json())
+    for view in ("summary", "full"):
+        out[f"final_results[{view}]"] = latencies(
+            lambda _: c.get(url, params={"view": view}).raise_for_status(), range(5 if quick else 20), rows=rows)
+    out["final_results[export]"] = latencies(
+        lambda _: c.get(f"{url}/export").raise_for_status(), range(5 if quick else 20), rows=rows)
+    return out
+
+
+# -------- COLD START --------
+def _serve(client, workers: int, warm: bool):
+    """Start backend.serve on a free port; returns (process, base url, seconds until /api/ready)."""
+    import httpx
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ, OMR_WARMUP="1" if warm else "0")
+    t = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "backend.serve", "--host", "127.0.0.1", "--port", str(port),
+                             "--workers", str(workers), "--log-level", "warning"], env=env)
+    url = f"http://127.0.0.1:{port}/api"
+    while True:
+        if proc.poll() is not None:
+            raise RuntimeError(f"backend.serve exited with {proc.returncode}")
+        try:
+            if client.get(f"{url}/ready", timeout=1).status_code == 200:
+                return proc, url, time.perf_counter() - t
+        except httpx.TransportError:
+            pass
+        time.sleep(0.01)
+
+
+@case("coldstart")
+def bench_coldstart(quick: bool):
+    import httpx
+    from backend.api.warmup import COLD_START_BUDGET_S, FIRST_REQUEST_BUDGET_MS
+    a = api()   # the servers share the bench database, so the batch and its key already exist
+    runs = ((1, True), (1, False)) + (() if quick else ((2, True),))
+    # a sheet per server: the detection cache is shared too, and must not answer the first request
+    sheets = make_batch(len(runs), seed=7, rotate=1.0, noise=6)
+    out, client = {}, httpx.Client(timeout=60)
+    for (workers, warm), sheet in zip(runs, sheets):
+        proc, url, ready_s = _serve(client, workers, warm)
+        try:
+            meta = {"student_id": f"cold{workers}{warm}", "college_id": a["college_id"], "batch_id": a["batch_id"]}
+            t = time.perf_counter()
+            r = client.post(f"{url}/evaluate_student", files={"file": ("s.jpg", sheet.image, "image/jpeg")},
+                            data={"student_meta": json.dumps(meta)})
+            first_s = time.perf_counter() - t
+            assert r.status_code == 200, r.text
+            server = client.get(f"{url}/ready").json()
+        finally:
+            proc.terminate()
+            proc.wait(30)
+        tag = f"workers={workers}" + ("" if warm else ",no_warmup")
+        # budgets hold for warmed servers; the unwarmed run shows what warm-up buys
+        out[f"cold_start[{tag}]"] = {"unit": "starts/s", "throughput": round(1 / ready_s, 3),
+                                     "p50_ms": round(1e3 * ready_s, 1), "p95_ms": round(1e3 * ready_s, 1),
+                                     "server_cold_start_s": server["cold_start_s"], "steps": server["steps"],
+                                     **({"budget_ms": 1e3 * COLD_START_BUDGET_S} if warm else {})}
+        out[f"first_request[{tag}]"] = {"unit": "requests/s", "throughput": round(1 / first_s, 2),
+                                        "p50_ms": round(1e3 * first_s, 1), "p95_ms": round(1e3 * first_s, 1),
+                                        **({"budget_ms": FIRST_REQUEST_BUDGET_MS} if warm else {})}
+    return out
+
+
+# -------- BASELINES --------
+def compare(current: dict, baseline: dict, tolerance: float):
+    """Cases slower than the baseline by more than `tolerance`, as printable lines."""
+    bad = []
+    for name, now in current.items():
+        then = baseline.get(name)
+        if not then or now.get("unit") == "info":
+            continue
+        if then.get("throughput") and now["throughput"] < then["throughput"] * (1 - tolerance):
+            bad.append(f"{name}: throughput {now['throughput']} < baseline {then['throughput']}")
+        if then.get("p95_ms") and now.get("p95_ms", 0) > then["p95_ms"] * (1 + tolerance):
+            bad.append(f"{name}: p95 {now['p95_ms']} ms > baseline {then['p95_ms']} ms")
+        if "accuracy" in then and now.get("accuracy", 0) < then["accuracy"] - 1e-3:
+            bad.append(f"{name}: accuracy {now.get('accuracy')} < baseline {then['accuracy']}")
+    return bad
+
+
+def over_budget(current: dict):
+    return [f"{name}: p95 {r['p95_ms']} ms > budget {r['budget_ms']} ms"
+            for name, r in current.items() if r.get("budget_ms") and r["p95_ms"] > r["budget_ms"]]
+
+
+def environment() -> dict:
+    return {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+            "cpus": os.cpu_count(), "platform": platform.platform(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--quick", action="store_true", help="smaller batch sizes, for CI")
+    ap.add_argument("--only", default="", help=f"comma-separated groups: {','.join(CASES)}")
+    ap.add_argument("--save", help="write results as a baseline JSON file")
+    ap.add_argument("--compare", help="baseline JSON file to check against")
+    ap.add_argument("--tolerance", type=float, default=0.3)
+    args = ap.parse_args()
+
+    groups = [g for g in args.only.split(",") if g] or list(CASES)
+    results = {}
+    try:
+        for g in groups:
+            for fn in CASES[g]:
+                results.update(fn(args.quick))
+    finally:
+        shutil.rmtree(_TMP, ignore_errors=True)
+
+    print(f"{'case':<40} {'throughput':>14} {'unit':<12} {'p50 ms':>9} {'p95 ms':>9}")
+    for name, r in results.items():
+        if r["unit"] != "info":
+            print(f"{name:<40} {r['throughput']:>14,.1f} {r['unit']:<12} {r.get('p50_ms', ''):>9} {r.get('p95_ms', ''):>9}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as fh:
+            json.dump({"environment": environment(), "quick": args.quick, "cases": results}, fh, indent=1)
+        print(f"baseline written to {args.save}")
+    over = over_budget(results)
+    for line in over:
+        print("OVER BUDGET", line)
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+        bad = compare(results, baseline["cases"], args.tolerance)
+        for line in bad:
+            print("REGRESSION", line)
+        if bad or over:
+            sys.exit(1)
+        print(f"no regressions beyond {args.tolerance:.0%} against {args.compare}")
+    elif over:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Synthetic OMR sheets with known ground truth, drawn from a sheet template: the printed frame,
+every bubble outline, and marks with configurable scan noise, rotation, faint pencil and
+partially filled bubbles.
+
+    python -m benchmarks.synth --out fixtures/ --n 20 [--template std-100x4] [--rotate 1.0]
+
+writes sheet_000.jpg ... plus truth.json ({"key": {...}, "sheets": {file: {q: "a,c"}}}).
+"""
+from typing import List, NamedTuple
+import argparse, io, json, os
+import numpy as np
+from PIL import Image, ImageDraw
+from backend.eval.scoring import mask_to_str
+from backend.eval.templates import get_template
+
+PAPER, INK, OUTLINE = 245, 20, 60
+
+
+class SyntheticSheet(NamedTuple):
+    image: bytes           # encoded scan
+    masks: np.ndarray      # (Q,) uint8 selections a reader should report
+    partial: np.ndarray    # (Q, O) bool, bubbles drawn only partly filled (still count as marked)
+
+
+def random_masks(n_questions: int, options: int = 4, rng=None, blank: float = 0.05, multi: float = 0.05) -> np.ndarray:
+    """Mostly single answers, with some blanks and multi-marked questions."""
+    rng = rng or np.random.default_rng()
+    single = (1 << rng.integers(0, options, n_questions)).astype(np.uint8)
+    second = (1 << rng.integers(0, options, n_questions)).astype(np.uint8)
+    u = rng.random(n_questions)
+    return np.where(u < blank, 0, np.where(u < blank + multi, single | second, single)).astype(np.uint8)
+
+
+def render(masks, template=None, width: int = 1700, height: int = 2200, margin: float = 0.05,
+           rotate: float = 0.0, noise: float = 0.0, faint: float = 0.0, partial: float = 0.0,
+           stray: float = 0.0, quality: int = 85, fmt: str = "JPEG", seed: int = 0) -> SyntheticSheet:
+    """
+    Draw one sheet. `rotate` is degrees, `noise` the std-dev of Gaussian pixel noise, `faint`
+    the share of marks drawn in light pencil, `partial` the share of marks filling only the
+    lower 78-92% of the bubble, `stray` the share of empty bubbles with a small smudge (< 20%)
+    that must not be read as a mark.
+    """
+    tpl = get_template(template)
+    rng = np.random.default_rng(seed)
+    masks = np.asarray(masks, dtype=np.uint8)
+    img = Image.new("L", (width, height), PAPER)
+    d = ImageDraw.Draw(img)
+    x0, y0, x1, y1 = margin * width, margin * height, (1 - margin) * width, (1 - margin) * height
+    d.rectangle([x0, y0, x1, y1], outline=0, width=max(int(0.006 * width), 2))
+    fw, fh = x1 - x0, y1 - y0
+    r = tpl.bubble_r * fw
+    marked = (masks[:, None] >> np.arange(tpl.options)) & 1 == 1
+    is_partial = marked & (rng.random(marked.shape) < partial)
+    is_faint = marked & (rng.random(marked.shape) < faint)
+    is_stray = ~marked & (rng.random(marked.shape) < stray)
+    for q in range(tpl.questions):
+        for o in range(tpl.options):
+            cx, cy = x0 + tpl.bubble_u[q, o] * fw, y0 + tpl.bubble_v[q, o] * fh
+            box = [cx - r, cy - r, cx + r, cy + r]
+            d.ellipse(box, outline=OUTLINE, width=2)
+            if marked[q, o]:
+                ink = int(rng.integers(70, 100)) if is_faint[q, o] else INK
+                if is_partial[q, o]:
+                    # fill only the lower part of the bubble, like a hurried pencil stroke
+                    bx, by, size = int(cx - r), int(cy - r), int(2 * r) + 2
+                    layer = Image.new("L", (size, size), 0)
+                    ImageDraw.Draw(layer).ellipse([cx - r - bx, cy - r - by, cx + r - bx, cy + r - by], fill=255)
+                    layer.paste(0, (0, 0, size, int(size * (1 - rng.uniform(0.78, 0.92)))))
+                    img.paste(ink, (bx, by, bx + size, by + size), mask=layer)
+                else:
+                    d.ellipse(box, fill=ink, outline=OUTLINE, width=2)
+            elif is_stray[q, o]:
+                s = r * 0.35
+                d.ellipse([cx - s, cy - s, cx + s, cy + s], fill=INK)
+    if rotate:
+        img = img.rotate(rotate, fillcolor=PAPER, resample=Image.BILINEAR)
+    if noise:
+        a = np.asarray(img, dtype=np.float32) + noise * rng.standard_normal((height, width), dtype=np.float32)
+        img = Image.fromarray(np.clip(a, 0, 255).astype(np.uint8))
+    buf = io.BytesIO()
+    img.save(buf, fmt, quality=quality) if fmt == "JPEG" else img.save(buf, fmt)
+    return SyntheticSheet(buf.getvalue(), masks, is_partial)
+
+
+def make_batch(n: int, template=None, seed: int = 0, rotate: float = 0.0, **kw) -> List[SyntheticSheet]:
+    """n sheets with random answers; rotation is drawn uniformly from [-rotate, rotate]."""
+    tpl = get_template(template)
+    rng = np.random.default_rng(seed)
+    return [render(random_masks(tpl.questions, tpl.options, rng), template=tpl.name,
+                   rotate=float(rng.uniform(-rotate, rotate)) if rotate else 0.0, seed=seed * 100003 + i, **kw)
+            for i in range(n)]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--n", type=int, default=10)
+    ap.add_argument("--template", default=None)
+    ap.add_argument("--rotate", type=float, default=1.0)
+    ap.add_argument("--noise", type=float, default=6.0)
+    ap.add_argument("--partial", type=float, default=0.1)
+    ap.add_argument("--faint", type=float, default=0.1)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    tpl = get_template(args.template)
+    os.makedirs(args.out, exist_ok=True)
+    key = random_masks(tpl.questions, tpl.options, np.random.default_rng(args.seed + 1), blank=0, multi=0.02)
+    truth = {"template": tpl.name, "key": {q + 1: mask_to_str(m) for q, m in enumerate(key.tolist())}, "sheets": {}}
+    for i, sheet in enumerate(make_batch(args.n, tpl.name, args.seed, rotate=args.rotate, noise=args.noise,
+                                         partial=args.partial, faint=args.faint)):
+        name = f"sheet_{i:03d}.jpg"
+        with open(os.path.join(args.out, name), "wb") as fh:
+            fh.write(sheet.image)
+        truth["sheets"][name] = {q + 1: mask_to_str(m) for q, m in enumerate(sheet.masks.tolist())}
+    with open(os.path.join(args.out, "truth.json"), "w") as fh:
+        json.dump(truth, fh, indent=1)
+    print(f"wrote {args.n} sheets to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
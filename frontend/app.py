@@ -1,12 +1,64 @@
 
 import streamlit as st
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json, os
 import pandas as pd
 
-API_BASE = "http://127.0.0.1:8000/api"
+API_BASE = os.environ.get("OMR_API_BASE", "http://127.0.0.1:8000/api")
+# the API as users' browsers reach it; when unset, exports are downloaded through this server
+PUBLIC_API_BASE = os.environ.get("OMR_PUBLIC_API_BASE", "").rstrip("/")
+EVAL_WORKERS = int(os.environ.get("OMR_FRONTEND_WORKERS", 8))   # concurrent evaluate_student uploads
 st.set_page_config(page_title="OMR Evaluator", layout="wide")
 
+
+# ----- HTTP -----
+@st.cache_resource
+def http() -> requests.Session:
+    """One keep-alive session per process, with a connection per upload worker."""
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=EVAL_WORKERS))
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=EVAL_WORKERS))
+    return session
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def fetch_batches(college_id):
+    resp = http().get(f"{API_BASE}/batches/{college_id}")
+    return resp.json() if resp.status_code == 200 else []
+
+
+@st.cache_data(ttl=600, show_spinner=False)
+def fetch_templates():
+    resp = http().get(f"{API_BASE}/templates")
+    return resp.json() if resp.status_code == 200 else []
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def fetch_results(batch_id):
+    """Score table of a batch; the summary view never reads per-question data on the server."""
+    resp = http().get(f"{API_BASE}/batches/{batch_id}/final_results", params={"view": "summary"})
+    return resp.json() if resp.status_code == 200 else []
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def fetch_export(batch_id, answers: bool) -> bytes:
+    """The batch's CSV export, read from the streaming endpoint in chunks."""
+    buf = bytearray()
+    with http().get(f"{API_BASE}/batches/{batch_id}/final_results/export",
+                    params={"format": "csv", "answers": str(answers).lower()}, stream=True) as resp:
+        resp.raise_for_status()
+        for chunk in resp.iter_content(chunk_size=1 << 16):
+            buf += chunk
+    return bytes(buf)
+
+
+def evaluate_one(meta, upload):
+    """Runs on a worker thread: HTTP only, no Streamlit calls."""
+    resp = http().post(f"{API_BASE}/evaluate_student", files={"file": upload}, data={"student_meta": json.dumps(meta)})
+    return resp.status_code, resp.json()["evaluated_result"] if resp.status_code == 200 else resp.text
+
 # ----- SESSION STATE -----
 if "college" not in st.session_state:
     st.session_state.college = None
@@ -16,8 +68,6 @@ if "batch_id" not in st.session_state:
     st.session_state.batch_id = None
 if "official_set" not in st.session_state:
     st.session_state.official_set = False
-if "current_batch_results" not in st.session_state:
-    st.session_state.current_batch_results = []
 if "students_list" not in st.session_state:
     st.session_state.students_list = [{"sid": "", "sname": "", "omr_file": None}]
 
@@ -38,7 +88,7 @@ if menu == "Signup":
         password = st.text_input("Password", type="password")
         submitted = st.form_submit_button("Signup")
         if submitted:
-            resp = requests.post(f"{API_BASE}/signup", data={"name": cname, "email": email, "password": password})
+            resp = http().post(f"{API_BASE}/signup", data={"name": cname, "email": email, "password": password})
             if resp.status_code == 200:
                 st.success("Signup successful. Please log in from the left sidebar.")
             else:
@@ -53,7 +103,7 @@ elif menu == "Login":
         password = st.text_input("Password", type="password")
         submitted = st.form_submit_button("Login")
         if submitted:
-            resp = requests.post(f"{API_BASE}/login", data={"email": email, "password": password})
+            resp = http().post(f"{API_BASE}/login", data={"email": email, "password": password})
             if resp.status_code == 200:
                 st.session_state.college = resp.json()
                 st.rerun()
@@ -68,9 +118,7 @@ elif menu == "Dashboard":
     st.subheader("Batch Management")
     st.markdown("**Instructions:** Select an existing batch from the dropdown below, or create a new batch if none exist.")
 
-    batch_resp = requests.get(f"{API_BASE}/batches/{college_id}")
-    if batch_resp.status_code == 200:
-        st.session_state.batches = batch_resp.json()
+    st.session_state.batches = fetch_batches(college_id)
 
     batch_names = [b["name"] for b in st.session_state.batches]
     selected_batch = st.selectbox("Select Batch", batch_names)
@@ -80,12 +128,17 @@ elif menu == "Dashboard":
 
     with st.expander("Create New Batch"):
         st.markdown("Fill the batch name below and click **Create Batch** to add a new batch for this college.")
+        templates = fetch_templates()
         with st.form("create_batch_form"):
             batch_name = st.text_input("Batch Name")
+            template = st.selectbox("Sheet Template", [t["name"] for t in templates],
+                                    format_func=lambda n: next((f"{n} — {t['description']}" for t in templates if t["name"] == n), n))
             submit_batch = st.form_submit_button("Create Batch")
             if submit_batch:
-                resp = requests.post(f"{API_BASE}/batches", data={"college_id": college_id, "name": batch_name})
+                resp = http().post(f"{API_BASE}/batches", data={"college_id": college_id, "name": batch_name,
+                                                                "template": template})
                 if resp.status_code == 200:
+                    fetch_batches.clear()
                     st.success("Batch created successfully. It will now appear in the dropdown above.")
                     st.rerun()
                 else:
@@ -93,25 +146,31 @@ elif menu == "Dashboard":
 
     # ----- OFFICIAL ANSWER KEY -----
     st.subheader("Upload Official Answer Key")
-    st.markdown("**Instructions:** Upload the official answer key for this batch in either XLSX or JSON format. "
-                "The system will automatically normalize and display all 100 questions, filling blanks if missing.")
+    st.markdown("**Instructions:** Upload the official answer key for this batch in XLSX, CSV or JSON format. "
+                "The system will automatically normalize and display every question of the batch's sheet template, filling blanks if missing.")
 
-    official_file = st.file_uploader("Choose Answer Key File", type=["xlsx", "json"])
+    official_file = st.file_uploader("Choose Answer Key File", type=["xlsx", "csv", "json"])
     if st.button("Upload Official Key"):
         if st.session_state.batch_id and official_file:
-            resp = requests.post(
+            resp = http().post(
                 f"{API_BASE}/batches/{st.session_state.batch_id}/official_result",
                 files={"file": (official_file.name, official_file.getvalue(), official_file.type)},
             )
             if resp.status_code == 200:
                 st.session_state.official_set = True
+                fetch_results.clear()   # the server re-scores the batch against the new key
+                fetch_export.clear()
                 st.success("Official answer key uploaded successfully.")
+                if resp.json().get("malformed_count"):
+                    st.warning(f"{resp.json()['malformed_count']} cell(s) could not be read and were skipped.")
+                    st.dataframe(pd.DataFrame(resp.json()["malformed"]), use_container_width=True)
                 key_dict = resp.json()["answer_key"]
 
                 key_dict = {int(k): v for k, v in key_dict.items()}
+                questions = sorted(key_dict)
                 df_key = pd.DataFrame({
-                    "Question": range(1, 101),
-                    "Answer": [key_dict.get(q, "") for q in range(1, 101)]
+                    "Question": questions,
+                    "Answer": [key_dict[q] for q in questions]
                 })
 
                 st.dataframe(df_key, use_container_width=True)
@@ -120,6 +179,31 @@ elif menu == "Dashboard":
         else:
             st.warning("Please select a batch before uploading an answer key.")
 
+    # ----- STUDENT ROSTER -----
+    st.subheader("Import Student Roster")
+    st.markdown("**Instructions:** Upload a CSV or XLSX with student IDs in the first column and names in the second "
+                "(a header row is optional). Once a roster is imported, only students on it can be evaluated in this batch.")
+
+    roster_file = st.file_uploader("Choose Roster File", type=["xlsx", "csv"])
+    if st.button("Import Roster"):
+        if st.session_state.batch_id and roster_file:
+            resp = http().post(
+                f"{API_BASE}/batches/{st.session_state.batch_id}/roster",
+                files={"file": (roster_file.name, roster_file.getvalue(), roster_file.type)},
+            )
+            if resp.status_code == 200:
+                data = resp.json()
+                fetch_results.clear()   # names on existing results may have changed
+                fetch_export.clear()
+                st.success(f"Roster imported: {data['created']} new, {data['updated']} renamed, {data['students']} in file.")
+                if data.get("malformed_count"):
+                    st.warning(f"{data['malformed_count']} row(s) were skipped or overridden.")
+                    st.dataframe(pd.DataFrame(data["malformed"]), use_container_width=True)
+            else:
+                st.error(resp.text)
+        else:
+            st.warning("Please select a batch before importing a roster.")
+
     # ----- STUDENT EVALUATION -----
     st.subheader("Student OMR Evaluation")
     st.markdown("**Instructions:** Add student details and upload their OMR sheet image. "
@@ -148,30 +232,38 @@ elif menu == "Dashboard":
         if not st.session_state.batch_id:
             st.warning("Please select a batch before evaluation.")
         else:
-            results_list = []
-            for student in st.session_state.students_list:
-                if not student["sid"] or not student["omr_file"]:
-                    st.warning(f"Skipping student with missing ID or OMR file.")
-                    continue
-                meta = {
-                    "student_id": student["sid"],
-                    "name": student["sname"],
-                    "college_id": st.session_state.college["id"],
-                    "batch_id": st.session_state.batch_id
-                }
-                files = {"file": (student["omr_file"].name, student["omr_file"].getvalue(), student["omr_file"].type)}
-                data = {"student_meta": json.dumps(meta)}
-
-                resp = requests.post(f"{API_BASE}/evaluate_student", files=files, data=data)
-
-                if resp.status_code == 200:
-                    result = resp.json()["evaluated_result"]
-                    st.success(f"Result stored for {student['sname'] or student['sid']}")
-                    results_list.append(result)
-                else:
-                    st.error(f"Failed to evaluate student {student['sid']}: {resp.text}")
-
+            todo = [s for s in st.session_state.students_list if s["sid"] and s["omr_file"]]
+            if len(todo) < len(st.session_state.students_list):
+                st.warning(f"Skipping {len(st.session_state.students_list) - len(todo)} student(s) with missing ID or OMR file.")
+
+            # uploads run in parallel over pooled connections; progress and messages stay on this thread
+            results_list, failures = [], []
+            progress = st.progress(0.0, text="Evaluating...")
+            with ThreadPoolExecutor(max_workers=EVAL_WORKERS) as ex:
+                futures = {ex.submit(evaluate_one,
+                                     {"student_id": s["sid"], "name": s["sname"], "college_id": college_id,
+                                      "batch_id": st.session_state.batch_id},
+                                     (s["omr_file"].name, s["omr_file"].getvalue(), s["omr_file"].type)): s
+                           for s in todo}
+                for done, fut in enumerate(as_completed(futures), 1):
+                    student = futures[fut]
+                    try:
+                        status, body = fut.result()
+                    except requests.RequestException as e:
+                        status, body = None, str(e)
+                    if status == 200:
+                        results_list.append(body)
+                    else:
+                        failures.append((student["sid"], body))
+                    progress.progress(done / len(todo), text=f"Evaluated {done} of {len(todo)}")
+            progress.empty()
+
+            for sid, error in failures:
+                st.error(f"Failed to evaluate student {sid}: {error}")
             if results_list:
+                st.success(f"Results stored for {len(results_list)} student(s).")
+                fetch_results.clear()
+                fetch_export.clear()
                 df_all = pd.DataFrame([
                     {"Student ID": r["student_id"], "Name": r["name"], "Score": r["score"], "Total": r["total"]}
                     for r in results_list
@@ -180,23 +272,30 @@ elif menu == "Dashboard":
                 st.markdown("The table below shows the scores of all students evaluated in this batch.")
                 st.dataframe(df_all, use_container_width=True)
 
-                batch_resp = requests.get(f"{API_BASE}/batches/{st.session_state.batch_id}/final_results")
-                if batch_resp.status_code == 200:
-                    st.session_state.current_batch_results = batch_resp.json()
-                    st.success("Batch results updated successfully.")
-
     # ----- VIEW BATCH RESULTS -----
     st.subheader("Batch Results")
     st.markdown("**Instructions:** View or download the evaluation results for this batch.")
 
     if st.session_state.batch_id:
-        if st.session_state.current_batch_results:
-            results_df = pd.DataFrame(st.session_state.current_batch_results)
-            results_df = results_df.drop(columns=["answers"])
-            st.dataframe(results_df, use_container_width=True)
-
-            csv = results_df.to_csv(index=False).encode("utf-8")
-            st.download_button("Download Results as CSV", data=csv, file_name="batch_results.csv", mime="text/csv")
+        batch_results = fetch_results(st.session_state.batch_id)
+        if batch_results:
+            st.dataframe(pd.DataFrame(batch_results), use_container_width=True)
+
+        downloads = [("Download Results as CSV", False, "batch_results.csv"),
+                     ("Download Results with Answers (CSV)", True, "batch_results_answers.csv")]
+        if PUBLIC_API_BASE:
+            # the server streams the export, so the browser downloads it straight to disk
+            export_url = f"{PUBLIC_API_BASE}/batches/{st.session_state.batch_id}/final_results/export?format=csv"
+            for label, answers, _ in downloads:
+                st.link_button(label, export_url + ("&answers=true" if answers else ""))
+        else:
+            for label, answers, file_name in downloads:
+                try:
+                    data = fetch_export(st.session_state.batch_id, answers)
+                except requests.RequestException as e:
+                    st.error(f"Export failed: {e}")
+                    continue
+                st.download_button(label, data=data, file_name=file_name, mime="text/csv")
 
 elif menu == "Logout":
     st.session_state.clear()
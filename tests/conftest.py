@@ -0,0 +1,74 @@
+"""
+Shared fixtures: the API against a throwaway database, detection cache and scan store,
+and a fresh college + batch + answer key per test.
+"""
+import os, tempfile
+
+# isolate every bit of state before the API modules read their settings
+_TMP = tempfile.mkdtemp(prefix="omr-test-")
+os.environ["OMR_SQLITE_URL"] = f"sqlite:///{_TMP}/test.db"
+os.environ["OMR_DETECTION_CACHE_DIR"] = os.path.join(_TMP, "detections")
+os.environ["OMR_JOB_DIR"] = os.path.join(_TMP, "jobs")
+os.environ["OMR_SCAN_DIR"] = os.path.join(_TMP, "scans")
+os.environ["OMR_OVERLAY_DIR"] = os.path.join(_TMP, "overlays")
+os.environ.setdefault("OMR_DETECT_PROCESSES", "1")
+
+import itertools, json, shutil
+import numpy as np
+import pytest
+
+_ids = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from backend.api.main import app
+    from backend.eval.pool import shutdown_pool
+    yield TestClient(app)
+    shutdown_pool()
+    shutil.rmtree(_TMP, ignore_errors=True)
+
+
+@pytest.fixture
+def upload_key(client):
+    """upload_key(batch_id, masks) stores `masks` as the batch's official key; returns the response body."""
+    from backend.eval.scoring import mask_to_str
+
+    def upload(batch_id: int, masks: np.ndarray) -> dict:
+        body = json.dumps({q + 1: mask_to_str(m) for q, m in enumerate(masks.tolist())})
+        r = client.post(f"/api/batches/{batch_id}/official_result", files={"file": ("key.json", body, "application/json")})
+        assert r.status_code == 200, r.text
+        return r.json()
+    return upload
+
+
+@pytest.fixture
+def batch(client, upload_key):
+    """A new college and batch with a random 100-question key: {"college_id", "batch_id", "key"}."""
+    from benchmarks.synth import random_masks
+    n = next(_ids)
+    cid = client.post("/api/signup", data={"name": f"college {n}", "email": f"c{n}@example.com",
+                                           "password": "x"}).json()["id"]
+    bid = client.post("/api/batches", data={"college_id": cid, "name": f"batch {n}"}).json()["id"]
+    key = random_masks(100, rng=np.random.default_rng(n), blank=0)
+    upload_key(bid, key)
+    return {"college_id": cid, "batch_id": bid, "key": key}
+
+
+@pytest.fixture
+def write_sheets(batch):
+    """write_sheets({student_id: masks}, reviews=None) scores and commits selections as if read from scans."""
+    from backend.api import evaluation, schemas
+    from backend.api.db import SessionLocal
+
+    def write(selections: dict, reviews: dict = None):
+        with SessionLocal() as db:
+            key = evaluation.load_answer_key(db, batch["batch_id"])
+        metas = [schemas.StudentMeta(student_id=sid, name=f"name {sid}", college_id=batch["college_id"],
+                                     batch_id=batch["batch_id"]) for sid in selections]
+        reviews = reviews or {}
+        graded = evaluation.score_many(metas, key, np.stack(list(selections.values())), None,
+                                       [reviews.get(sid) for sid in selections])
+        evaluation.result_writer.write(graded)
+    return write
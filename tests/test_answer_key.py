@@ -0,0 +1,64 @@
+import csv, json
+import pytest
+from backend.eval.answer_key import pad_answer_key, parse_answer_key, parse_rows
+
+
+@pytest.mark.parametrize("rows, answers, errors", [
+    # one cell per entry, every separator
+    ([("1-a",), ("2: a,c",), ("3. B",), ("4) d",), (" 5 - b , d ",)],
+     {1: "a", 2: "a,c", 3: "b", 4: "d", 5: "b,d"}, []),
+    # question and answer in neighbouring cells; spreadsheet numbers arrive as floats
+    ([(1, "a"), (2.0, "B, C"), ("3", "d")], {1: "a", 2: "b,c", 3: "d"}, []),
+    # both layouts in one row, with empty cells in between
+    ([("1-a", None, 2, "b", "", "3: c")], {1: "a", 2: "b", 3: "c"}, []),
+    # several pairs side by side
+    ([(1, "a", 11, "b"), (2, "c", 12, "d")], {1: "a", 11: "b", 2: "c", 12: "d"}, []),
+    # a header row and stray cells are reported by position, entries around them still parse
+    ([("Question", "Answer"), (1, "a"), ("note", 2, "b"), ("3-?",)], {1: "a", 2: "b"},
+     [("A1", "not a question/answer entry"), ("B1", "not a question/answer entry"),
+      ("A3", "not a question/answer entry"), ("A4", "not a question/answer entry")]),
+    # question 0 is not a question
+    ([("0-a",), ("1-b",)], {1: "b"}, [("A1", "not a question/answer entry")]),
+    # a repeated question keeps the later answer and says which cell it overrides
+    ([("1-a",), (2, "b"), (None, "1: c")], {1: "c", 2: "b"}, [("B3", "duplicate question 1; overrides A1")]),
+    ([("1-a", "1-b", "1-c")], {1: "c"},
+     [("B1", "duplicate question 1; overrides A1"), ("C1", "duplicate question 1; overrides B1")]),
+    ([], {}, []),
+])
+def test_parse_rows_layouts(rows, answers, errors):
+    parsed = parse_rows(rows)
+    assert parsed.answers == answers
+    assert [(e["cell"], e["error"]) for e in parsed.errors] == errors
+
+
+def test_columns_past_z_are_named_like_spreadsheets():
+    row = [None] * 27 + ["x"]
+    assert parse_rows([row]).errors[0]["cell"] == "AB1"
+
+
+@pytest.mark.parametrize("fmt", ["csv", "xlsx", "json"])
+def test_parse_answer_key_file_formats(tmp_path, fmt):
+    path = tmp_path / f"key.{fmt}"
+    rows = [("Q", "Ans"), (1, "a"), ("2-b,d", None), (3, "C")]
+    if fmt == "csv":
+        with open(path, "w", newline="") as fh:
+            csv.writer(fh).writerows(rows)
+    elif fmt == "xlsx":
+        from openpyxl import Workbook
+        wb = Workbook()
+        for row in rows:
+            wb.active.append(row)
+        wb.save(path)
+    else:
+        path.write_text(json.dumps({"1": "a", "2": "b,d", "3": "C"}))
+    parsed = parse_answer_key(str(path), path.name)
+    assert parsed.answers == {1: "a", 2: "b,d", 3: "c"}
+    assert [e["cell"] for e in parsed.errors] == ([] if fmt == "json" else ["A1", "B1"])
+    with open(path, "rb") as fh:   # binary file objects work too
+        assert parse_answer_key(fh, path.name).answers == parsed.answers
+
+
+def test_unsupported_format_and_padding():
+    with pytest.raises(ValueError, match="unsupported"):
+        parse_answer_key("key.txt", "key.txt")
+    assert pad_answer_key({3: "a", 1: "b"}, 4) == {1: "b", 2: "", 3: "a", 4: ""}
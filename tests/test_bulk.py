@@ -0,0 +1,79 @@
+import io, json, zipfile
+import pytest
+from benchmarks.synth import make_batch
+from backend.api import routes
+from backend.api.uploads import inflight
+
+
+def _bulk(client, batch, files):
+    r = client.post(f"/api/batches/{batch['batch_id']}/evaluate_bulk", data={"college_id": batch["college_id"]},
+                    files=[("files", f) for f in files])
+    assert r.status_code == 200, r.text
+    return [json.loads(line) for line in r.text.strip().splitlines()]
+
+
+def _zip(members: dict) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+
+@pytest.fixture
+def sheets():
+    return [s.image for s in make_batch(3, seed=11)]
+
+
+def test_oversized_zip_member_is_reported_as_too_large(client, batch, sheets, monkeypatch):
+    monkeypatch.setattr(routes, "MAX_UPLOAD_BYTES", 1 << 20)
+    archive = _zip({"a.jpg": sheets[0], "b.jpg": sheets[1], "huge.jpg": bytes(2 << 20)})
+    lines = _bulk(client, batch, [("sheets.zip", archive, "application/zip")])
+    by_file = {l["file"]: l for l in lines if "file" in l}
+    assert by_file["a.jpg"]["status"] == by_file["b.jpg"]["status"] == "ok"
+    assert by_file["huge.jpg"]["status"] == "error" and "exceeds" in by_file["huge.jpg"]["error"]
+    assert lines[-1] == {"done": True, "evaluated": 2, "failed": 1}
+    assert inflight.in_use == 0
+
+
+def test_bulk_chunks_wait_for_decode_memory(client, batch, sheets, monkeypatch):
+    # a budget smaller than one chunk: chunks run one at a time instead of piling up
+    monkeypatch.setattr(routes, "BULK_CHUNK", 1)
+    monkeypatch.setattr(inflight, "limit", 1)
+    peak = []
+    acquire = inflight.try_acquire
+    monkeypatch.setattr(inflight, "try_acquire", lambda n: peak.append(inflight.in_use) or acquire(n))
+    files = [(f"{i}.jpg", b + bytes([i]), "image/jpeg") for i, b in enumerate(sheets)]
+    lines = _bulk(client, batch, files)
+    assert lines[-1] == {"done": True, "evaluated": 3, "failed": 0}
+    assert max(peak) <= 1 and inflight.in_use == 0
+
+
+def test_bad_archive_does_not_stop_other_sheets(client, batch, sheets):
+    files = [("s1.jpg", sheets[0], "image/jpeg"), ("bad.jpg", b"not an image", "image/jpeg"),
+             ("s3.png", sheets[2], "image/png"), ("x.zip", b"not a zip", "application/zip")]
+    lines = _bulk(client, batch, files)
+    by_file = {l["file"]: l for l in lines if "file" in l}
+    assert by_file["s1.jpg"]["status"] == by_file["s3.png"]["status"] == "ok"
+    assert by_file["bad.jpg"]["status"] == "error" and "/" not in by_file["bad.jpg"]["error"]
+    assert by_file["x.zip"]["status"] == "error" and "zip" in by_file["x.zip"]["error"]
+    assert lines[-1] == {"done": True, "evaluated": 2, "failed": 2}
+
+
+def _die(images, template=None):
+    import os
+    os._exit(1)
+
+
+def test_killed_pool_worker_fails_its_chunk_not_the_stream(client, batch, sheets, monkeypatch):
+    monkeypatch.setattr(routes, "detect_chunk", _die)
+    files = [(f"{i}.jpg", b + b"killed", "image/jpeg") for i, b in enumerate(sheets)]
+    lines = _bulk(client, batch, files)
+    assert [l["status"] for l in lines[:-1]] == ["error"] * 3
+    assert lines[-1] == {"done": True, "evaluated": 0, "failed": 3}
+    assert inflight.in_use == 0
+
+    # the next request gets a fresh pool
+    monkeypatch.undo()
+    lines = _bulk(client, batch, [("again.jpg", sheets[0] + b"again", "image/jpeg")])
+    assert lines[-1] == {"done": True, "evaluated": 1, "failed": 0}
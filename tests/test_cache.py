@@ -0,0 +1,15 @@
+import os
+from backend.api.cache import DetectionCache
+
+
+def test_detection_cache_disk_tier_is_shared_and_keeps_its_layout(tmp_path):
+    first = DetectionCache(str(tmp_path), maxsize=4)
+    sha = first.digest(b"sheet")
+    first.put(sha, "std-100x4", b"\x01\x02")
+    assert os.path.exists(tmp_path / "v2" / "std-100x4" / sha[:2] / f"{sha}.bin")
+
+    # another process (a fresh cache) finds it on disk, under the same template only
+    other = DetectionCache(str(tmp_path), maxsize=4)
+    assert other.get(sha, "std-100x4") == b"\x01\x02" and other.disk_hits == 1
+    assert other.get(sha, "std-50x4") is None
+    assert not [f for _, _, files in os.walk(tmp_path) for f in files if not f.endswith(".bin")]
@@ -0,0 +1,44 @@
+import csv, io
+import numpy as np
+import pytest
+from benchmarks.synth import random_masks
+from backend.eval.scoring import LABELS
+
+
+@pytest.fixture
+def exported_batch(batch, write_sheets):
+    rng = np.random.default_rng(0)
+    selections = {"s1": random_masks(100, rng=rng), "s2": random_masks(100, rng=rng)}
+    write_sheets(selections, reviews={"s2": {"reasons": ["frame not found"]}})
+    return dict(batch, selections=selections)
+
+
+@pytest.mark.parametrize("answers", [False, True])
+def test_csv_rows_match_header(client, exported_batch, answers):
+    r = client.get(f"/api/batches/{exported_batch['batch_id']}/final_results/export", params={"answers": answers})
+    assert r.status_code == 200
+    header, *rows = list(csv.reader(io.StringIO(r.text)))
+    assert len(header) == (106 if answers else 6)
+    assert len(rows) == 2 and all(len(row) == len(header) for row in rows)
+    by_id = {row[0]: dict(zip(header, row)) for row in rows}
+    assert by_id["s1"]["needs_review"] == "False" and by_id["s2"]["needs_review"] == "True"
+    assert by_id["s1"]["total"] == "100"
+    if answers:
+        for sid, masks in exported_batch["selections"].items():
+            assert [by_id[sid][f"q{i + 1}"] for i in range(100)] == [LABELS[m] for m in masks.tolist()]
+
+
+@pytest.mark.parametrize("answers", [False, True])
+def test_parquet_rows_match_header(client, exported_batch, answers):
+    pq = pytest.importorskip("pyarrow.parquet")
+    r = client.get(f"/api/batches/{exported_batch['batch_id']}/final_results/export",
+                   params={"format": "parquet", "answers": answers})
+    assert r.status_code == 200
+    table = pq.read_table(io.BytesIO(r.content))
+    assert table.num_columns == (106 if answers else 6) and table.num_rows == 2
+    assert sorted(table.column("needs_review").to_pylist()) == [False, True]
+
+
+def test_summary_view_matches_export_columns(client, exported_batch):
+    rows = client.get(f"/api/batches/{exported_batch['batch_id']}/final_results", params={"view": "summary"}).json()
+    assert {r["student_id"]: r["needs_review"] for r in rows} == {"s1": False, "s2": True}
@@ -0,0 +1,40 @@
+import json
+from benchmarks.synth import make_batch
+from backend.api import db as db_module, evaluation, jobs, models
+from backend.api.db import SessionLocal, WriteSession
+
+
+def test_async_evaluation_survives_a_write_between_its_read_and_enqueue(client, batch, monkeypatch):
+    check = evaluation.check_student
+
+    def check_then_concurrent_write(db, meta):
+        db.query(models.Batch).filter(models.Batch.id == meta.batch_id).count()   # the request's read transaction
+        with WriteSession() as other:   # e.g. the result writer committing meanwhile
+            other.query(models.Batch).filter(models.Batch.id == meta.batch_id).update({models.Batch.name: "renamed"})
+            other.commit()
+        return check(db, meta)
+    monkeypatch.setattr(evaluation, "check_student", check_then_concurrent_write)
+
+    meta = {"student_id": "j1", "college_id": batch["college_id"], "batch_id": batch["batch_id"]}
+    sheet = make_batch(1, seed=5)[0]
+    r = client.post("/api/evaluate_student", data={"student_meta": json.dumps(meta), "mode": "async"},
+                    files={"file": ("j1.jpg", sheet.image, "image/jpeg")})
+    assert r.status_code == 202, r.text
+    job_id = r.json()["id"]
+
+    assert jobs.claim("test") == job_id
+    with WriteSession() as db:
+        jobs.run_job(db, db.get(models.EvalJob, job_id))
+    status = client.get(f"/api/jobs/{job_id}").json()
+    assert status["status"] == "done" and status["result"]["student_id"] == "j1"
+
+
+def test_idle_claim_does_not_take_the_write_lock(client, monkeypatch):
+    while jobs.claim("drain") is not None:   # leave nothing runnable
+        pass
+    immediate = []
+    monkeypatch.setattr(db_module.db_stats, "record_lock_wait", immediate.append)
+    assert jobs.claim("idle") is None
+    assert immediate == []
+    with SessionLocal() as db:
+        assert jobs.queue_depth(db)["queued"] == 0
@@ -0,0 +1,71 @@
+"""upgrade() against the baseline schema, starting from a copy of the shipped omrrr.db."""
+import json, os, shutil, sqlite3
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, inspect
+from backend.api.migrations import upgrade
+from backend.eval.scoring import compile_answer_key
+
+BASELINE_DB = os.path.join(os.path.dirname(__file__), os.pardir, "omrrr.db")
+
+
+def _rows(path, sql):
+    with sqlite3.connect(path) as conn:
+        return conn.execute(sql).fetchall()
+
+
+@pytest.fixture
+def legacy(tmp_path):
+    """The shipped database plus the legacy cases it lacks: a re-evaluated student, an
+    unreadable result blob and a student that belongs to no batch."""
+    path = str(tmp_path / "legacy.db")
+    shutil.copyfile(BASELINE_DB, path)
+    with sqlite3.connect(path) as conn:
+        (blob,) = conn.execute("SELECT aggregated_json FROM final_results WHERE id = 1").fetchone()
+        again = json.loads(blob)
+        again["score"] = 17
+        conn.execute("INSERT INTO final_results (id, college_id, batch_id, aggregated_json) VALUES (2, 1, 1, ?)",
+                     (json.dumps(again),))
+        conn.execute("INSERT INTO final_results (id, college_id, batch_id, aggregated_json) VALUES (3, 1, 1, 'oops')")
+        conn.execute("INSERT INTO students (student_id, name, college_id, batch_id) VALUES ('loose', 'x', 1, NULL)")
+    engine = create_engine(f"sqlite:///{path}")
+    yield path, engine
+    engine.dispose()
+
+
+def test_upgrade_from_baseline_schema(legacy):
+    path, engine = legacy
+    (raw,) = _rows(path, "SELECT raw_json FROM results")[0]
+    upgrade(engine)
+
+    insp = inspect(engine)
+    assert insp.get_pk_constraint("students")["constrained_columns"] == ["batch_id", "student_id"]
+    assert not insp.has_table("students_old")
+    assert _rows(path, "SELECT batch_id, student_id, name FROM students") == [(1, "2VX23CB046", "sanj")]
+    # the point of the new key: the same roll number in another batch
+    with sqlite3.connect(path) as conn:
+        conn.execute("INSERT INTO batches (id, name, college_id) VALUES (2, 'next', 1)")
+        conn.execute("INSERT INTO students (student_id, name, college_id, batch_id) VALUES ('2VX23CB046', 'sanj', 1, 2)")
+
+    (masks,) = _rows(path, "SELECT key_masks FROM results")[0]
+    assert masks == compile_answer_key(json.loads(raw)).masks.tobytes()
+
+    # the re-evaluation (latest row) is kept and unpacked; unreadable blobs are left as they were
+    rows = _rows(path, "SELECT id, student_id, score, total, answers, aggregated_json FROM final_results ORDER BY id")
+    (rid, sid, score, total, answers, blob), bad = rows
+    assert (rid, sid, score, total, blob) == (2, "2VX23CB046", 17, 100, None)
+    assert len(answers) == 100 and np.frombuffer(answers, np.uint8)[0] == 0   # question 1 "Not Attempted"
+    assert bad[0] == 3 and bad[4] is None and bad[5] == "oops"
+    assert "uix_final_results_batch_student" in {ix["name"] for ix in insp.get_indexes("final_results")}
+    assert {"batch_stats", "eval_jobs"} <= set(insp.get_table_names())
+
+
+def test_upgrade_is_idempotent(legacy):
+    path, engine = legacy
+    upgrade(engine)
+    tables = [t for (t,) in _rows(path, "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")]
+    before = {t: _rows(path, f"SELECT * FROM {t}") for t in tables}
+    schema = _rows(path, "SELECT sql FROM sqlite_master ORDER BY name")
+    upgrade(engine)
+    assert {t: _rows(path, f"SELECT * FROM {t}") for t in tables} == before
+    assert _rows(path, "SELECT sql FROM sqlite_master ORDER BY name") == schema
@@ -0,0 +1,25 @@
+import json
+from benchmarks.synth import make_batch
+
+
+def _evaluate(client, batch, sid, image):
+    meta = {"student_id": sid, "college_id": batch["college_id"], "batch_id": batch["batch_id"]}
+    r = client.post("/api/evaluate_student", files={"file": (f"{sid}.jpg", image, "image/jpeg")},
+                    data={"student_meta": json.dumps(meta)})
+    assert r.status_code == 200, r.text
+    return r.json()["evaluated_result"]
+
+
+def test_overlay_revalidates_when_a_student_is_re_evaluated(client, batch):
+    first, second = make_batch(2, seed=21)
+    url = _evaluate(client, batch, "o1", first.image)["overlay_url"]
+    r1 = client.get(url)
+    assert r1.status_code == 200 and r1.headers["content-type"] == "image/jpeg"
+    assert "immutable" not in r1.headers["cache-control"] and "no-cache" in r1.headers["cache-control"]
+    assert client.get(url, headers={"If-None-Match": r1.headers["etag"]}).status_code == 304
+
+    # same student, new scan: same URL, new content, and the old ETag no longer matches
+    assert _evaluate(client, batch, "o1", second.image)["overlay_url"] == url
+    r2 = client.get(url, headers={"If-None-Match": r1.headers["etag"]})
+    assert r2.status_code == 200 and r2.headers["etag"] != r1.headers["etag"]
+    assert r2.content != r1.content
@@ -0,0 +1,76 @@
+import csv, os, sqlite3
+import pytest
+from backend.api import routes
+from backend.eval.roster import parse_roster
+
+
+def _csv(rows) -> bytes:
+    return "\n".join(",".join(r) for r in rows).encode()
+
+
+def test_roster_is_parsed_before_the_write_lock_is_taken(client, batch, monkeypatch):
+    parse = routes.parse_roster
+
+    def parse_while_probing_the_lock(path, filename):
+        # another writer must still get SQLite's write lock while the upload is parsed
+        conn = sqlite3.connect(os.environ["OMR_SQLITE_URL"].removeprefix("sqlite:///"), timeout=0)
+        conn.isolation_level = None
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("ROLLBACK")
+        finally:
+            conn.close()
+        return parse(path, filename)
+    monkeypatch.setattr(routes, "parse_roster", parse_while_probing_the_lock)
+
+    r = client.post(f"/api/batches/{batch['batch_id']}/roster",
+                    files={"file": ("roster.csv", _csv([("student_id", "name"), ("r1", "Ann"), ("r2", "Bo")]), "text/csv")})
+    assert r.status_code == 200, r.text
+    assert (r.json()["students"], r.json()["created"]) == (2, 2)
+
+
+def test_roster_for_unknown_batch_is_404(client):
+    r = client.post("/api/batches/999999/roster", files={"file": ("roster.csv", _csv([("r1", "Ann")]), "text/csv")})
+    assert r.status_code == 404
+
+
+@pytest.mark.parametrize("rows, students, errors", [
+    # no header: id in the first column, name in the second
+    ([("r1", "Ann"), ("r2", "Bo")], {"r1": "Ann", "r2": "Bo"}, []),
+    # header row places the columns, whatever order they come in
+    ([("Name", "Roll No", "Section"), ("Ann", "r1", "A"), ("Bo", "r2", "B")], {"r1": "Ann", "r2": "Bo"}, []),
+    ([("#", "USN", "Student Name"), ("1", "r1", "Ann")], {"r1": "Ann"}, []),
+    # an id header without a name column gives blank names
+    ([("student_id",), ("r1",), ("r2",)], {"r1": "", "r2": ""}, []),
+    # the header is the first non-blank row; later header-like rows are data
+    ([("", ""), ("ID", "name"), ("id", "x")], {"id": "x"}, []),
+    # blank rows are skipped, short rows have no name
+    ([(1001, "Ann"), (None, None), (1002, None), ("r3",)], {"1001": "Ann", "1002": "", "r3": ""}, []),
+    # rows without an id are reported by row number; a repeated id keeps the later row
+    ([("r1", "Ann"), ("", "Nobody"), ("r1", "Anna")], {"r1": "Anna"},
+     [(2, "missing student id"), (3, "duplicate student id; the later row wins")]),
+    ([], {}, []),
+])
+def test_parse_roster_layouts(tmp_path, rows, students, errors):
+    path = tmp_path / "roster.csv"
+    with open(path, "w", newline="") as fh:
+        csv.writer(fh).writerows(rows)
+    parsed = parse_roster(str(path), path.name)
+    assert parsed.students == students and list(parsed.students) == list(students)
+    assert [(e["row"], e["error"]) for e in parsed.errors] == errors
+
+
+def test_parse_roster_xlsx_and_bom_csv(tmp_path):
+    from openpyxl import Workbook
+    wb = Workbook()
+    # spreadsheet numbers: roll number 1001, not 1001.0
+    for row in [("Student ID", "Name"), (1001.0, "Ann"), ("r2", " Bo ")]:
+        wb.active.append(row)
+    wb.save(tmp_path / "roster.xlsx")
+    assert parse_roster(str(tmp_path / "roster.xlsx"), "roster.xlsx").students == {"1001": "Ann", "r2": "Bo"}
+
+    (tmp_path / "bom.csv").write_bytes("﻿student_id,name\nr1,Ann\n".encode())
+    with open(tmp_path / "bom.csv", "rb") as fh:
+        assert parse_roster(fh, "bom.csv").students == {"r1": "Ann"}
+    with pytest.raises(ValueError, match="unsupported"):
+        parse_roster(str(tmp_path / "bom.csv"), "roster.txt")
@@ -0,0 +1,15 @@
+import pytest
+from backend.eval.scoring import OPTION_LETTERS
+from backend.eval.templates import grid_template, template_from_dict
+
+
+@pytest.mark.parametrize("options", [1, 4, len(OPTION_LETTERS)])
+def test_templates_up_to_one_bit_per_option_letter_compile(options):
+    t = grid_template("t", columns=1, rows=3, options=options).compile()
+    assert t.option_bits.tolist() == [1 << i for i in range(options)]
+
+
+@pytest.mark.parametrize("options", [0, len(OPTION_LETTERS) + 1, 9])
+def test_templates_with_options_beyond_the_mask_are_rejected(options):
+    with pytest.raises(ValueError, match="options must be"):
+        template_from_dict({"name": "wide", "grid": {"columns": 1, "rows": 3, "options": options}})
@@ -0,0 +1,9 @@
+import json
+
+
+def test_unreadable_sheet_error_does_not_leak_server_paths(client, batch):
+    meta = {"student_id": "u1", "college_id": batch["college_id"], "batch_id": batch["batch_id"]}
+    r = client.post("/api/evaluate_student", files={"file": ("scan.jpg", b"not an image", "image/jpeg")},
+                    data={"student_meta": json.dumps(meta)})
+    assert r.status_code == 400
+    assert r.json()["detail"] == "Could not decode OMR image: not a readable JPEG or PNG scan"